@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+compare the NMS modes of myGreedyNMS on saved raw outputs of the model
+
+the .npz files are saved by model_test.py with --save_raw_output True, one file
+per frame, arr_0 is the raw box locations [1,N,4] and arr_1 the raw box scores
+[1,N,q]. every NMS mode runs on every frame, the time per frame is recorded,
+and the NMSed boxes are compared with the groundtruth with
+check_performance._get_tp_fp_fn_extern, so the precision and recall could be
+weighed against the latency of each mode.
+
+usage example:
+    python3 benchmark_nms.py --raw_path /YOUR/FOLDER/leadingdetect
+    --groundtruth_path /YOUR/FOLDER/annotationfull_FOLDER.json
+    --output_thresh 0.05 --confidence_thresh 0.3
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+import myGreedyNMS
+from check_performance import _get_tp_fp_fn_extern
+
+
+def loadRawOutputs(filepath):
+    """
+    load all the .npz raw outputs under a folder
+
+    output:
+        rawdict: {filename without extension: (boxes [N,4], scores [N,q])}
+
+    """
+    rawdict={}
+    for filename in sorted(os.listdir(filepath)):
+        if not filename.endswith('.npz'):
+            continue
+        raw=np.load(os.path.join(filepath,filename))
+        rawdict[filename.split('.')[0]]=(raw['arr_0'][0],raw['arr_1'][0])
+    return rawdict
+
+def NMSedListToAnnotations(NMSed_list,im_width,im_height):
+    """
+    convert NMSed_list into annotations in VIVA format, in the same way as
+    updateAnnotationDict_Raw in model_test.py
+
+    """
+    annotations=[]
+    for i in range(len(NMSed_list)):
+        ymin,xmin,ymax,xmax=NMSed_list[i][0:4]
+        annodict={}
+        annodict['id']=i
+        annodict['x']=int(xmin*im_width)
+        annodict['y']=int(ymin*im_height)
+        annodict['width']=int((xmax-xmin)*im_width)
+        annodict['height']=int((ymax-ymin)*im_height)
+        annodict['score']=float(NMSed_list[i][4])
+        annotations.append(annodict)
+    return annotations
+
+def benchmarkNMS(rawdict,groundtruth,modes,outputthresh=0.05,IOUthresh=0.5,
+                 confidencethresh=0.3,evalIOUthresh=0.5,im_width=640,
+                 im_height=480,repeat=1):
+    """
+    run every NMS mode on every frame, record latency and performance
+
+    input:
+        rawdict: output of loadRawOutputs
+        groundtruth: groundtruth annotations in VIVA format, the keys are
+            image names, frames without groundtruth are counted for latency
+            only
+        modes: list of myGreedyNMS.NMS_MODES
+        outputthresh, IOUthresh: parameters of NMS
+        confidencethresh, evalIOUthresh: parameters of _get_tp_fp_fn_extern
+        repeat: how many times NMS runs on each frame for timing
+    output:
+        result: {mode: {'latency':{...}, 'performance':{...}}}
+
+    """
+    # match groundtruth by image name without extension
+    gtnames={imgname.split('.')[0]:imgname for imgname in groundtruth}
+
+    result={}
+    for mode in modes:
+        latency=[]
+        performance={'overall':{'tp':0, 'fp':0, 'tn':0, 'fn':0},
+                     'large':{'tp':0, 'fp':0, 'tn':0, 'fn':0},
+                     'medium':{'tp':0, 'fp':0, 'tn':0, 'fn':0},
+                     'small':{'tp':0, 'fp':0, 'tn':0, 'fn':0}}
+        for name in rawdict:
+            boxes,scores=rawdict[name]
+            starttime=time.time()
+            for i in range(repeat):
+                NMSed_list=myGreedyNMS.nonMaximumSupressionArray(boxes,scores,
+                                        clipthresh=outputthresh,
+                                        IOUthresh=IOUthresh,
+                                        mode=mode)
+            latency.append((time.time()-starttime)/repeat*1000)
+
+            if name not in gtnames:
+                continue
+            gt=groundtruth[gtnames[name]]
+            annos_detect=NMSedListToAnnotations(NMSed_list,
+                                                gt.get('width',im_width),
+                                                gt.get('height',im_height))
+            performance=_get_tp_fp_fn_extern(annos_detect,
+                                             gt['annotations'],
+                                             performance,
+                                             confidencethresh,
+                                             evalIOUthresh)
+
+        for key in performance:
+            tp=performance[key]['tp']
+            fp=performance[key]['fp']
+            fn=performance[key]['fn']
+            performance[key]['precision']=tp/(tp+fp) if tp+fp>0 else 0
+            performance[key]['recall']=tp/(tp+fn) if tp+fn>0 else 0
+
+        latency=np.array(latency)
+        result[mode]={'latency':{'mean':float(latency.mean()) if len(latency)>0 else 0.0,
+                                 'p50':float(np.percentile(latency,50)) if len(latency)>0 else 0.0,
+                                 'p95':float(np.percentile(latency,95)) if len(latency)>0 else 0.0},
+                      'performance':performance}
+        print('{} done, {} frames'.format(mode,len(latency)))
+
+    return result
+
+def printResult(result):
+    """
+    print latency and overall precision/recall of each mode in a table
+
+    """
+    print('{:<16}{:>10}{:>10}{:>10}{:>11}{:>8}{:>12}'.format(
+            'mode','mean ms','p50 ms','p95 ms','precision','recall','F1 per ms'))
+    for mode in result:
+        latency=result[mode]['latency']
+        overall=result[mode]['performance']['overall']
+        p=overall['precision']
+        r=overall['recall']
+        f1=2*p*r/(p+r) if p+r>0 else 0
+        print('{:<16}{:>10.2f}{:>10.2f}{:>10.2f}{:>11.4f}{:>8.4f}{:>12.4f}'.format(
+                mode,latency['mean'],latency['p50'],latency['p95'],p,r,
+                f1/latency['mean'] if latency['mean']>0 else 0))
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--raw_path', type=str,
+                        default='D:/Private Manager/Personal File/uOttawa/Lab works/2018 summer/Leading Vehicle/Viewnyx dataset/Part4_ACC/VNX_3652/leadingdetect',
+                        help="folder of the .npz raw outputs")
+    parser.add_argument('--groundtruth_path', type=str,
+                        default='D:/Private Manager/Personal File/uOttawa/Lab works/2018 summer/Leading Vehicle/Viewnyx dataset/Part4_ACC/VNX_3652/annotationfull_VNX_3652.json',
+                        help="groundtruth annotation in VIVA format")
+    parser.add_argument('--modes', type=str, nargs='+', default=myGreedyNMS.NMS_MODES,
+                        choices=myGreedyNMS.NMS_MODES,
+                        help="NMS modes to be compared")
+    parser.add_argument('--output_thresh', type=float, default=0.05,
+                        help='score threshold of NMS')
+    parser.add_argument('--nms_IoUthresh', type=float, default=0.5,
+                        help='IoU threshold of NMS')
+    parser.add_argument('--confidence_thresh', type=float, default=0.3,
+                        help='confidence threshold for evaluation')
+    parser.add_argument('--IoUthresh', type=float, default=0.5,
+                        help='IoU threshold for choosing positive predictions')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='how many times NMS runs on each frame for timing')
+    args = parser.parse_args()
+
+    rawdict=loadRawOutputs(args.raw_path)
+    groundtruth=json.load(open(args.groundtruth_path))
+    print('{} raw outputs loaded'.format(len(rawdict)))
+
+    result=benchmarkNMS(rawdict,groundtruth,args.modes,
+                        outputthresh=args.output_thresh,
+                        IOUthresh=args.nms_IoUthresh,
+                        confidencethresh=args.confidence_thresh,
+                        evalIOUthresh=args.IoUthresh,
+                        repeat=args.repeat)
+    printResult(result)
+
+    with open(os.path.join(args.raw_path,'nms_benchmark.json'),'w') as savefile:
+        savefile.write(json.dumps(result, sort_keys = True, indent = 4))
+
+''' End of File '''
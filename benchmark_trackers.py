@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+compare the tracker types of track_obj on annotated frame folders
+
+for each tracker type, the frames of each folder are replayed in temporal
+order. the tracker is initialized with the groundtruth leading vehicle, then
+updated for max_track frames (the same as the fixed scheduler of
+model_test.py), then initialized again. recorded for each type:
+    build: time to build a tracker (ObjTracker.refreshTracker)
+    init: time of the first update with the groundtruth box
+    update: time per tracked frame, mean/p50/p95/p99
+    drift: mean IoU against the groundtruth, by the number of frames since
+        the last init
+    lost: ratio of the updates where the tracker reports failure
+
+the frames are decoded before timing, so only the tracker is measured.
+
+usage example:
+    python3 benchmark_trackers.py --testimg_path /YOUR/TEST/FOLDER
+    --folder_only 3652 --max_track 10
+"""
+
+import os
+import json
+import time
+import argparse
+import cv2
+import numpy as np
+
+import track_obj
+import frame_pipeline
+from iou_matrix import getIoUPair
+
+
+def getLeadingBox(annotations):
+    """
+    get (x,y,width,height) of the leading vehicle, None if not annotated
+
+    """
+    for anno in annotations:
+        if anno['category']=='leading':
+            return (anno['x'],anno['y'],anno['width'],anno['height'])
+    return None
+
+def loadFolder(imagepath, groundtruth, max_frames=0):
+    """
+    decode the annotated frames of a folder in temporal order
+
+    output:
+        frames: list of (imagename, image, groundtruth box or None)
+    """
+    frames=[]
+    for imagename in frame_pipeline.sortFrames(groundtruth):
+        if max_frames>0 and len(frames)>=max_frames:
+            break
+        img=cv2.imread(os.path.join(imagepath,imagename))
+        if img is None:
+            continue
+        frames.append((imagename,img,getLeadingBox(groundtruth[imagename]['annotations'])))
+    return frames
+
+def replayTracker(objtracker, frames, max_track=10, record=None):
+    """
+    replay the frames of one folder through a tracker
+
+    input:
+        objtracker: a built track_obj.ObjTracker
+        frames: output of loadFolder
+        record: dict of lists to be extended, a new one if None
+    output:
+        record: {'build':[], 'init':[], 'update':[], 'drift':{step:[]},
+                 'lost':number of failed updates}
+    """
+    if record is None:
+        record={'build':[], 'init':[], 'update':[], 'drift':{}, 'lost':0}
+    tracking=False
+    step=0
+    for imagename,img,gtbox in frames:
+        if not tracking or step>=max_track:
+            tracking=False
+            if gtbox is None or gtbox[2]<=0 or gtbox[3]<=0:
+                continue
+            start=time.time()
+            objtracker.refreshTracker()
+            record['build'].append(time.time()-start)
+            start=time.time()
+            objtracker.updateTrack(img,init=True,bbox=gtbox)
+            record['init'].append(time.time()-start)
+            tracking=True
+            step=0
+            continue
+
+        flag, bbox, tracktime = objtracker.updateTrack(img)
+        record['update'].append(tracktime)
+        step+=1
+        if not flag:
+            record['lost']+=1
+            tracking=False
+            continue
+        if gtbox is not None:
+            iou=getIoUPair(gtbox,bbox)
+            record['drift'].setdefault(step,[]).append(iou)
+    return record
+
+def summarizeRecord(record):
+    """
+    latency in ms and drift IoU of a record from replayTracker
+
+    """
+    update=np.array(record['update'])*1000
+    ious=[iou for step in record['drift'] for iou in record['drift'][step]]
+    return {'build_ms':{'mean':float(np.mean(record['build'])*1000) if len(record['build'])>0 else 0.0},
+            'init_ms':{'mean':float(np.mean(record['init'])*1000) if len(record['init'])>0 else 0.0},
+            'update_ms':{'mean':float(update.mean()) if len(update)>0 else 0.0,
+                         'p50':float(np.percentile(update,50)) if len(update)>0 else 0.0,
+                         'p95':float(np.percentile(update,95)) if len(update)>0 else 0.0,
+                         'p99':float(np.percentile(update,99)) if len(update)>0 else 0.0},
+            'iou':float(np.mean(ious)) if len(ious)>0 else 0.0,
+            'drift':{str(step):float(np.mean(record['drift'][step]))
+                     for step in sorted(record['drift'])},
+            'lost':record['lost']/len(update) if len(update)>0 else 0.0,
+            'updates':len(update)}
+
+def printResult(result):
+    """
+    print the latency, IoU and lost rate of each tracker type in a table
+
+    """
+    print('{:<12}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}{:>8}{:>8}'.format(
+            'tracker','build ms','init ms','mean ms','p50 ms','p95 ms','p99 ms','IoU','lost'))
+    for trackertype in result:
+        summary=result[trackertype]
+        update=summary['update_ms']
+        print('{:<12}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>8.3f}{:>8.3f}'.format(
+                trackertype,summary['build_ms']['mean'],summary['init_ms']['mean'],
+                update['mean'],update['p50'],update['p95'],update['p99'],
+                summary['iou'],summary['lost']))
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--testimg_path',type=str,
+                        default='D:/Private Manager/Personal File/uOttawa/Lab works/2018 summer/Leading Vehicle/Viewnyx dataset/Part4_ACC',
+                        help='the top level of the frame folders, each folder \
+                        has its groundtruth annotationfull_<folder>.json in it')
+    parser.add_argument('--folder_only', type=str, default='',
+                        help="use the folders with 'A String' in its name only")
+    parser.add_argument('--trackers', type=str, nargs='+', default=track_obj.tracker_types,
+                        choices=track_obj.tracker_types,
+                        help='tracker types to be compared')
+    parser.add_argument('--max_track', type=int, default=10,
+                        help='frames tracked after each init, default is 10')
+    parser.add_argument('--max_frames', type=int, default=0,
+                        help='max frames used in each folder, 0 for all')
+    args = parser.parse_args()
+
+    folders=[]
+    for folder in sorted(os.listdir(args.testimg_path)):
+        gtpath=os.path.join(args.testimg_path,folder,'annotationfull_{}.json'.format(folder))
+        if args.folder_only!='' and args.folder_only not in folder:
+            continue
+        if os.path.exists(gtpath):
+            frames=loadFolder(os.path.join(args.testimg_path,folder),
+                              json.load(open(gtpath)),args.max_frames)
+            folders.append(frames)
+            print('{}: {} frames loaded'.format(folder,len(frames)))
+
+    result={}
+    for trackertype in args.trackers:
+        objtracker=track_obj.ObjTracker()
+        try:
+            objtracker.buildTracker(trackertype)
+        except (AttributeError, cv2.error) as e:
+            # not in every opencv build
+            print('{} skipped: {}'.format(trackertype,e))
+            continue
+        record=None
+        for frames in folders:
+            record=replayTracker(objtracker,frames,max_track=args.max_track,record=record)
+        if record is not None:
+            result[trackertype]=summarizeRecord(record)
+            print('{} done'.format(trackertype))
+    printResult(result)
+
+    with open(os.path.join(args.testimg_path,'tracker_benchmark.json'),'w') as savefile:
+        savefile.write(json.dumps(result, sort_keys = True, indent = 4))
+
+''' End of File '''
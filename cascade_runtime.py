@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+run the light and the heavy network as a cascade, frame by frame, instead of
+running both on every frame and merging the results afterwards with
+combine_heavy_and_light_network.py
+
+both frozen graphs are loaded once. the light network runs on every frame,
+the heavy one only when the rules of combineDetectionResult (CascadeRule)
+ask for the precise detection: in the first frames of a folder or after a
+gap, when the light network found no leading vehicle in the previous frame,
+or when its leading vehicle disagrees with the prediction from the last
+frames. otherwise the light detection is used, with the leading box merged
+with the prediction when possible.
+
+saved under testimg_path:
+    annotation_<folder>_cascade.json: the final detection of each frame
+    cascade_<folder>.json: 'precise', 'rough' or 'merge' for each frame
+    cascade_report.json: escalation rate (frames run by the heavy network)
+        and effective frames per second of each folder and of all of them
+
+usage example:
+    python3 cascade_runtime.py --light_ckpt_path /PATH/ssd_opt_150/frozen_inference_graph.pb
+    --heavy_ckpt_path /PATH/ssd_opt_300/frozen_inference_graph.pb
+    --testimg_path /YOUR/TEST/FOLDER --folder_only 3652
+"""
+
+import os
+import json
+import time
+import argparse
+
+import myGreedyNMS
+import frame_pipeline
+from detector import Detector
+from model_test import (detectFrames, loadFrame, updateAnnotationDict,
+                        updateAnnotationDict_Raw, keepOnlyOneLeading)
+from combine_heavy_and_light_network import (MOTION_MODELS, CascadeRule,
+                                              getLeadingAnnotation, getTimeStamp)
+
+from object_detection.utils import label_map_util
+
+
+def annotateFrame(detector, frame, category_index, max_class,
+                  outputthresh=0.5, customNMS=True, nms_mode='greedy'):
+    """
+    detect a single frame and keep only the nearest leading vehicle, the
+    same as detectMultipleImages does for each frame
+
+    input:
+        frame: a tuple from model_test.loadFrame
+    output:
+        the annotation of the frame in the format of VIVA Annotation
+    """
+    imagename,image_cv,image_np,im_width,im_height,_ = frame
+    output_dict = detectFrames(detector,[frame])[0]
+    annotationdict={}
+    if not customNMS:
+        annotationdict = updateAnnotationDict(output_dict,
+                        annotationdict,imagename,
+                        im_width,im_height,max_class)
+    else:
+        annotationdict, _ ,_ = updateAnnotationDict_Raw(output_dict,annotationdict,
+                                  imagename,im_width,im_height,
+                                  max_class,category_index,
+                                  outputthresh=outputthresh,IOUthresh=0.5,
+                                  nms_mode=nms_mode)
+    annotationdict, _, _ = keepOnlyOneLeading(annotationdict,imagename)
+    return annotationdict[imagename]
+
+
+class HeavyLightCascade():
+    """
+    a light and a heavy detector with the CascadeRule deciding, for each
+    frame, whether the heavy one is run
+
+    """
+    def __init__(self, light_detector, heavy_detector, category_index,
+                 max_class=1, outputthresh=0.5, customNMS=True,
+                 nms_mode='greedy', prediction_fun_order=2, IoU_thresh=0.5,
+                 motion_model='polynomial', frame_interval=0.1):
+        """
+        input:
+            light_detector, heavy_detector: detector.Detector of the light
+                (rough) and the heavy (precise) network
+            prediction_fun_order, IoU_thresh, motion_model, frame_interval:
+                see combineDetectionResult
+
+        """
+        self.light_detector=light_detector
+        self.heavy_detector=heavy_detector
+        self.category_index=category_index
+        self.max_class=max_class
+        self.outputthresh=outputthresh
+        self.customNMS=customNMS
+        self.nms_mode=nms_mode
+        self.frame_interval=frame_interval
+        self.rule=CascadeRule(prediction_fun_order=prediction_fun_order,
+                              IoU_thresh=IoU_thresh,
+                              motion_model=motion_model,
+                              frame_interval=frame_interval)
+        self.stats=self.newStats()
+
+    def newStats(self):
+        return {'frames':0, 'escalations':0, 'light_time':0.0,
+                'heavy_time':0.0, 'precise':0, 'rough':0, 'merge':0}
+
+    def reset(self):
+        # call at the start of each folder, and after each gap
+        self.rule.reset()
+
+    def _annotate(self, detector, frame):
+        return annotateFrame(detector, frame, self.category_index,
+                             self.max_class, outputthresh=self.outputthresh,
+                             customNMS=self.customNMS, nms_mode=self.nms_mode)
+
+    def detect(self, frame):
+        """
+        detect a frame with the light network, and with the heavy one if
+        the rule asks for it
+
+        input:
+            frame: a tuple from model_test.loadFrame, in temporal order
+        output:
+            annotation: the final annotation of the frame
+            action: 'precise', 'rough' or 'merge', see CascadeRule
+        """
+        t=getTimeStamp(frame[0], self.frame_interval)
+        starttime=time.time()
+        annotation=self._annotate(self.light_detector, frame)
+        self.stats['light_time']+=time.time()-starttime
+
+        action, merged = self.rule.decide(getLeadingAnnotation(annotation), t)
+        if action=='precise':
+            starttime=time.time()
+            annotation=self._annotate(self.heavy_detector, frame)
+            self.stats['heavy_time']+=time.time()-starttime
+            self.stats['escalations']+=1
+        elif action=='merge':
+            getLeadingAnnotation(annotation).update(merged)
+
+        self.rule.accept(getLeadingAnnotation(annotation), t)
+        self.stats['frames']+=1
+        self.stats[action]+=1
+        return annotation, action
+
+
+def summarizeStats(stats, walltime):
+    """
+    escalation rate and speed of the stats of a HeavyLightCascade
+
+    input:
+        stats: HeavyLightCascade.stats, or the sum of several
+        walltime: seconds spent on the frames, decoding included
+    """
+    frames=max(1,stats['frames'])
+    summary=dict(stats)
+    summary['escalation_rate']=stats['escalations']/frames
+    summary['fps']=stats['frames']/walltime if walltime>0 else 0.0
+    summary['light_ms']=stats['light_time']*1000/frames
+    summary['heavy_ms']=stats['heavy_time']*1000/max(1,stats['escalations'])
+    summary['walltime']=walltime
+    return summary
+
+def runFolder(cascade, testimgpath, folder, num_readers=0):
+    """
+    run the cascade on the frames of a folder in temporal order
+
+    output:
+        annotationdict: {imagename: annotation}
+        actiondict: {imagename: action}
+        summary: output of summarizeStats for the folder
+    """
+    imagepath=os.path.join(testimgpath,folder)
+    framelist, gaps = frame_pipeline.enumerateFrames(os.listdir(imagepath))
+    # the prediction needs the frames right before, start over after a gap
+    gapframes=set(after for _,after,_ in gaps)
+    reader=frame_pipeline.FrameReader(num_workers=num_readers,
+                                      prefetch=2*max(1,num_readers))
+
+    cascade.stats=cascade.newStats()
+    cascade.reset()
+    annotationdict={}
+    actiondict={}
+    starttime=time.time()
+    for frame in reader.read(loadFrame,[(imagepath,imagename) for imagename in framelist]):
+        if frame is None:
+            continue
+        if frame[0] in gapframes:
+            cascade.reset()
+        annotationdict[frame[0]], actiondict[frame[0]] = cascade.detect(frame)
+    return annotationdict, actiondict, summarizeStats(cascade.stats, time.time()-starttime)
+
+def printSummary(name, summary):
+    print('{}: {} frames, escalation rate {:.3f}, {:.2f} fps, light {:.2f} ms, heavy {:.2f} ms'.format(
+            name,summary['frames'],summary['escalation_rate'],summary['fps'],
+            summary['light_ms'],summary['heavy_ms']))
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--light_ckpt_path', type=str,
+                        default='D:/Private Manager/Personal File/uOttawa/Lab works/2018 summer/viewnyx/ckpt_ssd_opt_150/export/frozen_inference_graph.pb',
+                        help="frozen graph of the light network, run on every frame")
+    parser.add_argument('--heavy_ckpt_path', type=str,
+                        default='D:/Private Manager/Personal File/uOttawa/Lab works/2018 summer/viewnyx/ckpt_ssd_opt_300/export/frozen_inference_graph.pb',
+                        help="frozen graph of the heavy network, run when escalated")
+    parser.add_argument('--label_path', type=str,
+                        default='D:/Private Manager/Personal File/uOttawa/Lab works/2018 summer/viewnyx/data/class_labels.pbtxt',
+                        help="select the file path for class labels")
+    parser.add_argument('--testimg_path',type=str,
+                        default='D:/Private Manager/Personal File/uOttawa/Lab works/2018 summer/Leading Vehicle/Viewnyx dataset/Part4_ACC',
+                        help='path to the images to be tested')
+    parser.add_argument('--folder_only', type=str, default='3652',
+                        help="run on the folders with 'A String' in its name \
+                        only, set this as '' to run all the folders")
+    parser.add_argument('--class_number', type=int, default=1,
+                        help="set number of classes (default as 1)")
+    parser.add_argument('--output_thresh', type=float, default=0.2,
+                        help='threshold of score for output the detected bbxs')
+    parser.add_argument('--nms_mode',type=str,default='greedy',
+                        choices=myGreedyNMS.NMS_MODES,
+                        help='NMS used on the raw outputs: greedy, soft_linear, \
+                        soft_gaussian or wbf. default is greedy')
+    parser.add_argument('--IoUthresh',type=float,default=0.5,
+                        help='the light detection agrees with the prediction \
+                        above this IoU, otherwise the heavy network is run')
+    parser.add_argument('--prediction_func_order',type=int,default=2,
+                        help='the order of prediction function')
+    parser.add_argument('--motion_model',type=str,default='polynomial',
+                        choices=MOTION_MODELS,
+                        help='prediction of the leading box, see \
+                        combine_heavy_and_light_network.py')
+    parser.add_argument('--frame_interval',type=float,default=0.1,
+                        help='seconds between two frames, default is 0.1')
+    parser.add_argument('--num_readers',type=int,default=0,
+                        help='number of threads decoding frames ahead of the \
+                        networks, 0 for decoding on the main thread. default is 0')
+    parser.add_argument('--intra_op_threads',type=int,default=0,
+                        help='threads used inside a single op of each network, \
+                        0 for the default of tensorflow. default is 0')
+    args = parser.parse_args()
+
+    testimgpath=args.testimg_path
+
+    label_map = label_map_util.load_labelmap(args.label_path)
+    categories = label_map_util.convert_label_map_to_categories(label_map,
+            max_num_classes=args.class_number, use_display_name=True)
+    category_index = label_map_util.create_category_index(categories)
+
+    light_detector=Detector(args.light_ckpt_path, intra_op_threads=args.intra_op_threads)
+    heavy_detector=Detector(args.heavy_ckpt_path, intra_op_threads=args.intra_op_threads)
+    print('models loaded, light sha1 {}, heavy sha1 {}'.format(
+            light_detector.model_hash,heavy_detector.model_hash))
+    cascade=HeavyLightCascade(light_detector, heavy_detector, category_index,
+                              max_class=args.class_number,
+                              outputthresh=args.output_thresh,
+                              nms_mode=args.nms_mode,
+                              prediction_fun_order=args.prediction_func_order,
+                              IoU_thresh=args.IoUthresh,
+                              motion_model=args.motion_model,
+                              frame_interval=args.frame_interval)
+
+    report={}
+    total=cascade.newStats()
+    totaltime=0.0
+    with light_detector, heavy_detector:
+        for folder in sorted(os.listdir(testimgpath)):
+            if '.' in folder or not os.path.isdir(os.path.join(testimgpath,folder)):
+                continue
+            if args.folder_only!='' and args.folder_only not in folder:
+                continue
+            annotationdict, actiondict, summary = runFolder(cascade,testimgpath,
+                                                  folder,num_readers=args.num_readers)
+            printSummary(folder,summary)
+            report[folder]=summary
+            for key in total:
+                total[key]+=cascade.stats[key]
+            totaltime+=summary['walltime']
+
+            with open(os.path.join(testimgpath,'annotation_{}_cascade.json'.format(folder)),'w') as savefile:
+                savefile.write(json.dumps(annotationdict, sort_keys = True, indent = 4))
+            with open(os.path.join(testimgpath,'cascade_{}.json'.format(folder)),'w') as savefile:
+                savefile.write(json.dumps(actiondict, sort_keys = True, indent = 4))
+
+    report['total']=summarizeStats(total,totaltime)
+    printSummary('total',report['total'])
+    with open(os.path.join(testimgpath,'cascade_report.json'),'w') as savefile:
+        savefile.write(json.dumps(report, sort_keys = True, indent = 4))
+
+''' End of File '''
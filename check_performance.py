@@ -16,6 +16,9 @@ import time
 import numpy as np
 import json
 
+from result_stream import loadResults
+from iou_matrix import getIoUMatrix, boxesFromAnnotations
+
 import bbox_lib.BoundingBoxes as BoundingBoxes
 import bbox_lib.BoundingBox as BoundingBox
 import bbox_lib.Evaluator as Evaluator
@@ -25,42 +28,6 @@ import matplotlib.patches as mpatches
 import matplotlib.lines as mlines
 import matplotlib.pyplot as plt
 
-def getIoU(bbx_benchmark,bbx_detect):
-    """
-    calculate Intersection over Union of two bounding boxes
-    return 0 if no intersection
-    
-    """
-    
-    # get the cordinates of intersecting square
-    x_inter_1=max(bbx_benchmark['x'],bbx_detect['x'])
-    y_inter_1=max(bbx_benchmark['y'],bbx_detect['y'])
-    x_inter_2=min(bbx_benchmark['x']+bbx_benchmark['width'],bbx_detect['x']+bbx_detect['width'])
-    y_inter_2=min(bbx_benchmark['y']+bbx_benchmark['height'],bbx_detect['y']+bbx_detect['height'])
-    
-    # get intersect area
-    inter_area = max(0, x_inter_2 - x_inter_1) * max(0, y_inter_2 - y_inter_1)
-    
-    # get bbx area
-    benchmark_area = bbx_benchmark['width'] * bbx_benchmark['height']
-    detect_area=bbx_detect['width'] * bbx_detect['height']
-    
-    # calculate IoU
-    iou = inter_area / float(benchmark_area + detect_area - inter_area)
-    
-    # for debugging, check the result
-    '''
-    print('benchmark:(x1,y1)=',bbx_benchmark['x'],bbx_benchmark['y'],' (x2,y2)=',bbx_benchmark['x']+bbx_benchmark['width'],bbx_benchmark['y']+bbx_benchmark['height'])
-    print('detect:(x1,y1)=',bbx_detect['x'],bbx_detect['y'],'(x2,y2)=',bbx_detect['x']+bbx_detect['width'],bbx_detect['y']+bbx_detect['height'])
-    print('intersection area:',inter_area)
-    print('benchmark area:',benchmark_area)
-    print('detect area:',detect_area)
-    print('IoU=',iou,'\n')
-    '''
-    
-    
-    return iou
-
 def _get_tp_fp_fn_extern(predictionlist, groundtruthlist, totalperformance, 
                          confidencethresh=0.3,IOUthresh=0.5, rejectsize=0):
     """
@@ -155,12 +122,8 @@ def _get_tp_fp_fn(predictionlist, groundtruthlist, totalperformance, confidencet
     plist=[i for i in predictionlist if i['score']>confidencethresh]
     glist=groundtruthlist
     
-    pg = np.zeros([len(plist), len(glist)])
-    for i in range(len(plist)):
-        for j in range(len(glist)):
-            pg[i, j] = getIoU(plist[i], glist[j])
-            if pg[i, j] < IOUthresh: # IOU THRESHOLD
-                pg[i, j] = 0
+    pg = getIoUMatrix(boxesFromAnnotations(plist), boxesFromAnnotations(glist))
+    pg[pg < IOUthresh] = 0 # IOU THRESHOLD
     # matrix of IOUs with IOUs = 0 or IOU > thr(0.5)
     validity = True
     while pg.shape[0]>0 and pg.shape[1]>0:
@@ -225,10 +188,12 @@ def checkSingleImage(imgname,annos_benchmark,annos_detect,totalperformance,IOUth
     else:
         benchlist=[] # to store the matched bbx
         detectlist=[] # to store the matched bbx
+        # calculate IoU of all the bbx in benchmark and bbx in detect at once
+        ioumat=getIoUMatrix(boxesFromAnnotations(annos_benchmark),
+                            boxesFromAnnotations(annos_detect))
         for i in range(len(annos_benchmark)):
-            # calculate IoU bbx in detect and bbx in benchmark            
             for j in range(len(annos_detect)):
-                iou=getIoU(annos_benchmark[i],annos_detect[j])
+                iou=ioumat[i,j]
                 # true positive
                 if iou>=IOUthresh:
                     if annos_benchmark[i]['category'].lower()==annos_detect[j]['category'].lower():
@@ -376,10 +341,10 @@ if __name__=='__main__':
                 continue   
             else:
                 benchmark=json.load(open(os.path.join(jsonpath,'annotationfull_'+foldername+'.json')))
-                detected=json.load(open(os.path.join(jsonpath,'annotation_'+foldername+'_'+modelname+'.json')))
+                detected=loadResults(os.path.join(jsonpath,'annotation_'+foldername+'_'+modelname+'.json'))
     else:# detection result and benchmark pathes are specified
         benchmark=json.load(open(benchmarkpath))
-        detected=json.load(open(detectpath))
+        detected=loadResults(detectpath)
     
     # change IoU threshold from 0 to 1.0, interval 0.05
     if 'gt22' in modelname:
@@ -13,9 +13,13 @@ hardware condition severely.
 import os
 import json
 import argparse
+import collections
 import numpy as np
 
-from IoU_tools import getIoU
+from iou_matrix import getIoU
+from frame_pipeline import parseFrameIndex, sortFrames
+
+MOTION_MODELS=['polynomial','velocity','acceleration']
 
 def loadJsonResults(filepath, annotationflag=True, jsonlabel='detection'):
     """
@@ -74,6 +78,152 @@ def boxPrediction(previous_boxes, current_detection, order=2, debug=False) :
                 print('{}:{},{},{}->{}'.format(cate[j][0],y1,y2,y3,y4))
     return prediction_result
     
+class KalmanBoxFilter():
+    """
+    kalman filter of a box (width, height, x, y), each coordinate with a 
+    constant velocity or constant acceleration motion model
+    
+    the state is kept between frames, so each frame costs one predict and one
+    update of fixed size, and the time between frames comes from the real
+    time stamps instead of a fixed interval. the 4 coordinates share the same
+    motion model and noise, so they share one covariance matrix
+    
+    """
+    KEYS=('width','height','x','y')
+    
+    def __init__(self, motion_model='velocity', process_noise=50.0,
+                 measurement_noise=4.0, dt=0.1):
+        """
+        args:
+            motion_model: 'velocity' or 'acceleration'
+            process_noise: variance of the random acceleration (velocity 
+                model) or jerk (acceleration model), in pixels and seconds
+            measurement_noise: variance of a box coordinate in pixels for a
+                detection of confidence 1
+            dt: time between frames if no time stamp is given, in seconds
+        
+        """
+        if motion_model not in ('velocity','acceleration'):
+            raise ValueError('invalid motion model: {}'.format(motion_model))
+        self.order=2 if motion_model=='velocity' else 3
+        self.process_noise=process_noise
+        self.measurement_noise=measurement_noise
+        self.dt=dt
+        self.reset()
+    
+    def reset(self):
+        self.state=None # [4, order], position, velocity (, acceleration)
+        self.P=None # [order, order] covariance shared by the 4 coordinates
+        self.t=None
+        self.count=0 # number of updates since the last reset
+        self.predicted=False # predicted to the current frame, not updated yet
+    
+    def _transition(self, dt):
+        """
+        transition matrix F and process noise Q for a time step of dt
+        
+        """
+        if self.order==2:
+            F=np.array([[1,dt],[0,1]],dtype=np.float64)
+            G=np.array([dt**2/2,dt])
+        else:
+            F=np.array([[1,dt,dt**2/2],[0,1,dt],[0,0,1]],dtype=np.float64)
+            G=np.array([dt**3/6,dt**2/2,dt])
+        Q=self.process_noise*np.outer(G,G)
+        return F, Q
+    
+    def getBox(self):
+        """
+        current box in the format of mergeTwoResultWithConfidence
+        
+        """
+        return {key:float(self.state[i,0]) for i,key in enumerate(self.KEYS)}
+    
+    def predict(self, t=None):
+        """
+        move the state to time t, the last time + dt if t is None. the 
+        following update() of the same frame doesn't move it again
+        
+        return the predicted box
+        """
+        if self.state is None:
+            raise ValueError('box filter not initialized')
+        if t is None:
+            t=self.t+self.dt
+        dt=t-self.t
+        if dt!=0:
+            F, Q = self._transition(dt)
+            self.state=self.state.dot(F.T)
+            self.P=F.dot(self.P).dot(F.T)+Q
+            self.t=t
+        self.predicted=True
+        return self.getBox()
+    
+    def update(self, box, t=None, score=1.0):
+        """
+        correct the state with a detected box at time t (the last time + dt 
+        if None, or the time of predict() if called for this frame already),
+        the box of a lower confidence score is trusted less. the first box 
+        initializes the state at rest
+        
+        return the corrected box
+        """
+        z=np.array([box[key] for key in self.KEYS],dtype=np.float64)
+        R=self.measurement_noise/max(score,1e-3)
+        if self.state is None:
+            self.state=np.zeros((4,self.order))
+            self.state[:,0]=z
+            self.P=np.diag([R]+[self.measurement_noise*100]*(self.order-1))
+            self.t=0 if t is None else t
+            self.count=1
+            self.predicted=False
+            return self.getBox()
+        if t is not None or not self.predicted:
+            self.predict(t)
+        S=self.P[0,0]+R
+        K=self.P[:,0]/S
+        self.state=self.state+np.outer(z-self.state[:,0],K)
+        self.P=self.P-np.outer(K,self.P[0,:])
+        self.count+=1
+        self.predicted=False
+        return self.getBox()
+
+def getTimeStamp(imgname, frame_interval=0.1):
+    """
+    time stamp of a frame from its index, e.g. VNX_10009_00012.png -> 1.2 s 
+    at 10 fps
+    
+    """
+    _, index = parseFrameIndex(imgname)
+    if index is None:
+        return None
+    return index*frame_interval
+
+def replaceLeadingBox(annosdict, box):
+    """
+    a new frame with the box of the leading vehicle changed, only the frame,
+    its list of annotations and the leading annotation are copied, the other
+    annotations are shared with annosdict
+    
+    """
+    newframe=dict(annosdict)
+    newframe['annotations']=list(annosdict['annotations'])
+    for i, anno in enumerate(newframe['annotations']):
+        if anno['category']=='leading':
+            newframe['annotations'][i]=dict(anno, **box)
+            break
+    return newframe
+
+def getLeadingAnnotation(annosdict):
+    """
+    the annotation of the leading vehicle in a frame, None if not found
+    
+    """
+    for anno in annosdict['annotations']:
+        if anno['category']=='leading':
+            return anno
+    return None
+
 def havingLeadingOrNot(annosdict):
     """
     check if an image has leading vehicle in it
@@ -119,108 +269,88 @@ def solve2ndFunc(y1,y2,y3,
     
 def combineDetectionResult(precise_detection, rough_detection,
                             max_refine_frames = 20, prediction_fun_order=2,
-                            IoU_thresh=0.5):
+                            IoU_thresh=0.5, motion_model='polynomial',
+                            frame_interval=0.1):
     """
     combine the detection results
     
+    the frames of each video are walked once in temporal order, the leading
+    vehicle of each rough frame is looked up once, and CascadeRule keeps the
+    leading boxes of the last prediction_fun_order+1 final frames, so no 
+    frame name is rebuilt and no frame is searched twice. a gap in the frame
+    indices starts the video over. the inputs are not changed, only the 
+    merged frames are new, the other frames of the result are the frames of
+    the inputs, not copies
+    
+    motion_model: 'polynomial' fits a 2nd order function through the last 
+        prediction_fun_order+1 boxes, 'velocity' or 'acceleration' use a 
+        KalmanBoxFilter with the time stamps of the frames, and the merge 
+        of detection and prediction is the update of the filter
+    frame_interval: seconds between two frame indices, for the time stamps
+    
     """
-    # create new dict of detection, use hard copy for creating the format faster
-    new_detection_dict=precise_detection.copy()
+    rule=CascadeRule(prediction_fun_order=prediction_fun_order,
+                     IoU_thresh=IoU_thresh,
+                     motion_model=motion_model,
+                     frame_interval=frame_interval)
+    new_detection_dict={}
     
-    for jsonname in new_detection_dict:
-        video_len= len(new_detection_dict[jsonname])
-        count=0
-
-        for imgname in new_detection_dict[jsonname]:
-            if count<=prediction_fun_order:
-                # skip the first few frames
-                count=count+1
-                continue
+    for jsonname in precise_detection:
+        precise=precise_detection[jsonname]
+        rough=rough_detection[jsonname]
+        framelist=sortFrames(precise)
+        # parsed once, for the gaps and the time stamps
+        indices=[parseFrameIndex(imgname)[1] for imgname in framelist]
+        rough_leading=[getLeadingAnnotation(rough[imgname]) for imgname in framelist]
+        
+        rule.reset()
+        new_detection_dict[jsonname]={}
+        for k, imgname in enumerate(framelist):
+            index=indices[k]
+            if k>0 and index is not None and indices[k-1] is not None \
+                and index-indices[k-1]>1:
+                rule.reset() # gap
+            t=None if index is None else index*frame_interval
+            action, merged = rule.decide(rough_leading[k], t)
+            if action=='precise':
+                newframe=precise[imgname]
+            elif action=='rough':
+                newframe=rough[imgname]
             else:
-                count=count+1
-                currentframe=imgname.split('.')[0].split('_')[-1]
-                previousimg=imgname.replace(currentframe,str(int(currentframe)-1).zfill(5))
-                leading_in_pre_flag=havingLeadingOrNot(rough_detection[jsonname][previousimg])
-                if not leading_in_pre_flag:
-                    # if previous frame doesn't has leading, use precise detection    
-                    new_detection_dict[jsonname][imgname]=precise_detection[jsonname][imgname]
-                else:    
-                    # if previous frame has leading, check if prediction is feasible
-                    prediction_feasible_flag=True
-                    while_count=prediction_fun_order+1 # check order+1 previous frames
-                    while(while_count):
-                        previousimg=imgname.replace(currentframe,str(int(currentframe)-(while_count)).zfill(5))
-                        while_count=while_count-1
-                        # use new result, instead of raw result
-                        leading_in_pre_flag=havingLeadingOrNot(new_detection_dict[jsonname][previousimg])
-                        if not leading_in_pre_flag:
-                            prediction_feasible_flag=False
-                            #print('due to {}, prediction not feasible'.format(previousimg))
-                            break
-                    
-                    if prediction_fun_order==0 or (not prediction_feasible_flag):
-                        # if not feasible, use rough detection
-                        new_detection_dict[jsonname][imgname]=rough_detection[jsonname][imgname]
-                    else:
-                        # if prediction is feasible, run prediction, refine the rough detection
-                        # prepare boxes in previous frames, and rough detection in current frame
-                        previous_boxes=[]
-                        while_count=prediction_fun_order+1
-                        while(while_count):
-                            previousimg=imgname.replace(currentframe,str(int(currentframe)-(while_count)).zfill(5))
-                            while_count=while_count-1
-                            # box format: [w,h,cx,cy]
-                            for i in new_detection_dict[jsonname][previousimg]['annotations']:
-                                if i['category']=='leading':
-                                    previous_boxes.append(i)
-                        
-                        for i in rough_detection[jsonname][imgname]['annotations']:
-                            if i['category']=='leading':
-                                current_detection=i
-
-                        prediction_result = boxPrediction(
-                                                previous_boxes, 
-                                                current_detection, 
-                                                order=prediction_fun_order)
-                        is_same_vehicle = (getIoU(current_detection,prediction_result)>IoU_thresh)
-                        
-                        # merge the current detection & prediction with 
-                        # confidence score as weight
-                        if is_same_vehicle:
-                            merged = mergeTwoResultWithConfidence(
-                                         res=current_detection, 
-                                         addi=prediction_result,
-                                         debug=False)
-                        
-                            # use the merged result as the final detection result
-                            # use all the sideways
-                            new_detection_dict[jsonname][imgname]=rough_detection[jsonname][imgname]
-                            # change the detection of the leading one
-                            for i, box in zip(range(len(new_detection_dict[jsonname][imgname]['annotations'])),
-                                              new_detection_dict[jsonname][imgname]['annotations']):
-                                if box['category']=='leading':
-                                    new_detection_dict[jsonname][imgname]['annotations'][i]['width']=merged['width']
-                                    new_detection_dict[jsonname][imgname]['annotations'][i]['height']=merged['height']
-                                    new_detection_dict[jsonname][imgname]['annotations'][i]['x']=merged['x']
-                                    new_detection_dict[jsonname][imgname]['annotations'][i]['y']=merged['y']
+                # use all the sideways of the rough detection, change the 
+                # detection of the leading one
+                newframe=replaceLeadingBox(rough[imgname], merged)
+            rule.accept(getLeadingAnnotation(newframe), t)
+            new_detection_dict[jsonname][imgname]=newframe
 
     return new_detection_dict
 
-def mergeTwoResultWithConfidence(res, addi, debug=True):
+def mergeTwoResultWithConfidence(res, addi, debug=True, box_filter=None):
     """
     args:
         res: a rough detection result, full annotation boxes format
             use result['width'] for width, result['score'] for confidence, etc
         addi: additional prediction result, no confidence. use addi['width']
             for width, etc
+        box_filter: a KalmanBoxFilter already predicted to the current frame,
+            if given, the merge is the update of the filter with res, 
+            weighted by the confidence of res and the uncertainty of the 
+            prediction, instead of the fixed blend by confidence
     
     """
     conf=res['score']
     
-    w = round(conf*res['width'] + (1-conf)*addi['width'])
-    h = round(conf*res['height'] + (1-conf)*addi['height'])
-    x = round(conf*res['x'] + (1-conf)*addi['x'])
-    y = round(conf*res['y'] + (1-conf)*addi['y'])
+    if box_filter is not None:
+        merged = box_filter.update(res, t=box_filter.t, score=conf)
+        w = round(merged['width'])
+        h = round(merged['height'])
+        x = round(merged['x'])
+        y = round(merged['y'])
+    else:
+        w = round(conf*res['width'] + (1-conf)*addi['width'])
+        h = round(conf*res['height'] + (1-conf)*addi['height'])
+        x = round(conf*res['x'] + (1-conf)*addi['x'])
+        y = round(conf*res['y'] + (1-conf)*addi['y'])
     
     if debug:
         print('w change: {}'.format(w/res['width']))
@@ -230,6 +360,113 @@ def mergeTwoResultWithConfidence(res, addi, debug=True):
     
     return {'width':w, 'height': h, 'x':x, 'y':y}
 
+class CascadeRule():
+    """
+    the rules of combining the precise and rough detections, applied one 
+    frame of a video at a time, offline by combineDetectionResult and online
+    by cascade_runtime.py to run the precise (heavy) network only when it 
+    is needed
+    
+    for each frame, decide() tells from the leading vehicle of the rough 
+    (light) detection which result to use:
+        'precise': the precise detection, in the first prediction_fun_order+1
+            frames, when the rough detection of the previous frame has no 
+            leading vehicle, or when the rough leading vehicle disagrees with
+            the prediction from the last frames (IoU<=IoU_thresh, or lost)
+        'rough': the rough detection as it is, when the prediction is not 
+            feasible, i.e. a frame among the last prediction_fun_order+1 has
+            no leading vehicle in the final result
+        'merge': the rough detection, with the leading box merged with the
+            prediction
+    then accept() is called with the leading vehicle of the final result
+    
+    """
+    def __init__(self, prediction_fun_order=2, IoU_thresh=0.5,
+                 motion_model='polynomial', frame_interval=0.1):
+        self.order=prediction_fun_order
+        self.IoU_thresh=IoU_thresh
+        if motion_model=='polynomial':
+            self.box_filter=None
+        else:
+            self.box_filter=KalmanBoxFilter(motion_model=motion_model,
+                                            dt=frame_interval)
+        self.reset()
+    
+    def reset(self):
+        # call at the start of each video
+        self.count=0
+        self.rough_leading_before=False
+        # leading boxes of the final results of the last frames, None for
+        # a frame without leading vehicle
+        self.window=collections.deque(maxlen=self.order+1)
+        self.filter_updated=False
+        if self.box_filter is not None:
+            self.box_filter.reset()
+    
+    def isPredictionFeasible(self):
+        if self.box_filter is not None:
+            # the filter is reset by a frame without leading, so the count
+            # is the number of frames in a row
+            return self.box_filter.count>=self.order+1
+        if len(self.window)<self.order+1:
+            return False
+        for box in self.window:
+            if box is None:
+                return False
+        return True
+    
+    def decide(self, rough_leading, t=None):
+        """
+        args:
+            rough_leading: the leading annotation of the rough detection of
+                the frame, None if not found
+            t: time stamp of the frame, see getTimeStamp
+        returns:
+            action: 'precise', 'rough' or 'merge'
+            merged: the merged box {'width','height','x','y'} for 'merge',
+                otherwise None
+        """
+        rough_leading_before=self.rough_leading_before
+        self.rough_leading_before= rough_leading is not None
+        self.filter_updated=False
+        self.count+=1
+        if self.count<=self.order+1 or not rough_leading_before:
+            return 'precise', None
+        if self.order==0 or not self.isPredictionFeasible():
+            return 'rough', None
+        if rough_leading is None:
+            return 'precise', None
+        
+        if self.box_filter is None:
+            prediction_result = boxPrediction(list(self.window), 
+                                              rough_leading, 
+                                              order=self.order)
+        else:
+            prediction_result = self.box_filter.predict(t)
+        if getIoU(rough_leading,prediction_result)<=self.IoU_thresh:
+            return 'precise', None
+        merged = mergeTwoResultWithConfidence(res=rough_leading,
+                                              addi=prediction_result,
+                                              debug=False,
+                                              box_filter=self.box_filter)
+        self.filter_updated= self.box_filter is not None
+        return 'merge', merged
+    
+    def accept(self, final_leading, t=None):
+        """
+        record the leading annotation of the final result of the frame, 
+        None if not found
+        
+        """
+        self.window.append(final_leading)
+        if self.box_filter is None or self.filter_updated:
+            return
+        if final_leading is None:
+            self.box_filter.reset()
+        else:
+            self.box_filter.update(final_leading, t, 
+                                   score=final_leading.get('score',1.0))
+
 if __name__=='__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--save_path', type=str, 
@@ -247,6 +484,13 @@ if __name__=='__main__':
                         help='IoU threshold for choosing positive predictions')
     parser.add_argument('--prediction_func_order',type=int,default=2,
                         help='the order of prediction function')
+    parser.add_argument('--motion_model',type=str,default='polynomial',
+                        choices=MOTION_MODELS,
+                        help='polynomial for the 2nd order function through \
+                        the last boxes, velocity or acceleration for a kalman \
+                        filter of the leading box')
+    parser.add_argument('--frame_interval',type=float,default=0.1,
+                        help='seconds between two frames, default is 0.1')
     args = parser.parse_args()
     
     # parse the arguments
@@ -256,6 +500,8 @@ if __name__=='__main__':
     titleattach = args.title_attach
     IoUthresh   = args.IoUthresh
     order       = args.prediction_func_order
+    motionmodel = args.motion_model
+    frameinterval = args.frame_interval
     
     # load .json detection result of 150 and 300 resolution, dict form is better than list
     heavy_detection_dict = loadJsonResults(heavypath)
@@ -268,7 +514,9 @@ if __name__=='__main__':
                             rough_detection = light_detection_dict,
                             max_refine_frames = 20,
                             prediction_fun_order=order,
-                            IoU_thresh=IoUthresh)
+                            IoU_thresh=IoUthresh,
+                            motion_model=motionmodel,
+                            frame_interval=frameinterval)
     
     # save the new result as the detection result of "combine heavy and light" method
     detection_dict_for_save={}
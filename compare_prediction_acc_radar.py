@@ -20,7 +20,8 @@ import os
 import json
 from matplotlib import pyplot as plt
 
-from IoU_tools import getIoU
+from iou_matrix import getPairwiseIoU, boxesFromAnnotations
+from result_stream import loadResults, toJSONPath
 
 def parseString2ArrayExtra(filename, string):
     '''
@@ -87,7 +88,9 @@ def loadAccData(accpath):
 
 def loadJsonResults(filepath, annotationflag=True, jsonlabel=''):
     """
-    load prediction and tracking results in json format
+    load prediction and tracking results in json format, the .ndjson files
+    saved with --stream_output of model_test.py are loaded as well, under
+    the name of the .json file
     
     """
     detectdist={}
@@ -95,33 +98,75 @@ def loadJsonResults(filepath, annotationflag=True, jsonlabel=''):
     detectanno={}
     trackanno={}
     gtanno={}
-    filelist=os.listdir(filepath)
+    filelist=[filename for filename in os.listdir(filepath) 
+              if filename.endswith('.json') or filename.endswith('.ndjson')]
     print('loading prediction & tracking files')
     if not annotationflag:
         for filename in filelist:
             if jsonlabel in filename and 'distance' in filename:
                 if 'detection' in filename:
                     # loading detection results
-                    detectdist[filename]=json.load(open(os.path.join(filepath,filename)))
+                    detectdist[toJSONPath(filename)]=loadResults(os.path.join(filepath,filename))
                 elif 'tracking' in filename:
                     # loading tracking results
-                    trackdist[filename]=json.load(open(os.path.join(filepath,filename)))
+                    trackdist[toJSONPath(filename)]=loadResults(os.path.join(filepath,filename))
     if annotationflag:
         for filename in filelist:
             if 'annotation' in filename:
                 # use 140 only for annotation, they dont change anyway
                 if 'detection' in filename:
                     # loading detection results
-                    detectanno[filename]=json.load(open(os.path.join(filepath,filename)))
+                    detectanno[toJSONPath(filename)]=loadResults(os.path.join(filepath,filename))
                 elif 'tracking' in filename:
                     # loading tracking results
-                    trackanno[filename]=json.load(open(os.path.join(filepath,filename)))
+                    trackanno[toJSONPath(filename)]=loadResults(os.path.join(filepath,filename))
                 else:
                     # loading ground truth annotation
-                    gtanno[filename]=json.load(open(os.path.join(filepath,filename)))
+                    gtanno[toJSONPath(filename)]=loadResults(os.path.join(filepath,filename))
         print('loading completed')
     return detectdist, trackdist, detectanno, trackanno, gtanno
 
+def loadSweepTables(filepath):
+    """
+    load the distance tables saved by model_test.py with --calibration_sweep,
+    i.e. distance_<folder>_detection_sweep.json and 
+    distance_<folder>_tracking_sweep.json
+    
+    """
+    sweeptables={}
+    for filename in os.listdir(filepath):
+        if 'distance' in filename and filename.endswith('_sweep.json'):
+            sweeptables[filename]=json.load(open(os.path.join(filepath,filename)))
+    return sweeptables
+
+def sweepTablesToDist(sweeptables, jsonlabel):
+    """
+    take the distances of one calibration from the sweep tables, in the same
+    format as the distances from loadJsonResults(annotationflag=False), so 
+    they could be used by calculateError directly
+    
+    args:
+        sweeptables: output of loadSweepTables
+        jsonlabel: code of the calibration, e.g. '_160'
+    
+    outputs, both empty if the code is not in the sweep:
+        detectdist: {'distance_<folder>_detection<jsonlabel>.json':{imagename:distance}}
+        trackdist: {'distance_<folder>_tracking<jsonlabel>.json':{imagename:distance}}
+    """
+    detectdist={}
+    trackdist={}
+    for filename in sweeptables:
+        table=sweeptables[filename]
+        if jsonlabel not in table:
+            continue
+        distname=filename.replace('_sweep.json','{}.json'.format(jsonlabel))
+        distances=dict(zip(table['name'],table[jsonlabel]))
+        if filename.endswith('_detection_sweep.json'):
+            detectdist[distname]=distances
+        elif filename.endswith('_tracking_sweep.json'):
+            trackdist[distname]=distances
+    return detectdist, trackdist
+
 def calculateError(acc_table, detect_table, track_table, jsonlabel='',
                    error_type='percent',round_flag=True):
     """
@@ -364,7 +409,8 @@ def getMeanIoU(gtanno, testanno, label='detection'):
     the gtanno might miss some annotation when there is no vehicles in image
     
     """
-    ioulist=[]
+    benchmarklist=[]
+    testlist=[]
     for jsonname in gtanno:
         if label=='detection':
             testname=jsonname.split('.')[0]+'_detection.json'
@@ -378,7 +424,11 @@ def getMeanIoU(gtanno, testanno, label='detection'):
             for bbox in testanno[testname][imgname]['annotations']:
                 if bbox['category']=='leading':
                     bbox_test=bbox
-            ioulist.append(getIoU(bbox_benchmark,bbox_test))
+            benchmarklist.append(bbox_benchmark)
+            testlist.append(bbox_test)
+    # IoU of all the pairs at once
+    ioulist=getPairwiseIoU(boxesFromAnnotations(benchmarklist),
+                           boxesFromAnnotations(testlist)).tolist()
     miou=np.mean(np.array(ioulist))
     miniou=np.min(np.array(ioulist))
     maxiou=np.max(np.array(ioulist))
@@ -418,7 +468,8 @@ def getIoUBtwConsecutiveLV(gtanno, label='gt'):
     get IoU between consecutive leading vehicles in ground truth data.
     
     """
-    ioulist=[]
+    bboxlist=[]
+    lastbboxlist=[]
     for jsonname in gtanno:
         lastbbox={}
         for imgname in gtanno[jsonname]:
@@ -429,8 +480,11 @@ def getIoUBtwConsecutiveLV(gtanno, label='gt'):
                     continue
                 else:
                     # compute iou for each pair of bbox in two consecutive frames
-                    #print('iou={}'.format(getIoU(bbox,lastbbox)))
-                    ioulist.append(getIoU(bbox,lastbbox))
+                    bboxlist.append(bbox)
+                    lastbboxlist.append(lastbbox)
+    # IoU of all the pairs at once
+    ioulist=getPairwiseIoU(boxesFromAnnotations(bboxlist),
+                           boxesFromAnnotations(lastbboxlist)).tolist()
     miou=np.mean(np.array(ioulist))
            
     return ioulist, miou
@@ -543,7 +597,10 @@ if __name__=='__main__':
     wlist_tracking, mwe_tracking= getMeanWidthError(gt_anno,track_anno,
                                                       label='tracking')
     
-    # distance estimation errors 
+    # distance estimation errors, use the tables of a calibration sweep if 
+    # model_test.py was run with --calibration_sweep, and the per-calibration
+    # distance files for the codes which are not in the sweep
+    detect_sweep = loadSweepTables(detectpath)
     detect_statdict = {}
     track_statdict = {}
     errordict = {}
@@ -551,12 +608,15 @@ if __name__=='__main__':
         # evaluate estimation results of all the baseline widths
         for jsonlabel in jsonlabellist:
             # load prediction results
-            _,track_table,_,_,_ = loadJsonResults(detectpath, 
-                                                              annotationflag=False,
-                                                              jsonlabel=jsonlabel)
-            detect_table,_,_,_,_ = loadJsonResults(detectpath, 
-                                                              annotationflag=False,
-                                                              jsonlabel=jsonlabel)
+            detect_table,track_table = sweepTablesToDist(detect_sweep,jsonlabel)
+            if len(detect_table)==0 and len(track_table)==0:
+                detect_table,track_table,_,_,_ = loadJsonResults(detectpath, 
+                                                                  annotationflag=False,
+                                                                  jsonlabel=jsonlabel)
+            if len(detect_table)==0 and len(track_table)==0:
+                print('Warning: no distances of calibration {} in {}, neither'
+                      ' in the sweep tables nor in distance_*{}.json'.format(
+                              jsonlabel,detectpath,jsonlabel))
             
             # calculate detection/tracking error with ACC radar as ground truth
             detect_error, track_error = calculateError(acc_table, detect_table, 
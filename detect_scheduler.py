@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+schedulers deciding detect or track for each frame in the tracking mode of
+model_test.py
+
+the scheduler is asked once per frame with wantsTrack(). if a track is
+attempted, onTrack() returns the reason to run detection on the same frame,
+None to keep the tracked box. if no track is attempted, getReason() gives
+the reason of the detection. onDetect() and onDistance() feed back the result
+of the frame.
+
+reasons of detection:
+    'no_target': no leading vehicle is being tracked, e.g. the first frame
+    'gap': frames are missing before this frame
+    'track_lost': the tracker reports failure
+    'max_track': FixedIntervalScheduler, maxtrack frames tracked
+    'interval': AdaptiveScheduler, the interval of the current danger level
+        and time budget is used up
+    'box_change': AdaptiveScheduler, the tracked box changed too much from
+        the last frame
+"""
+
+import math
+
+from overlay import getDangerLevel
+
+SCHEDULERS=['fixed','adaptive']
+
+
+class FixedIntervalScheduler():
+    """
+    detect after at most maxtrack tracked frames, or when the tracker is
+    lost. the same as the maxtrack policy model_test.py used before
+
+    """
+    def __init__(self, maxtrack=10):
+        self.maxtrack=maxtrack
+        self.reset()
+
+    def reset(self):
+        # call at the start of each folder
+        self.solid=False
+        self.trackcount=0
+        self.reason='no_target'
+
+    def invalidate(self, reason='gap'):
+        """
+        drop the current target, the next frame is detected
+
+        """
+        self.solid=False
+        self.reason=reason
+
+    def wantsTrack(self):
+        return self.solid and self.trackcount<self.maxtrack
+
+    def getReason(self):
+        if self.solid:
+            return 'max_track'
+        return self.reason
+
+    def onTrack(self, success, bbox, tracktime):
+        self.solid=success
+        self.trackcount+=1
+        if not success:
+            return 'track_lost'
+        if self.trackcount==self.maxtrack:
+            return 'max_track'
+        return None
+
+    def onDetect(self, has_leading, bbox, detecttime):
+        self.solid=has_leading
+        if has_leading:
+            self.trackcount=0
+        else:
+            self.reason='no_target'
+
+    def onDistance(self, distance):
+        pass
+
+
+class AdaptiveScheduler(FixedIntervalScheduler):
+    """
+    the number of frames tracked after a detection depends on the danger
+    level of the leading vehicle and on the time budget. a close vehicle is
+    detected often, a distant one is tracked longer. the tracked box is
+    detected again at once if it changes too much between two frames
+
+    """
+    def __init__(self, intervals=None, target_fps=0, max_box_change=0.3,
+                 maxtrack=30, smoothing=0.1):
+        """
+        input:
+            intervals: {danger level: max frames tracked after a detection},
+                see overlay.DANGER_LEVELS
+            target_fps: if >0, track longer when detection every interval
+                frames would be slower than target_fps on average. ignored
+                for the 'High' danger level
+            max_box_change: detect when the width, height or center of the
+                tracked box moves by more than this ratio of the box width
+            maxtrack: upper limit of the interval
+            smoothing: weight of the new sample in the running average of
+                the detection and tracking time
+        """
+        if intervals is None:
+            intervals={'High':2,'Medium':5,'Low':15}
+        self.intervals=intervals
+        self.target_fps=target_fps
+        self.max_box_change=max_box_change
+        self.smoothing=smoothing
+        self.detecttime=None
+        self.tracktime=None
+        FixedIntervalScheduler.__init__(self, maxtrack=maxtrack)
+
+    def reset(self):
+        FixedIntervalScheduler.reset(self)
+        self.lastbox=None
+        self.level='Low'
+        self.last_dist=20000
+        self.interval=self.intervals[self.level]
+
+    def _average(self, average, sample):
+        if average is None:
+            return sample
+        return (1-self.smoothing)*average+self.smoothing*sample
+
+    def getBudgetInterval(self):
+        """
+        min interval k so that the average time per frame,
+        (detect + (k-1)*track)/k, is within 1/target_fps
+
+        """
+        if self.target_fps<=0 or self.detecttime is None or self.tracktime is None:
+            return 1
+        budget=1.0/self.target_fps
+        if budget<=self.tracktime:
+            return self.maxtrack
+        return max(1,int(math.ceil((self.detecttime-self.tracktime)/(budget-self.tracktime))))
+
+    def updateInterval(self):
+        interval=self.intervals[self.level]
+        if self.level!='High':
+            interval=max(interval,self.getBudgetInterval())
+        self.interval=min(interval,self.maxtrack)
+
+    def wantsTrack(self):
+        return self.solid and self.trackcount<self.interval
+
+    def getReason(self):
+        # the interval could shrink below trackcount when the vehicle closes in
+        if self.solid:
+            return 'interval'
+        return self.reason
+
+    def onTrack(self, success, bbox, tracktime):
+        self.tracktime=self._average(self.tracktime,tracktime)
+        reason=FixedIntervalScheduler.onTrack(self, success, bbox, tracktime)
+        if reason=='track_lost':
+            return reason
+        if self.lastbox is not None and self.lastbox[2]>0:
+            width=float(self.lastbox[2])
+            change=max(abs(bbox[2]-self.lastbox[2])/width,
+                       abs(bbox[3]-self.lastbox[3])/width,
+                       abs(bbox[0]+bbox[2]/2.0-self.lastbox[0]-self.lastbox[2]/2.0)/width,
+                       abs(bbox[1]+bbox[3]/2.0-self.lastbox[1]-self.lastbox[3]/2.0)/width)
+            if change>self.max_box_change:
+                return 'box_change'
+        self.lastbox=bbox
+        if self.trackcount>=self.interval:
+            return 'interval'
+        return None
+
+    def onDetect(self, has_leading, bbox, detecttime):
+        self.detecttime=self._average(self.detecttime,detecttime)
+        FixedIntervalScheduler.onDetect(self, has_leading, bbox, detecttime)
+        self.lastbox=bbox if has_leading else None
+
+    def onDistance(self, distance):
+        if distance==999999:
+            self.level='Low'
+        else:
+            # 10 fps, the same as the danger level drawn in tracking mode
+            self.level=getDangerLevel(distance,0.1,self.last_dist,0.1,
+                                      abs_dist_only=False)
+        self.last_dist=distance
+        self.updateInterval()
+
+
+def buildScheduler(name='fixed', maxtrack=None, target_fps=0):
+    """
+    build a scheduler by name, one of SCHEDULERS. maxtrack is 10 for the
+    fixed scheduler and 30 for the adaptive one if None
+
+    """
+    if name=='fixed':
+        return FixedIntervalScheduler(maxtrack=maxtrack or 10)
+    if name=='adaptive':
+        return AdaptiveScheduler(target_fps=target_fps, maxtrack=maxtrack or 30)
+    raise ValueError('invalid scheduler: {}'.format(name))
+
+''' End of File '''
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+on-disk cache of the raw outputs of the model
+
+each entry is a .npz file keyed by (sha1 of the frozen graph, sha1 of the image
+file), saved as cache_path/<model hash>/<image hash>.npz, so a different
+model never reads the results of another one, and a changed image is never
+matched with its old result.
+
+the modify time of an entry is updated on every hit, when the total size of
+the cache is over the cap, the entries used least recently are removed first.
+entries are written to a temp file and renamed, so a killed run never leaves
+a broken entry behind.
+"""
+
+import os
+import hashlib
+import numpy as np
+
+
+def hashFile(filepath, chunksize=1<<20):
+    """
+    sha1 of the content of a file
+
+    """
+    sha1=hashlib.sha1()
+    with open(filepath,'rb') as fid:
+        for chunk in iter(lambda: fid.read(chunksize), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def hashBuffer(buffer):
+    """
+    sha1 of the content of a file already read into memory, the same as 
+    hashFile of the file, e.g. the key of a frame from model_test.loadFrame
+
+    """
+    return hashlib.sha1(buffer).hexdigest()
+
+
+class DetectionCache():
+    """
+    LRU cache of output_dict of the model on disk, with a size cap
+
+    """
+    def __init__(self, cache_path, model_hash, max_size_mb=2048):
+        """
+        input:
+            cache_path: top folder of the cache, shared by all the models
+            model_hash: sha1 of the frozen graph, e.g. Detector.model_hash
+            max_size_mb: size cap of the whole cache folder in MB
+
+        """
+        self.cache_path=cache_path
+        self.model_path=os.path.join(cache_path,model_hash)
+        self.max_size=int(max_size_mb*1024*1024)
+        self.hits=0
+        self.misses=0
+        if not os.path.exists(self.model_path):
+            os.makedirs(self.model_path)
+        self.size=sum(size for _,size,_ in self._listEntries())
+
+    def _listEntries(self):
+        """
+        list all the entries of all the models as (path, size, mtime)
+
+        """
+        entries=[]
+        for model_hash in os.listdir(self.cache_path):
+            model_path=os.path.join(self.cache_path,model_hash)
+            if not os.path.isdir(model_path):
+                continue
+            for filename in os.listdir(model_path):
+                if not filename.endswith('.npz') or '.tmp' in filename:
+                    continue
+                filepath=os.path.join(model_path,filename)
+                try:
+                    stat=os.stat(filepath)
+                except OSError:
+                    continue # removed by another run
+                entries.append((filepath,stat.st_size,stat.st_mtime))
+        return entries
+
+    def get(self, key):
+        """
+        return the cached output_dict of the key, None if not cached
+
+        """
+        filepath=os.path.join(self.model_path,key+'.npz')
+        try:
+            with np.load(filepath) as data:
+                output_dict={name:data[name] for name in data.files}
+            os.utime(filepath,None) # mark as recently used
+        except (IOError, OSError, ValueError):
+            self.misses+=1
+            return None
+        self.hits+=1
+        return output_dict
+
+    def put(self, key, output_dict):
+        """
+        save output_dict under the key, then evict old entries if the cache
+        is over the size cap
+
+        """
+        filepath=os.path.join(self.model_path,key+'.npz')
+        # np.savez adds .npz to names without it, keep the suffix on the temp
+        tmppath=os.path.join(self.model_path,'{}.tmp{}.npz'.format(key,os.getpid()))
+        np.savez(tmppath,**output_dict)
+        self.size+=os.path.getsize(tmppath)
+        if os.path.exists(filepath):
+            self.size-=os.path.getsize(filepath)
+        os.replace(tmppath,filepath)
+        if self.size>self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        remove the least recently used entries until the cache is below 90%
+        of the size cap, so the eviction doesn't run on every put
+
+        """
+        entries=self._listEntries()
+        entries.sort(key=lambda entry: entry[2])
+        self.size=sum(size for _,size,_ in entries)
+        target=int(self.max_size*0.9)
+        for filepath,size,_ in entries:
+            if self.size<=target:
+                break
+            try:
+                os.remove(filepath)
+                self.size-=size
+            except OSError:
+                pass
+
+    def stats(self):
+        """
+        return hits, misses and the size of the cache in MB
+
+        """
+        return self.hits, self.misses, self.size/1024/1024
+
+''' End of File '''
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+a detector which loads the frozen graph once and keeps one session open, so
+the graph import, session startup and tensor lookup are paid only once, not
+per image or per folder
+
+usage example:
+    with Detector('/PATH/frozen_inference_graph.pb', intra_op_threads=4) as detector:
+        output_list = detector.detect([image_np])
+"""
+
+import hashlib
+import numpy as np
+import tensorflow as tf
+
+from object_detection.utils import ops as utils_ops
+
+# raw outputs before the NMS of the graph, for the custom NMS
+RAW_OUTPUTS=['Postprocessor/raw_box_encodings',
+             'Postprocessor/raw_box_locations',
+             'Postprocessor/raw_box_scores']
+# outputs after the NMS of the graph
+DETECTION_OUTPUTS=['num_detections', 'detection_boxes', 'detection_scores',
+                   'detection_classes', 'detection_masks']
+
+
+def loadFrozenGraph(ckpt_path):
+    """
+    load a frozen graph (.pb) into a new tf.Graph
+
+    output:
+        detection_graph: the loaded graph
+        model_hash: sha1 of the .pb file, identifies the model
+    """
+    detection_graph = tf.Graph()
+    with detection_graph.as_default():
+        od_graph_def = tf.GraphDef()
+        with tf.gfile.GFile(ckpt_path, 'rb') as fid:
+            serialized_graph = fid.read()
+            # there is a NonMaximumSupressionV3 in the graph, but only V1 & V2 given
+            # in the api if tf version<1.8.0
+            od_graph_def.ParseFromString(serialized_graph)
+            tf.import_graph_def(od_graph_def, name='')
+    model_hash=hashlib.sha1(serialized_graph).hexdigest()
+    return detection_graph, model_hash
+
+def getTensorDict(graph, keys):
+    """
+    get handles to the output tensors in keys which exist in the graph, and
+    build the mask reframe ops if detection_masks is fetched. each call adds
+    new ops to the graph, so call it once and reuse the result
+
+    the mask reframe takes the image size from the input tensor, so the same
+    ops work for images of any size
+
+    output:
+        tensor_dict: output tensors to be fetched
+        image_tensor: input tensor of the graph
+    """
+    with graph.as_default():
+        ops = graph.get_operations()
+        all_tensor_names = {output.name for op in ops for output in op.outputs}
+        tensor_dict = {}
+        for key in keys:
+            tensor_name = key + ':0'
+            if tensor_name in all_tensor_names:
+                tensor_dict[key] = graph.get_tensor_by_name(tensor_name)
+        image_tensor = graph.get_tensor_by_name('image_tensor:0')
+        if 'detection_masks' in tensor_dict:
+            # The following processing is only for single image
+            detection_boxes = tf.squeeze(tensor_dict['detection_boxes'], [0])
+            detection_masks = tf.squeeze(tensor_dict['detection_masks'], [0])
+            # Reframe is required to translate mask from box coordinates to image coordinates and fit the image size.
+            real_num_detection = tf.cast(tensor_dict['num_detections'][0], tf.int32)
+            detection_boxes = tf.slice(detection_boxes, [0, 0], [real_num_detection, -1])
+            detection_masks = tf.slice(detection_masks, [0, 0, 0], [real_num_detection, -1, -1])
+            image_shape = tf.shape(image_tensor)
+            detection_masks_reframed = utils_ops.reframe_box_masks_to_image_masks(detection_masks, detection_boxes, image_shape[1], image_shape[2])
+            detection_masks_reframed = tf.cast(tf.greater(detection_masks_reframed, 0.5), tf.uint8)
+            # Follow the convention by adding back the batch dimension
+            tensor_dict['detection_masks'] = tf.expand_dims(detection_masks_reframed, 0)
+    return tensor_dict, image_tensor
+
+
+class Detector():
+    """
+    frozen graph + one session, with the output tensors looked up once
+
+    """
+    def __init__(self, ckpt_path=None, graph=None, intra_op_threads=0,
+                 inter_op_threads=0):
+        """
+        input:
+            ckpt_path: path of the frozen graph, not used if graph is given
+            graph: an already loaded graph
+            intra_op_threads: threads used inside a single op, 0 for the
+                default of tensorflow
+            inter_op_threads: threads used to run independent ops, 0 for
+                the default of tensorflow
+
+        """
+        if graph is None:
+            if ckpt_path is None:
+                raise ValueError('either ckpt_path or graph should be given')
+            self.graph, self.model_hash = loadFrozenGraph(ckpt_path)
+        else:
+            self.graph=graph
+            self.model_hash=hashlib.sha1(graph.as_graph_def().SerializeToString()).hexdigest()
+
+        # all the ops are built before the session, the graph never grows
+        # afterwards
+        self.raw_tensor_dict, self.image_tensor = getTensorDict(self.graph, RAW_OUTPUTS)
+        self.detection_tensor_dict, _ = getTensorDict(self.graph, DETECTION_OUTPUTS)
+
+        config=tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                              inter_op_parallelism_threads=inter_op_threads)
+        self.sess=tf.Session(graph=self.graph, config=config)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.sess is not None:
+            self.sess.close()
+            self.sess=None
+
+    def detect(self, frames, raw=True):
+        """
+        run inference on a list of frames of the same size with one sess.run
+
+        input:
+            frames: list of h*w*3 uint8 frames in RGB color space
+            raw: if true, fetch the raw box locations and scores before the
+                NMS of the graph, otherwise fetch the detections after it
+        output:
+            output_list: list of output_dict, one for each frame. the raw
+                outputs keep a batch dimension of 1, the same as sess.run on
+                a single image (e.g. for updateAnnotationDict_Raw). the
+                detections are converted as in the tf object detection api
+                tutorial, num_detections is an int and the other outputs
+                have no batch dimension
+        """
+        if raw:
+            return self._run(self.raw_tensor_dict, frames)
+
+        if 'detection_masks' in self.detection_tensor_dict:
+            # the mask reframe only works for single image
+            output_list=[]
+            for frame in frames:
+                output_list.extend(self._run(self.detection_tensor_dict, [frame]))
+        else:
+            output_list=self._run(self.detection_tensor_dict, frames)
+
+        for output_dict in output_list:
+            # all outputs are float32 numpy arrays, so convert types as appropriate
+            output_dict['num_detections'] = int(output_dict['num_detections'][0])
+            output_dict['detection_classes'] = output_dict['detection_classes'][0].astype(np.uint8)
+            output_dict['detection_boxes'] = output_dict['detection_boxes'][0]
+            output_dict['detection_scores'] = output_dict['detection_scores'][0]
+            if 'detection_masks' in output_dict:
+                output_dict['detection_masks'] = output_dict['detection_masks'][0]
+        return output_list
+
+    def _run(self, tensor_dict, frames):
+        """
+        one sess.run on the stacked frames, then split the outputs back into
+        one output_dict per frame
+
+        """
+        if len(frames)==1:
+            feed=np.expand_dims(frames[0], 0)
+        else:
+            feed=np.stack(frames, 0)
+        output_batch = self.sess.run(tensor_dict,feed_dict={self.image_tensor: feed})
+        output_list=[]
+        for i in range(len(frames)):
+            output_list.append({key:output_batch[key][i:i+1] for key in output_batch})
+        return output_list
+
+''' End of File '''
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+producer/consumer helpers for running the detector over frame folders
+
+the frames are decoded by a reader pool ahead of the model, the model runs on
+the calling thread, and the post-processing and saving are handed over to
+worker stages. all the queues are bounded, so a slow stage blocks the stage
+before it instead of piling up decoded frames in memory.
+
+with num_workers=0 every helper runs its job on the calling thread, which
+gives exactly the old sequential behaviour.
+
+the frames of a folder are put in temporal order by the _NNNNN index in their
+names (e.g. VNX_10009_00012.png), not in the order of os.listdir.
+"""
+
+import re
+import collections
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, Future
+
+# VNX_10009_00012.png -> ('VNX_10009', 12)
+FRAME_INDEX=re.compile(r'^(.*)_(\d+)\.\w+$')
+
+
+def parseFrameIndex(imagename):
+    """
+    parse the video name and the frame index out of a frame name
+
+    output:
+        (video name, frame index), or (imagename, None) if the name has no
+        _NNNNN index
+    """
+    match=FRAME_INDEX.match(imagename)
+    if match is None:
+        return imagename, None
+    return match.group(1), int(match.group(2))
+
+def sortFrames(filenames):
+    """
+    sort the frame names by video name, then by frame index as a number, so
+    _00100 comes after _00099. the names without an index go last, sorted
+    by name
+
+    """
+    def frameKey(imagename):
+        video, index=parseFrameIndex(imagename)
+        if index is None:
+            return (1, imagename, 0)
+        return (0, video, index)
+    return sorted(filenames, key=frameKey)
+
+def findFrameGaps(framelist):
+    """
+    find the missing frame indices in a sorted frame list
+
+    output:
+        gaps: list of (frame before the gap, frame after the gap, number of
+            missing frames)
+    """
+    gaps=[]
+    for last, current in zip(framelist[:-1], framelist[1:]):
+        lastvideo, lastindex=parseFrameIndex(last)
+        video, index=parseFrameIndex(current)
+        if index is None or lastindex is None or video!=lastvideo:
+            continue
+        if index-lastindex>1:
+            gaps.append((last, current, index-lastindex-1))
+    return gaps
+
+def enumerateFrames(filenames):
+    """
+    get the jpg & png frames among filenames in temporal order
+
+    input:
+        filenames: e.g. os.listdir of a folder
+    output:
+        framelist: frame names in temporal order
+        gaps: see findFrameGaps
+    """
+    framelist=sortFrames([imagename for imagename in filenames
+                          if 'jpg' in imagename or 'png' in imagename])
+    return framelist, findFrameGaps(framelist)
+
+
+class FrameReader():
+    """
+    decode frames with a pool of threads and hand them out in input order
+
+    """
+    def __init__(self, num_workers=0, prefetch=16):
+        # prefetch: max number of frames decoded ahead of the consumer
+        self.num_workers=num_workers
+        self.prefetch=max(1,prefetch)
+
+    def read(self, loadfunc, items):
+        """
+        input:
+            loadfunc: function to decode a single item, e.g. loadFrame
+            items: list of argument tuples for loadfunc
+
+        output:
+            a generator of loadfunc(*item), in the same order as items
+
+        """
+        if self.num_workers<=0:
+            for item in items:
+                yield loadfunc(*item)
+            return
+
+        pending=collections.deque()
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            for item in items:
+                pending.append(pool.submit(loadfunc,*item))
+                # backpressure, don't run more than prefetch frames ahead
+                if len(pending)>=self.prefetch:
+                    yield pending.popleft().result()
+            while len(pending)>0:
+                yield pending.popleft().result()
+
+
+class StageWorker():
+    """
+    run jobs of a pipeline stage on worker threads, at most max_pending jobs
+    could wait in the stage, submit() blocks when the stage is full.
+
+    with num_workers=1 the jobs are run in the order of submission. with
+    num_workers=0 the jobs are run on the calling thread at submit().
+
+    """
+    def __init__(self, num_workers=0, max_pending=32):
+        self.num_workers=num_workers
+        self.futures=[]
+        if num_workers>0:
+            self.pool=ThreadPoolExecutor(max_workers=num_workers)
+            self.slots=threading.BoundedSemaphore(max(1,max_pending))
+        else:
+            self.pool=None
+            self.slots=None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _release(self, future):
+        self.slots.release()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        submit a job, return a future of the result of func(*args, **kwargs)
+
+        """
+        if self.pool is None:
+            future=Future()
+            future.set_result(func(*args,**kwargs))
+            return future
+
+        self.slots.acquire()
+        future=self.pool.submit(func,*args,**kwargs)
+        future.add_done_callback(self._release)
+        self.futures.append(future)
+        return future
+
+    def join(self):
+        """
+        wait for all the submitted jobs, raise the first error of the jobs
+
+        """
+        futures=self.futures
+        self.futures=[]
+        for future in futures:
+            future.result()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool=None
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+load images as h*w*3 uint8 numpy arrays in RGB color space for the models
+
+loadImageInNpArray used to be copied in model_test.py and model_performance.py
+and built the array from image.getdata(), a python sequence of pixel tuples.
+here the array is taken directly from the buffer of the decoder instead.
+
+readImage decodes a file only once with opencv, and returns both the BGR frame
+(for opencv trackers and drawing) and the RGB frame (for the models).
+decodeImage does the same for the bytes of a file already read, e.g. when the
+bytes are hashed as well.
+
+usage example of the micro-benchmark:
+    python3 image_loader.py --image_path /YOUR/IMG/PATH/VNX_10009_00012.png
+    --repeat 20
+"""
+
+import argparse
+import time
+import cv2
+import numpy as np
+
+from PIL import Image
+
+
+def loadImageInNpArray_getdata(image):
+    """
+    the old implementation of loadImageInNpArray, only kept for the benchmark
+
+    """
+    (im_width, im_height) = image.size
+    return np.array(image.getdata()).reshape((im_height, im_width, 3)).astype(np.uint8)
+
+def loadImageInNpArray(image):
+    """
+    convert a PIL image into h*w*3 in uint8 format, RGB color space
+
+    """
+    if image.mode!='RGB':
+        image=image.convert('RGB')
+    return np.asarray(image, dtype=np.uint8)
+
+def readImage(filepath):
+    """
+    decode an image file once with opencv
+
+    input:
+        filepath: path of the image
+    output:
+        image_cv: h*w*3 uint8 in BGR color space, None if failed to decode
+        image_np: h*w*3 uint8 in RGB color space, None if failed to decode
+
+    """
+    image_cv = cv2.imread(filepath)
+    if image_cv is None:
+        return None, None
+    image_np = cv2.cvtColor(image_cv, cv2.COLOR_BGR2RGB)
+    return image_cv, image_np
+
+def decodeImage(buffer):
+    """
+    decode the bytes of an image file with opencv, the same as readImage
+
+    input:
+        buffer: content of the image file in bytes
+    output:
+        image_cv: h*w*3 uint8 in BGR color space, None if failed to decode
+        image_np: h*w*3 uint8 in RGB color space, None if failed to decode
+
+    """
+    image_cv = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image_cv is None:
+        return None, None
+    image_np = cv2.cvtColor(image_cv, cv2.COLOR_BGR2RGB)
+    return image_cv, image_np
+
+def benchmarkLoaders(filepath, repeat=20):
+    """
+    compare the old and new loaders on a single image, print the average time
+    per call of each loader, and check that all of them give the same array
+
+    """
+    timing={}
+
+    # old way in model_test.py: decode with opencv and PIL, then getdata
+    start=time.time()
+    for i in range(repeat):
+        image_cv = cv2.imread(filepath)
+        image = Image.open(filepath)
+        image_old = loadImageInNpArray_getdata(image)
+    timing['imread + Image.open + getdata']=(time.time()-start)/repeat
+
+    start=time.time()
+    for i in range(repeat):
+        image = Image.open(filepath)
+        image_pil = loadImageInNpArray(image)
+    timing['Image.open + asarray']=(time.time()-start)/repeat
+
+    start=time.time()
+    for i in range(repeat):
+        image_cv, image_np = readImage(filepath)
+    timing['imread + cvtColor']=(time.time()-start)/repeat
+
+    for key in timing:
+        print('{:<32}{:.2f} ms'.format(key,timing[key]*1000))
+    print('PIL loader matches old loader: {}'.format(np.array_equal(image_old,image_pil)))
+    print('opencv loader matches old loader: {}'.format(np.array_equal(image_old,image_np)))
+
+    return timing
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--image_path', type=str,
+                        default='D:/Private Manager/Personal File/uOttawa/Lab works/2018 summer/Leading Vehicle/Viewnyx dataset/Part3_videoframes/VNX_10009/VNX_10009_00012.png',
+                        help="image used for the benchmark")
+    parser.add_argument('--repeat', type=int, default=20,
+                        help="how many times each loader is called")
+    args = parser.parse_args()
+
+    benchmarkLoaders(args.image_path, repeat=args.repeat)
+
+''' End of File '''
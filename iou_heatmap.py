@@ -19,7 +19,7 @@ import matplotlib.pyplot as plt
 from matplotlib import cm
 from matplotlib.colors import ListedColormap, LinearSegmentedColormap
 
-import check_performance as chp
+from iou_matrix import getAnchorIoUMatrix
 
 
 savedKmeanList={'ssd-strip-gt22':[
@@ -112,45 +112,32 @@ def getIoUMats(KmeanList, boxes, fast=True):
     given the centroids lists of kmeans result and ground truth boxes, compute
     the 300x300 iou matrix
     
+    the IoU of all the boxes and all the centroids is computed at once, with
+    fast=True each box shape is computed only once, otherwise the mean IoU of
+    all the boxes is printed too
+    
     """
     
     ioumat_dict={}
+    shapes=np.array(boxes,dtype=np.int64).reshape(-1,2)
+    # regulation for rounded indices
+    shapes[shapes==300]=299
+    if fast:
+        # skip the shapes already calculated
+        shapes=np.unique(shapes,axis=0)
     
     for model_name in KmeanList:
         centroids = savedKmeanList[model_name]
         ioumat=np.zeros([300,300])
-        meaniou=[]
-        for [w,h] in boxes:
-            # regulation for rounded indices
-            if w==300:
-                w=299
-            if h==300:
-                h=299
-            
-            # fast and slow methods
-            if fast:
-                if ioumat[w,h]==0:# skip if already calculated (!=0)
-                    bbx1={'x':0, 'y':0, 'width':w, 'height':h}
-                    ioulist=[]
-                    for [c_w,c_h] in centroids:
-                        bbx2={'x':0,'y':0,'width':c_w,'height':c_h}
-                        ioulist.append(chp.getIoU(bbx1,bbx2))
-                    ioumat[w,h]=max(ioulist)
-            else:
-                bbx1={'x':0, 'y':0, 'width':w, 'height':h}
-                ioulist=[]
-                for [c_w,c_h] in centroids:
-                    bbx2={'x':0,'y':0,'width':c_w,'height':c_h}
-                    ioulist.append(chp.getIoU(bbx1,bbx2))
-                iou=max(ioulist)
-                meaniou.append(iou)
-                ioumat[w,h]=iou
+        # best IoU among the centroids for each box
+        ious=getAnchorIoUMatrix(shapes,centroids).max(axis=1)
+        ioumat[shapes[:,0],shapes[:,1]]=ious
                 
         # for each model, save iou matrix and print meaniou        
         ioumat_dict[model_name]=ioumat
         if not fast:
             print('model: {}'.format(model_name))
-            print('mean IoU: {}'.format(np.mean(np.array(meaniou))))
+            print('mean IoU: {}'.format(np.mean(ious)))
         
     return ioumat_dict
                 
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+IoU of boxes in numpy arrays, shared by the evaluation scripts, the NMS and
+the trackers, instead of one scalar getIoU in each of them
+
+two box formats are taken:
+    'xywh': (x_min, y_min, width, height), the format of the json annotations
+    'yxyx': (y_min, x_min, y_max, x_max), the format of the model outputs
+        and of myGreedyNMS
+
+the coordinates, intersections and areas are computed in dtype (float32 or
+float64, or None to keep the precision of the boxes), the division is done
+in float64 as the old scalar getIoU did. a pair of boxes with no area at all
+gets an IoU of 0.
+
+usage example:
+    iou = getIoUMatrix(boxesFromAnnotations(predictions),
+                       boxesFromAnnotations(groundtruths)) # [P,G]
+"""
+
+import numpy as np
+
+BOX_FORMATS=['xywh','yxyx']
+
+
+def toCorners(boxes, box_format='xywh', dtype=np.float64):
+    """
+    convert boxes to an array of corners
+
+    input:
+        boxes: [...,4] array or nested list in box_format
+        dtype: dtype of the output, None to keep the float type of boxes
+    output:
+        corners: [...,4] array of (x_min, y_min, x_max, y_max), or of
+            (y_min, x_min, y_max, x_max) for 'yxyx' boxes, which are not
+            copied. the IoU doesn't depend on the order of the axes
+    """
+    boxes=np.asarray(boxes)
+    if dtype is None:
+        dtype=np.result_type(boxes, np.float32)
+    boxes=boxes.astype(dtype, copy=False)
+    if box_format=='xywh':
+        return np.stack([boxes[...,0], boxes[...,1],
+                         boxes[...,0]+boxes[...,2], boxes[...,1]+boxes[...,3]],
+                        axis=-1)
+    if box_format=='yxyx':
+        return boxes
+    raise ValueError('invalid box format: {}'.format(box_format))
+
+def getIoUCorners(corners_a, corners_b):
+    """
+    IoU of boxes in corners, the two arrays are broadcast against each other.
+    both should have the axes in the same order
+
+    input:
+        corners_a, corners_b: [...,4] arrays from toCorners
+    output:
+        iou: float64 array of the broadcast shape without the last axis
+    """
+    a_x1, a_y1, a_x2, a_y2 = (corners_a[...,k] for k in range(4))
+    b_x1, b_y1, b_x2, b_y2 = (corners_b[...,k] for k in range(4))
+
+    # get intersect area
+    inter_area=np.maximum(0, np.minimum(a_x2,b_x2) - np.maximum(a_x1,b_x1)) \
+              *np.maximum(0, np.minimum(a_y2,b_y2) - np.maximum(a_y1,b_y1))
+
+    # get bbx area
+    union=((a_x2-a_x1)*(a_y2-a_y1) + (b_x2-b_x1)*(b_y2-b_y1) - inter_area).astype(np.float64)
+
+    iou=np.zeros_like(union)
+    np.divide(inter_area, union, out=iou, where=union>0)
+    return iou
+
+def getIoUMatrix(boxes_a, boxes_b, box_format='xywh', dtype=np.float64):
+    """
+    IoU between every pair of boxes of two lists in one broadcast
+
+    input:
+        boxes_a: [P,4] boxes, e.g. the predictions
+        boxes_b: [G,4] boxes, e.g. the groundtruths
+        box_format: one of BOX_FORMATS, the same for both lists
+        dtype: np.float32, np.float64, or None to keep the float type of
+            the boxes
+    output:
+        iou: [P,G] float64 array
+    """
+    if dtype is None:
+        dtype=np.result_type(np.asarray(boxes_a), np.asarray(boxes_b), np.float32)
+    corners_a=toCorners(boxes_a, box_format, dtype).reshape(-1,4)
+    corners_b=toCorners(boxes_b, box_format, dtype).reshape(-1,4)
+    if len(corners_a)==1:
+        # one box against many, e.g. in the NMS, scalar against 1d is faster
+        return getIoUCorners(corners_a[0], corners_b)[None,:]
+    return getIoUCorners(corners_a[:,None,:], corners_b[None,:,:])
+
+def getPairwiseIoU(boxes_a, boxes_b, box_format='xywh', dtype=np.float64):
+    """
+    IoU of boxes_a[i] and boxes_b[i] for each i, the diagonal of
+    getIoUMatrix without computing the rest
+
+    output:
+        iou: [N] float64 array
+    """
+    if dtype is None:
+        dtype=np.result_type(np.asarray(boxes_a), np.asarray(boxes_b), np.float32)
+    corners_a=toCorners(boxes_a, box_format, dtype).reshape(-1,4)
+    corners_b=toCorners(boxes_b, box_format, dtype).reshape(-1,4)
+    return getIoUCorners(corners_a, corners_b)
+
+def getAnchorIoUMatrix(shapes, anchors, dtype=np.float64):
+    """
+    IoU between box shapes and anchor shapes, both put at the same corner,
+    i.e. only the width and height are compared, as for the kmeans anchors
+
+    input:
+        shapes: [N,2] (width, height)
+        anchors: [K,2] (width, height)
+    output:
+        iou: [N,K] float64 array
+    """
+    shapes=np.asarray(shapes).astype(dtype, copy=False).reshape(-1,2)
+    anchors=np.asarray(anchors).astype(dtype, copy=False).reshape(-1,2)
+    zeros_shapes=np.zeros_like(shapes)
+    zeros_anchors=np.zeros_like(anchors)
+    return getIoUMatrix(np.concatenate([zeros_shapes,shapes],axis=1),
+                        np.concatenate([zeros_anchors,anchors],axis=1),
+                        box_format='xywh', dtype=dtype)
+
+def boxesFromAnnotations(annotations, dtype=np.float64):
+    """
+    [N,4] 'xywh' array of a list of annotation boxes in the format of VIVA
+    Annotation, e.g. annotationdict[imagename]['annotations']
+
+    """
+    boxes=np.zeros((len(annotations),4), dtype=dtype)
+    for i, anno in enumerate(annotations):
+        boxes[i]=(anno['x'], anno['y'], anno['width'], anno['height'])
+    return boxes
+
+def getIoUPair(box_a, box_b, box_format='xywh'):
+    """
+    IoU of a single pair of boxes in plain python, which is much faster than 
+    numpy for one pair, e.g. once per frame or once per candidate. the same
+    value as getPairwiseIoU with dtype=None. use getIoUMatrix for many boxes
+
+    input:
+        box_a, box_b: sequences of at least 4 numbers in box_format, the
+            numbers after the first 4 are ignored
+    output:
+        iou: float, 0 for a pair with no area
+    """
+    if box_format=='xywh':
+        a_x1, a_y1 = box_a[0], box_a[1]
+        a_x2, a_y2 = a_x1+box_a[2], a_y1+box_a[3]
+        b_x1, b_y1 = box_b[0], box_b[1]
+        b_x2, b_y2 = b_x1+box_b[2], b_y1+box_b[3]
+    elif box_format=='yxyx':
+        a_x1, a_y1, a_x2, a_y2 = box_a[0], box_a[1], box_a[2], box_a[3]
+        b_x1, b_y1, b_x2, b_y2 = box_b[0], box_b[1], box_b[2], box_b[3]
+    else:
+        raise ValueError('invalid box format: {}'.format(box_format))
+
+    inter_area=max(0, min(a_x2,b_x2) - max(a_x1,b_x1)) \
+              *max(0, min(a_y2,b_y2) - max(a_y1,b_y1))
+    union=(a_x2-a_x1)*(a_y2-a_y1) + (b_x2-b_x1)*(b_y2-b_y1) - inter_area
+    if union<=0:
+        return 0.0
+    return float(inter_area)/float(union)
+
+def getIoU(bbx_benchmark, bbx_detect):
+    """
+    IoU of two annotation boxes {'x','y','width','height',...others}, for a
+    single pair, e.g. once per frame in combine_heavy_and_light_network.py
+
+    """
+    return getIoUPair((bbx_benchmark['x'], bbx_benchmark['y'],
+                       bbx_benchmark['width'], bbx_benchmark['height']),
+                      (bbx_detect['x'], bbx_detect['y'],
+                       bbx_detect['width'], bbx_detect['height']))
+
+''' End of File '''
@@ -37,6 +37,9 @@ from object_detection.utils import ops as utils_ops
 from object_detection.utils import label_map_util
 from object_detection.utils import visualization_utils as vis_util
 
+from image_loader import readImage
+from detector import Detector
+
 os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
 os.environ["CUDA_VISIBLE_DEVICES"] = "1"
 
@@ -85,51 +88,43 @@ def carClassifier(x,y,width,height,threshold=0.2, strip_x1=305,strip_x2=335):
 def returnbottomy(bbx):
     return bbx['y']+bbx['height']
 
-def loadImageInNpArray(image):
-    # convert input image into h*w*3 in uint8 format, BGR color space
-    (im_width, im_height) = image.size
-    return np.array(image.getdata()).reshape((im_height, im_width, 3)).astype(np.uint8)
-
-def detectSingleImage(image, graph):
-    with graph.as_default():
-        with tf.Session() as sess:
-            # Get handles to input and output tensors
-            ops = tf.get_default_graph().get_operations()
-            all_tensor_names = {output.name for op in ops for output in op.outputs}
-            tensor_dict = {}
-            for key in [
-                    'num_detections', 'detection_boxes', 'detection_scores',
-                    'detection_classes', 'detection_masks'
-            ]:
-                tensor_name = key + ':0'
-                if tensor_name in all_tensor_names:
-                    tensor_dict[key] = tf.get_default_graph().get_tensor_by_name(tensor_name)
-            if 'detection_masks' in tensor_dict:
-                # The following processing is only for single image
-                detection_boxes = tf.squeeze(tensor_dict['detection_boxes'], [0])
-                detection_masks = tf.squeeze(tensor_dict['detection_masks'], [0])
-                # Reframe is required to translate mask from box coordinates to image coordinates and fit the image size.
-                real_num_detection = tf.cast(tensor_dict['num_detections'][0], tf.int32)
-                detection_boxes = tf.slice(detection_boxes, [0, 0], [real_num_detection, -1])
-                detection_masks = tf.slice(detection_masks, [0, 0, 0], [real_num_detection, -1, -1])
-                detection_masks_reframed = utils_ops.reframe_box_masks_to_image_masks(detection_masks, detection_boxes, image.shape[0], image.shape[1])
-                detection_masks_reframed = tf.cast(tf.greater(detection_masks_reframed, 0.5), tf.uint8)
-                # Follow the convention by adding back the batch dimension
-                tensor_dict['detection_masks'] = tf.expand_dims(detection_masks_reframed, 0)
-            image_tensor = tf.get_default_graph().get_tensor_by_name('image_tensor:0')
+def checkGraphGrowth(graph, opcount, latencylist, window=100):
+    """
+    check that the graph stays the same size and the detection time doesn't
+    grow over a folder. the average time of the first and the last window
+    frames is compared, the first frame is skipped as warm-up
+    
+    input:
+        graph: the detection graph
+        opcount: number of ops in the graph before the folder
+        latencylist: detection time of each frame in the folder
+    output:
+        growth: dict of op counts and first/last window average times
+    """
+    growth={}
+    growth['ops_before']=opcount
+    growth['ops_after']=len(graph.get_operations())
+    latency=latencylist[1:] if len(latencylist)>2 else latencylist
+    window=max(1,min(window,len(latency)//2))
+    growth['first_window_time']=float(np.mean(latency[:window])) if len(latency)>0 else 0.0
+    growth['last_window_time']=float(np.mean(latency[-window:])) if len(latency)>0 else 0.0
+    print('graph ops: {} -> {}, average detection time of first/last {} frames: {:.4f} s / {:.4f} s'.format(
+            growth['ops_before'],growth['ops_after'],window,
+            growth['first_window_time'],growth['last_window_time']))
+    if growth['ops_after']!=growth['ops_before']:
+        print('warning: the graph grew by {} ops while processing the folder'.format(
+                growth['ops_after']-growth['ops_before']))
+    return growth
 
-            # Run inference
-            output_dict = sess.run(tensor_dict,feed_dict={image_tensor: np.expand_dims(image, 0)})
-            # all outputs are float32 numpy arrays, so convert types as appropriate
-            output_dict['num_detections'] = int(output_dict['num_detections'][0])
-            output_dict['detection_classes'] = output_dict['detection_classes'][0].astype(np.uint8)
-            output_dict['detection_boxes'] = output_dict['detection_boxes'][0]
-            output_dict['detection_scores'] = output_dict['detection_scores'][0]
-            if 'detection_masks' in output_dict:
-                output_dict['detection_masks'] = output_dict['detection_masks'][0]
-    return output_dict
+def detectSingleImage(image, detector):
+    """
+    run the detector (a detector.Detector) on a single image, return the 
+    detections after the NMS of the graph
+    
+    """
+    return detector.detect([image], raw=False)[0]
 
-def detectMultipleImages(detection_graph, category_index, testimgpath, 
+def detectMultipleImages(detector, category_index, testimgpath, 
                               foldernumber, outputthresh, saveimg_flag=True):
     '''
     load the frozen graph (model) and run detection among all the images
@@ -138,7 +133,7 @@ def detectMultipleImages(detection_graph, category_index, testimgpath,
         testimgpath: the top level of your image folders, note that subfolders 
             are considered as default
         foldernumber: how many subfolders do you want to test
-        detection_graph: the loaded frozen graph
+        detector: a detector.Detector with the loaded frozen graph
         category_index: index to convert category labels into numbers
         outputthresh
         saveimg_flag: if ture, save detection results under subfolder 'leadingdetect'
@@ -150,135 +145,105 @@ def detectMultipleImages(detection_graph, category_index, testimgpath,
 
     foldercount=0
     
-    # initialize the graph once for all
-    with detection_graph.as_default():
-        with tf.Session() as sess:
-    
-    
-            folderdict=os.listdir(testimgpath)
-            for folder in folderdict:
-                # skip the files, choose folders only
-                if '.' in folder:
-                    continue 
-                
-                # for debug, set the number of folders to be processed
-                if foldercount>=foldernumber:
-                    break
-                else:
-                    foldercount+=1
+    # the graph, the tensor handles, the mask reframe ops and the session 
+    # are built once by the detector and reused for every frame
+    folderdict=os.listdir(testimgpath)
+    for folder in folderdict:
+        # skip the files, choose folders only
+        if '.' in folder:
+            continue 
+        
+        # for debug, set the number of folders to be processed
+        if foldercount>=foldernumber:
+            break
+        else:
+            foldercount+=1
+        
+        # show folder name and create save path
+        imagepath=os.path.join(testimgpath,folder)
+        print('processing folder:',imagepath)
+        if saveimg_flag:
+            savepath=os.path.join(testimgpath,folder,'leadingdetect')
+            if not os.path.exists(savepath):
+                os.makedirs(savepath)
+        
+        filedict=os.listdir(imagepath)
+        annotationdict={} # save all detection result into json file
+        opcount=len(detector.graph.get_operations())
+        latencylist=[] # detection time of each frame
+        
+        for imagename in filedict:
+            if 'jpg' in imagename or 'png' in imagename:
+                # the array based representation of the image will be used 
+                # later in order to prepare the
+                # result image with boxes and labels on it.
+                _, image_np = readImage(os.path.join(imagepath,imagename))
+                if image_np is None:
+                    continue
+                # Expand dimensions since the model expects images to have shape: [1, None, None, 3]
+                # image_np_expanded = np.expand_dims(image_np, axis=0)
                 
-                # show folder name and create save path
-                imagepath=os.path.join(testimgpath,folder)
-                print('processing folder:',imagepath)
-                if saveimg_flag:
-                    savepath=os.path.join(testimgpath,folder,'leadingdetect')
-                    if not os.path.exists(savepath):
-                        os.makedirs(savepath)
+                ##################### Actual detection ######################
+                # Run inference
+                starttime=time.time()
+                output_dict = detector.detect([image_np], raw=False)[0]
+                latencylist.append(time.time()-starttime)
                 
-                filedict=os.listdir(imagepath)
-                annotationdict={} # save all detection result into json file
+                ########### save detection result (output_dict) ############
+                ###### into jsondict in the format of VIVA Annotation ######
+                annotationdict[imagename]={}
+                annotationdict[imagename]['name']=imagename
+                (im_height, im_width) = image_np.shape[0:2]
+                annotationdict[imagename]['width']=im_width
+                annotationdict[imagename]['height']=im_height
+                annotationdict[imagename]['annotations']=[]
                 
-                for imagename in filedict:
-                    if 'jpg' in imagename or 'png' in imagename:
-                        image = cv2.imread(os.path.join(imagepath,imagename))
-                        if image is None:
-                            continue
-                        image = Image.open(os.path.join(imagepath,imagename))
-                        # the array based representation of the image will be used 
-                        # later in order to prepare the
-                        # result image with boxes and labels on it.
-                        image_np = loadImageInNpArray(image)
-                        # Expand dimensions since the model expects images to have shape: [1, None, None, 3]
-                        # image_np_expanded = np.expand_dims(image_np, axis=0)
-                        
-                        ##################### Actual detection ######################
-                        # Get handles to input and output tensors
-                        ops = tf.get_default_graph().get_operations()
-                        all_tensor_names = {output.name for op in ops for output in op.outputs}
-                        tensor_dict = {}
-                        for key in [
-                                'num_detections', 'detection_boxes', 'detection_scores',
-                                'detection_classes', 'detection_masks'
-                        ]:
-                            tensor_name = key + ':0'
-                            if tensor_name in all_tensor_names:
-                                tensor_dict[key] = tf.get_default_graph().get_tensor_by_name(tensor_name)
-                        if 'detection_masks' in tensor_dict:
-                            # The following processing is only for single image
-                            detection_boxes = tf.squeeze(tensor_dict['detection_boxes'], [0])
-                            detection_masks = tf.squeeze(tensor_dict['detection_masks'], [0])
-                            # Reframe is required to translate mask from box coordinates to image coordinates and fit the image size.
-                            real_num_detection = tf.cast(tensor_dict['num_detections'][0], tf.int32)
-                            detection_boxes = tf.slice(detection_boxes, [0, 0], [real_num_detection, -1])
-                            detection_masks = tf.slice(detection_masks, [0, 0, 0], [real_num_detection, -1, -1])
-                            detection_masks_reframed = utils_ops.reframe_box_masks_to_image_masks(detection_masks, detection_boxes, image_np.shape[0], image_np.shape[1])
-                            detection_masks_reframed = tf.cast(tf.greater(detection_masks_reframed, 0.5), tf.uint8)
-                            # Follow the convention by adding back the batch dimension
-                            tensor_dict['detection_masks'] = tf.expand_dims(detection_masks_reframed, 0)
-                        image_tensor = tf.get_default_graph().get_tensor_by_name('image_tensor:0')
-                        # Run inference
-                        output_dict = sess.run(tensor_dict,feed_dict={image_tensor: np.expand_dims(image_np, 0)})
-                        # all outputs are float32 numpy arrays, so convert types as appropriate
-                        output_dict['num_detections'] = int(output_dict['num_detections'][0])
-                        output_dict['detection_classes'] = output_dict['detection_classes'][0].astype(np.uint8)
-                        output_dict['detection_boxes'] = output_dict['detection_boxes'][0]
-                        output_dict['detection_scores'] = output_dict['detection_scores'][0]
-                        if 'detection_masks' in output_dict:
-                            output_dict['detection_masks'] = output_dict['detection_masks'][0]
-                        
-                        ########### save detection result (output_dict) ############
-                        ###### into jsondict in the format of VIVA Annotation ######
-                        annotationdict[imagename]={}
-                        annotationdict[imagename]['name']=imagename
-                        (im_width, im_height) = image.size
-                        annotationdict[imagename]['width']=im_width
-                        annotationdict[imagename]['height']=im_height
-                        annotationdict[imagename]['annotations']=[]
+                for i in range(output_dict['num_detections']):
+                    if output_dict['detection_scores'][i] < outputthresh:
+                        continue
+                    else:
+                        annodict={}
+                        annodict['id']=i
+                        annodict['shape']=['Box',1]
+                        annodict['label']=getClass(output_dict['detection_classes'][i])
+                        ymin,xmin,ymax,xmax=output_dict['detection_boxes'][i]
+                        annodict['x']=int(xmin*im_width)
+                        annodict['y']=int(ymin*im_height)
+                        annodict['width']=int((xmax-xmin)*im_width)
+                        annodict['height']=int((ymax-ymin)*im_height)
+                        annodict['category']=carClassifier(annodict['x'],annodict['y'],annodict['width'],annodict['height'])
+                        #annodict['score']=int(output_dict['detection_scores'][i]*100)
                         
-                        for i in range(output_dict['num_detections']):
-                            if output_dict['detection_scores'][i] < outputthresh:
-                                continue
-                            else:
-                                annodict={}
-                                annodict['id']=i
-                                annodict['shape']=['Box',1]
-                                annodict['label']=getClass(output_dict['detection_classes'][i])
-                                ymin,xmin,ymax,xmax=output_dict['detection_boxes'][i]
-                                annodict['x']=int(xmin*im_width)
-                                annodict['y']=int(ymin*im_height)
-                                annodict['width']=int((xmax-xmin)*im_width)
-                                annodict['height']=int((ymax-ymin)*im_height)
-                                annodict['category']=carClassifier(annodict['x'],annodict['y'],annodict['width'],annodict['height'])
-                                #annodict['score']=int(output_dict['detection_scores'][i]*100)
-                                
-                                annotationdict[imagename]['annotations'].append(annodict)
-                        
-                        # loop through all bbx with category 'leading', draw the nearest one in red bbx
-                        annotationdict[imagename]['annotations'].sort(key=returnbottomy,reverse=True)
-                        leadingflag=True
-                        if saveimg_flag:
-                            img=cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
-                            font=cv2.FONT_HERSHEY_SIMPLEX
-                            linetype=cv2.LINE_AA
-                            for i in range(len(annotationdict[imagename]['annotations'])):
-                                tl=(annotationdict[imagename]['annotations'][i]['x'],annotationdict[imagename]['annotations'][i]['y'])
-                                br=(annotationdict[imagename]['annotations'][i]['x']+annotationdict[imagename]['annotations'][i]['width'],annotationdict[imagename]['annotations'][i]['y']+annotationdict[imagename]['annotations'][i]['height'])
-                                if leadingflag and annotationdict[imagename]['annotations'][i]['category']=='leading':
-                                    leadingflag=False
-                                    img=cv2.rectangle(img,tl,br,(0,0,255),2) # red
-                                    #cv2.putText(img, 'leading', tl, font, 1, (0,0,255), 1, lineType=linetype)
-                                else:
-                                    # caution!!! this step will change the annotation result!!!
-                                    annotationdict[imagename]['annotations'][i]['category']='sideways'
-                                    img=cv2.rectangle(img,tl,br,(0,255,0),2) # green
-                                    #cv2.putText(img, 'sideways', tl, font, 1, (0,255,0), 1, lineType=linetype)
-        
-                            cv2.imwrite(os.path.join(savepath,imagename.split('.')[0]+'_leadingdetect.jpg'),img) # don't save it in png!!!
+                        annotationdict[imagename]['annotations'].append(annodict)
                 
-                # after done save all the annotation into json file, save the file
-                with open(os.path.join(imagepath,'annotation_'+folder+'_detection.json'),'w') as savefile:
-                    savefile.write(json.dumps(annotationdict, sort_keys = True, indent = 4))
-                    
+                # loop through all bbx with category 'leading', draw the nearest one in red bbx
+                annotationdict[imagename]['annotations'].sort(key=returnbottomy,reverse=True)
+                leadingflag=True
+                if saveimg_flag:
+                    img=cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+                    font=cv2.FONT_HERSHEY_SIMPLEX
+                    linetype=cv2.LINE_AA
+                    for i in range(len(annotationdict[imagename]['annotations'])):
+                        tl=(annotationdict[imagename]['annotations'][i]['x'],annotationdict[imagename]['annotations'][i]['y'])
+                        br=(annotationdict[imagename]['annotations'][i]['x']+annotationdict[imagename]['annotations'][i]['width'],annotationdict[imagename]['annotations'][i]['y']+annotationdict[imagename]['annotations'][i]['height'])
+                        if leadingflag and annotationdict[imagename]['annotations'][i]['category']=='leading':
+                            leadingflag=False
+                            img=cv2.rectangle(img,tl,br,(0,0,255),2) # red
+                            #cv2.putText(img, 'leading', tl, font, 1, (0,0,255), 1, lineType=linetype)
+                        else:
+                            # caution!!! this step will change the annotation result!!!
+                            annotationdict[imagename]['annotations'][i]['category']='sideways'
+                            img=cv2.rectangle(img,tl,br,(0,255,0),2) # green
+                            #cv2.putText(img, 'sideways', tl, font, 1, (0,255,0), 1, lineType=linetype)
+
+                    cv2.imwrite(os.path.join(savepath,imagename.split('.')[0]+'_leadingdetect.jpg'),img) # don't save it in png!!!
+        
+        checkGraphGrowth(detector.graph, opcount, latencylist)
+        
+        # after done save all the annotation into json file, save the file
+        with open(os.path.join(imagepath,'annotation_'+folder+'_detection.json'),'w') as savefile:
+            savefile.write(json.dumps(annotationdict, sort_keys = True, indent = 4))
+            
     return output_dict, annotationdict
 
 if __name__=='__main__':
@@ -302,6 +267,10 @@ if __name__=='__main__':
                         help="flag for saving detection result of not, default as True")
     parser.add_argument('--output_thresh', type=float, default=0.3,
                         help='threshold of score for output the detected bbxs (default=0.3)')
+    parser.add_argument('--intra_op_threads',type=int,default=0,
+                        help='threads used inside a single op of the model, 0 for the default of tensorflow')
+    parser.add_argument('--inter_op_threads',type=int,default=0,
+                        help='threads used to run independent ops of the model, 0 for the default of tensorflow')
     args = parser.parse_args()
     
     ckptpath = args.ckpt_path
@@ -316,21 +285,9 @@ if __name__=='__main__':
     IMAGE_SIZE = (12, 8)# Size, in inches, of the output images.
     
     # Load a (frozen) Tensorflow model into memory
-    detection_graph = tf.Graph()
-    with detection_graph.as_default():
-        od_graph_def = tf.GraphDef()
-        with tf.gfile.GFile(ckptpath, 'rb') as fid:
-            serialized_graph = fid.read()
-            # the od_graph_def is the config file for the network
-            # when display this variable, please wait, cause it read the file in binary
-            # but display with utf8
-            
-            # there is a NonMaximumSupressionV3 in the graph, but only V1 & V2 given
-            # in the api if tf version<1.8.0
-            od_graph_def.ParseFromString(serialized_graph)
-            tf.import_graph_def(od_graph_def, name='')
-            
- 
+    detector = Detector(ckptpath, intra_op_threads=args.intra_op_threads,
+                        inter_op_threads=args.inter_op_threads)
+    
     # Loading label map
     label_map = label_map_util.load_labelmap(labelpath)
     categories = label_map_util.convert_label_map_to_categories(label_map, 
@@ -340,12 +297,13 @@ if __name__=='__main__':
     
     # detection by function
     starttime=time.time()
-    output_dict, jsondict=detectMultipleImages(detection_graph, 
-                              category_index, 
-                              testimgpath, 
-                              foldernumber,  
-                              outputthresh, 
-                              saveflag)
+    with detector:
+        output_dict, jsondict=detectMultipleImages(detector, 
+                                  category_index, 
+                                  testimgpath, 
+                                  foldernumber,  
+                                  outputthresh, 
+                                  saveflag)
     endtime=time.time()
     print('\n processing finished, total time:{} s'.format(endtime-starttime))
         
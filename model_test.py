@@ -23,6 +23,8 @@ usage example:
 
 import os
 import cv2
+import functools
+import multiprocessing
 import numpy as np
 import tensorflow as tf
 import argparse
@@ -30,6 +32,18 @@ import json
 import time
 import track_obj
 import myGreedyNMS
+import frame_pipeline
+
+from concurrent.futures import Future
+from detector import Detector
+from detect_scheduler import SCHEDULERS, buildScheduler
+from result_stream import loadDone, openStreams
+from run_manifest import RunManifest, scanFolder
+from overlay import (getDangerLevel, raiseAlert, renderDetectionOverlay, 
+                     renderTrackOverlay, saveOverlay)
+from detection_cache import DetectionCache, hashBuffer, hashFile
+
+from image_loader import decodeImage, loadImageInNpArray
 
 from matplotlib import pyplot as plt
 from PIL import Image
@@ -39,9 +53,6 @@ from object_detection.utils import ops as utils_ops
 from object_detection.utils import label_map_util
 from object_detection.utils import visualization_utils as vis_util
 
-os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
-os.environ["CUDA_VISIBLE_DEVICES"] = "1"
-
 def calculate_trainable_variables():
     total_parameters = 0
     print('================= Trainable Variables =======================')
@@ -77,6 +88,20 @@ def getClass(class_id,category_index,max_class):
         else:
             raise ValueError('class doesn\'t have a valid display name or binary name')
 
+def getValidClasses(category_index,max_class):
+    """
+    get the class ids which are not 'null' according to getClass, boxes of 
+    other classes could be removed before NMS
+    
+    """
+    valid_classes=[]
+    for class_id in range(1,max_class+1):
+        if class_id not in category_index:
+            continue
+        if getClass(class_id,category_index,max_class)!='null':
+            valid_classes.append(class_id)
+    return valid_classes
+
 def carClassifier(x,y,width,height,threshold=0.2, strip_x1=305,strip_x2=335,y_roof=0):
     """
     input the information of bounding box (topleft, bottomright), get the possible
@@ -113,73 +138,135 @@ def carClassifier(x,y,width,height,threshold=0.2, strip_x1=305,strip_x2=335,y_ro
 def returnbottomy(bbx):
     return bbx['y']+bbx['height']
 
-def loadImageInNpArray(image):
-    # convert input image into h*w*3 in uint8 format, BGR color space
-    (im_width, im_height) = image.size
-    return np.array(image.getdata()).reshape((im_height, im_width, 3)).astype(np.uint8)
-
-def detectSingleImage(image, graph):
-    with graph.as_default():
-        with tf.Session() as sess:
-            # Get handles to input and output tensors
-            ops = tf.get_default_graph().get_operations()
-            all_tensor_names = {output.name for op in ops for output in op.outputs}
-            tensor_dict = {}
-            for key in [
-                    'num_detections', 'detection_boxes', 'detection_scores',
-                    'detection_classes', 'detection_masks'
-            ]:
-                tensor_name = key + ':0'
-                if tensor_name in all_tensor_names:
-                    tensor_dict[key] = tf.get_default_graph().get_tensor_by_name(tensor_name)
-            if 'detection_masks' in tensor_dict:
-                # The following processing is only for single image
-                detection_boxes = tf.squeeze(tensor_dict['detection_boxes'], [0])
-                detection_masks = tf.squeeze(tensor_dict['detection_masks'], [0])
-                # Reframe is required to translate mask from box coordinates to image coordinates and fit the image size.
-                real_num_detection = tf.cast(tensor_dict['num_detections'][0], tf.int32)
-                detection_boxes = tf.slice(detection_boxes, [0, 0], [real_num_detection, -1])
-                detection_masks = tf.slice(detection_masks, [0, 0, 0], [real_num_detection, -1, -1])
-                detection_masks_reframed = utils_ops.reframe_box_masks_to_image_masks(detection_masks, detection_boxes, image.shape[0], image.shape[1])
-                detection_masks_reframed = tf.cast(tf.greater(detection_masks_reframed, 0.5), tf.uint8)
-                # Follow the convention by adding back the batch dimension
-                tensor_dict['detection_masks'] = tf.expand_dims(detection_masks_reframed, 0)
-            image_tensor = tf.get_default_graph().get_tensor_by_name('image_tensor:0')
-
-            # Run inference
-            output_dict = sess.run(tensor_dict,feed_dict={image_tensor: np.expand_dims(image, 0)})
-            # all outputs are float32 numpy arrays, so convert types as appropriate
-            output_dict['num_detections'] = int(output_dict['num_detections'][0])
-            output_dict['detection_classes'] = output_dict['detection_classes'][0].astype(np.uint8)
-            output_dict['detection_boxes'] = output_dict['detection_boxes'][0]
-            output_dict['detection_scores'] = output_dict['detection_scores'][0]
-            if 'detection_masks' in output_dict:
-                output_dict['detection_masks'] = output_dict['detection_masks'][0]
-    return output_dict
+def detectSingleImage(image, detector):
+    """
+    run the detector on a single image, return the detections after the NMS
+    of the graph
+    
+    input:
+        image: h*w*3 uint8 in RGB color space
+        detector: a detector.Detector
+    
+    """
+    return detector.detect([image], raw=False)[0]
+
+def loadFrame(imagepath,imagename):
+    """
+    read a single frame from disk
+
+    output:
+        None if the frame can't be read or decoded, else a tuple of
+        (imagename, image_cv, image_np, im_width, im_height, imagekey), where
+        image_cv is in BGR color space (for the tracker), image_np is h*w*3 
+        uint8 in RGB color space (for the model), and imagekey is the sha1 of
+        the file, the key of the frame in a DetectionCache
+    """
+    # read the file only once, the same bytes are hashed and decoded
+    try:
+        with open(os.path.join(imagepath,imagename),'rb') as fid:
+            buffer=fid.read()
+    except (IOError, OSError):
+        return None
+    # decode only once, the array based representation of the image will 
+    # be used later in order to prepare the
+    # result image with boxes and labels on it.
+    image_cv, image_np = decodeImage(buffer)
+    if image_cv is None:
+        return None
+    (im_height, im_width) = image_np.shape[0:2]
+    return imagename, image_cv, image_np, im_width, im_height, hashBuffer(buffer)
+
+def loadFrameBatches(imagepath,filedict,batch_size=1,reader=None):
+    """
+    read the frames under imagepath and group them into batches of at most
+    batch_size frames. a batch is closed early when the frame size changes,
+    since frames of different sizes can't be stacked into one feed
+
+    input:
+        imagepath: folder of the frames
+        filedict: file names under imagepath, only jpg & png are loaded
+        batch_size: max number of frames in a batch
+        reader: a frame_pipeline.FrameReader to decode the frames ahead of
+            the model, decode on the calling thread if None
+    output:
+        a generator of lists, each list contains the tuples from loadFrame
+    """
+    if reader is None:
+        reader=frame_pipeline.FrameReader(num_workers=0)
+    items=[(imagepath,imagename) for imagename in filedict 
+           if 'jpg' in imagename or 'png' in imagename]
+    batch=[]
+    for frame in reader.read(loadFrame,items):
+        if frame is None:
+            continue
+        if len(batch)>0 and frame[2].shape!=batch[0][2].shape:
+            yield batch
+            batch=[]
+        batch.append(frame)
+        if len(batch)>=batch_size:
+            yield batch
+            batch=[]
+    if len(batch)>0:
+        yield batch
+
+def detectFrames(detector,frames,cache=None):
+    """
+    run the detector on a batch of frames, the frames with raw outputs in the
+    cache are not fed to the detector. if all the frames are cached, the 
+    detector is not called at all
+    
+    input:
+        detector: a detector.Detector
+        frames: list of tuples from loadFrame
+        cache: a detection_cache.DetectionCache, or None for no cache
+    output:
+        output_list: list of raw output_dict, one for each frame
+    
+    """
+    if cache is None:
+        return detector.detect([frame[2] for frame in frames])
+    
+    keys=[frame[5] for frame in frames]
+    output_list=[cache.get(key) for key in keys]
+    missing=[i for i in range(len(frames)) if output_list[i] is None]
+    if len(missing)>0:
+        results=detector.detect([frames[i][2] for i in missing])
+        for i,output_dict in zip(missing,results):
+            output_list[i]=output_dict
+            cache.put(keys[i],output_dict)
+    return output_list
 
 def updateAnnotationDict_Raw(output_dict,annotationdict,
                          imagename,im_width,im_height,
                          max_class,category_index,
-                         outputthresh=0.05,IOUthresh=0.5):
+                         outputthresh=0.05,IOUthresh=0.5,max_candidates=None,
+                         nms_mode='greedy'):
     """
     update annotation dictionary with raw box lacations and
     scores using my NMS
     
+    max_candidates: if not None, only the top max_candidates boxes above 
+        outputthresh go through NMS
+    nms_mode: one of myGreedyNMS.NMS_MODES, 'greedy' for hard greedy NMS,
+        'soft_linear' or 'soft_gaussian' for soft NMS, 'wbf' for weighted 
+        box fusion
+    
     """
     
     # loading raw result from model
     boxes=output_dict['Postprocessor/raw_box_locations'][0]
     scores=output_dict['Postprocessor/raw_box_scores'][0]
-    boxlist, _ = myGreedyNMS.sortByScore(scores,boxes)
     
     # Format of NMSed_list:
     # [y_min, x_min, y_max, x_max, highest_score, predicted_class]
     # the first 4 values are of range [0.0 1.0], highest_score [0.0 1.0]
     # predicted_class is class code, which should be an integer. If class code
     # is 0, means it's background
-    NMSed_list = myGreedyNMS.greedyNonMaximumSupression(boxlist,
+    NMSed_list = myGreedyNMS.nonMaximumSupressionArray(boxes,scores,
                             clipthresh=outputthresh,
-                            IOUthresh=IOUthresh)
+                            IOUthresh=IOUthresh,
+                            mode=nms_mode,
+                            max_candidates=max_candidates)
     
     ########### save detection result (output_dict) ############
     ###### into jsondict in the format of VIVA Annotation ######
@@ -208,7 +295,75 @@ def updateAnnotationDict_Raw(output_dict,annotationdict,
         
     return annotationdict, boxes, scores
 
-def updateAnnotationDict_Track(annotationdict,imagename,bbox):
+def updateAnnotationDictBatch_Raw(output_list,annotationdict,frames,
+                                  max_class,category_index,valid_classes=None,
+                                  outputthresh=0.05,IOUthresh=0.5,
+                                  max_candidates=None):
+    """
+    update annotation dictionary for a batch of frames at once, with per-class
+    NMS on the stacked raw box locations and scores of the whole batch
+    
+    different from updateAnnotationDict_Raw, boxes of the 'null' classes are
+    removed before NMS, a box is only suppressed by boxes of the same class,
+    and boxes with scores lower than outputthresh are never kept
+    
+    input:
+        output_list: list of output_dict from runDetectionBatch
+        frames: list of tuples from loadFrame, same order as output_list
+        valid_classes: class ids to be kept, from getValidClasses if None
+    output:
+        annotationdict: updated annotation dictionary
+        boxes: raw box locations of the batch, format [B,N,4]
+        scores: raw box scores of the batch, format [B,N,q]
+    
+    """
+    if valid_classes is None:
+        valid_classes=getValidClasses(category_index,max_class)
+    
+    # stack raw results of the batch
+    boxes=np.concatenate([output_dict['Postprocessor/raw_box_locations'] 
+                          for output_dict in output_list],axis=0)
+    scores=np.concatenate([output_dict['Postprocessor/raw_box_scores'] 
+                           for output_dict in output_list],axis=0)
+    
+    # keep: [image index, box index] of kept boxes, grouped by image
+    keep,keepscores,keepclasses = myGreedyNMS.batchedNonMaximumSupression(
+                            boxes,scores,
+                            clipthresh=outputthresh,
+                            IOUthresh=IOUthresh,
+                            valid_classes=valid_classes,
+                            max_candidates=max_candidates)
+    
+    ########### save detection result (output_dict) ############
+    ###### into jsondict in the format of VIVA Annotation ######
+    for imagename,image_cv,image_np,im_width,im_height,_ in frames:
+        annotationdict[imagename]={}
+        annotationdict[imagename]['name']=imagename
+        annotationdict[imagename]['width']=im_width
+        annotationdict[imagename]['height']=im_height
+        annotationdict[imagename]['annotations']=[]
+    
+    for (imageidx,boxidx),score,class_id in zip(keep,keepscores,keepclasses):
+        imagename,_,_,im_width,im_height=frames[imageidx]
+        annotations=annotationdict[imagename]['annotations']
+        annodict={}
+        annodict['id']=len(annotations)
+        annodict['shape']=['Box',1]
+        annodict['label']=getClass(int(class_id),category_index,max_class)
+        ymin,xmin,ymax,xmax=boxes[imageidx,boxidx]
+        annodict['x']=int(xmin*im_width)
+        annodict['y']=int(ymin*im_height)
+        annodict['width']=int((xmax-xmin)*im_width)
+        annodict['height']=int((ymax-ymin)*im_height)
+        annodict['category']=carClassifier(annodict['x'],annodict['y'],annodict['width'],annodict['height'])
+        annodict['score']=float(score)
+        
+        annotations.append(annodict)
+    
+    return annotationdict, boxes, scores
+
+def updateAnnotationDict_Track(annotationdict,imagename,bbox,im_width=640,
+                               im_height=480):
     """
     update annotation dictionary using the result of object
     tracker. only save one 'leading' bbox into annotation.
@@ -218,8 +373,6 @@ def updateAnnotationDict_Track(annotationdict,imagename,bbox):
     this is not for detection!
     
     """
-    im_width=640
-    im_height=480
     annotationdict[imagename]={}
     annotationdict[imagename]['name']=imagename
     annotationdict[imagename]['width']=im_width
@@ -240,6 +393,37 @@ def updateAnnotationDict_Track(annotationdict,imagename,bbox):
     
     return annotationdict
 
+def updateAnnotationDict_Tracks(annotationdict,imagename,tracks,im_width,
+                                im_height):
+    """
+    update annotation dictionary using the tracks of 
+    track_obj.MultiObjTracker, all the tracked vehicles are saved, the id of
+    an annotation is the id of its track. the category is given by 
+    carClassifier as for the detections, call keepOnlyOneLeading afterwards
+    
+    this is not for detection!
+    
+    """
+    annotationdict[imagename]={}
+    annotationdict[imagename]['name']=imagename
+    annotationdict[imagename]['width']=im_width
+    annotationdict[imagename]['height']=im_height
+    annotationdict[imagename]['annotations']=[]
+    
+    for track in tracks:
+        annodict={'id':track['id'],
+                  'label':track['label'],
+                  'shape':['Box',1],
+                  'x':round(track['bbox'][0]),
+                  'y':round(track['bbox'][1]),
+                  'width':round(track['bbox'][2]),
+                  'height':round(track['bbox'][3])
+                 }
+        annodict['category']=carClassifier(annodict['x'],annodict['y'],annodict['width'],annodict['height'])
+        annotationdict[imagename]['annotations'].append(annodict)
+    
+    return annotationdict
+
 def updateAnnotationDict(output_dict,annotationdict,imagename,im_width,im_height,
                          max_class):
     """
@@ -315,34 +499,75 @@ def keepOnlyOneLeading(annotationdict,imagename):
     
     return annotationdict, not leadingflag, bbox
 
+def detectLeading(frame,detector,category_index,max_class,
+                  outputthresh=0.5,customNMS=True,max_candidates=None,
+                  nms_mode='greedy',cache=None):
+    """
+    detect the leading vehicle in a single frame, for the background thread
+    of track_obj.AsyncDetectTracker. the annotation is kept in a dict of its
+    own, nothing shared is changed
+    
+    output:
+        bbox=(x,y,width,height) of the leading vehicle, None if not found
+    """
+    imagename,image_cv,image_np,im_width,im_height,_ = frame
+    output_dict = detectFrames(detector,[frame],cache=cache)[0]
+    annotationdict={}
+    if not customNMS:
+        annotationdict = updateAnnotationDict(output_dict,
+                        annotationdict,imagename,
+                        im_width,im_height,max_class)
+    else:
+        annotationdict, _ ,_ = updateAnnotationDict_Raw(output_dict,annotationdict,
+                                  imagename,im_width,im_height,
+                                  max_class,category_index,
+                                  outputthresh=outputthresh,IOUthresh=0.5,
+                                  max_candidates=max_candidates,
+                                  nms_mode=nms_mode)
+    _, hasleading, bbox = keepOnlyOneLeading(annotationdict,imagename)
+    if not hasleading:
+        return None
+    return bbox
+
+def estimateLeadingDistance(annotations,dist_estimator=None):
+    """
+    estimate the distance of the leading vehicle in a frame, return 999999 if
+    no leading car appears in the frame or dist_estimator is None
+    
+    """
+    distance=999999 # a default value if no leading car appears in the image
+    if dist_estimator is None:
+        return distance
+    for anno in annotations:
+        if anno['category']=='leading':
+            distance=dist_estimator.estimateDistance(width=anno['width'])
+    return distance
+
+def estimateTrackDistance(bbox,last_dist,dist_estimator=None):
+    """
+    estimate the distance and the danger level of the tracked leading vehicle
+    
+    bbox=(x,y,width,height)
+    output:
+        distance: 999999 if no leading vehicle or dist_estimator is None
+        level: danger level in string, None if distance is not estimated
+    """
+    if bbox[2]==0 or dist_estimator is None:
+        return 999999, None
+    distance=dist_estimator.estimateDistance(width=int(bbox[2]))
+    # use real detection time for real camera-captured video, for our
+    # demo, however, the video are all of 10 fps sample frequency
+    level=getDangerLevel(distance,0.1,last_dist,0.1,abs_dist_only=False)
+    return distance, level
+
 def drawBBoxNSave(image_np,imagename,savepath,annotationdict,drawside=False,
                   dist_estimator=None, show_leading=False,show_dist=True):
-    img=cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
-    font=cv2.FONT_HERSHEY_SIMPLEX
-    linetype=cv2.LINE_AA
-    linewidth=2
-    distance=999999 # a default value if no leading car appears in the image
-    for i in range(len(annotationdict[imagename]['annotations'])):
-        tl=(annotationdict[imagename]['annotations'][i]['x'],annotationdict[imagename]['annotations'][i]['y'])
-        br=(annotationdict[imagename]['annotations'][i]['x']+annotationdict[imagename]['annotations'][i]['width'],annotationdict[imagename]['annotations'][i]['y']+annotationdict[imagename]['annotations'][i]['height'])
-        if annotationdict[imagename]['annotations'][i]['category']=='leading':
-            # draw leading car in red
-            if show_leading:
-                img=cv2.rectangle(img,tl,br,(0,0,255),linewidth) # red
-            else:
-                img=cv2.rectangle(img,tl,br,(0,255,0),linewidth) # green
-            #cv2.putText(img, 'leading', tl, font, 1, (0,0,255), 1, lineType=linetype)
-            if dist_estimator is not None:
-                bl=(annotationdict[imagename]['annotations'][i]['x'],annotationdict[imagename]['annotations'][i]['y']+annotationdict[imagename]['annotations'][i]['height']-4)
-                distance=dist_estimator.estimateDistance(width=annotationdict[imagename]['annotations'][i]['width'])
-                if show_dist:
-                    #cv2.putText(img, 'd={:.2f}'.format(distance/1000), bl, font, 0.5, (255,255,255), 1, lineType=linetype)
-                    cv2.putText(img, 'w={} pels'.format(annotationdict[imagename]['annotations'][i]['width']), bl, font, 0.5, (255,255,255), 1, lineType=linetype)
-        elif drawside:
-            # draw sideway cars in green
-            img=cv2.rectangle(img,tl,br,(0,255,0),linewidth) # green
-
-    cv2.imwrite(os.path.join(savepath,imagename.split('.')[0]+'_leadingdetect.jpg'),img) # don't save it in png!!!
+    annotations=annotationdict[imagename]['annotations']
+    distance=estimateLeadingDistance(annotations,dist_estimator)
+    img=renderDetectionOverlay(image_np,annotations,drawside=drawside,
+                               show_leading=show_leading,
+                               show_width=show_dist and dist_estimator is not None)
+    saveOverlay(img,savepath,imagename)
     return distance
 
 def drawBBoxNSave_Track(image_np,imagename,savepath,bbox,
@@ -350,88 +575,54 @@ def drawBBoxNSave_Track(image_np,imagename,savepath,bbox,
                         saveimg_flag=False):
     """
     bbox=(x,y,width,height)
+    
+    the frame is only converted and drawn when saveimg_flag is true
     """
-    img=cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
-    font=cv2.FONT_HERSHEY_SIMPLEX
-    linetype=cv2.LINE_AA
-    tl=(int(bbox[0]),int(bbox[1]))
-    br=(int(bbox[0]+bbox[2]),int(bbox[1]+bbox[3]))
-    distance=999999
-    if bbox[2]!=0:
-        img=cv2.rectangle(img,tl,br,(0,0,255),2) # red
-        if dist_estimator is not None:
-            #bl=(int(bbox[0]),int(bbox[1]+bbox[3]-4))
-            distance=dist_estimator.estimateDistance(width=int(bbox[2]))
-
-            # use real detection time for real camera-captured video, for our
-            # demo, however, the video are all of 10 fps sample frequency
-            _,img=raiseAlert(distance,0.1,last_dist,0.1,
-                              img,abs_dist_only=False)
-# =============================================================================
-#             _,img=raiseAlert(distance,detect_time,last_dist,last_time,
-#                               img,abs_dist_only=True)
-# =============================================================================
-            
-            cv2.putText(img, 'Distance: {:.1f}m'.format(distance/1000), (4,456), font, 0.5, (255,255,255), 1, lineType=linetype)
+    distance,_=estimateTrackDistance(bbox,last_dist,dist_estimator)
     if saveimg_flag:
-        cv2.imwrite(os.path.join(savepath,imagename.split('.')[0]+'_leadingdetect.jpg'),img) # don't save it in png!!!
+        img=renderTrackOverlay(image_np,bbox,
+                               distance=distance if dist_estimator is not None else None,
+                               last_dist=last_dist)
+        saveOverlay(img,savepath,imagename)
     return distance
-    
-def raiseAlert(dist,t,last_dist,last_t,img,abs_dist_only=True,timeahead=0.6):
+
+def getAlertLevels(distlist,last_dist=20000,abs_dist_only=True):
     """
-    raise alert according to absolute distance and high acceleration
-    the distance unit is milimeters, time unit is seconds. always show the 
-    higher danger level
+    get the danger level of each frame from the distances of a folder, in 
+    temporal order. frames without a leading vehicle get None
     
     input:
-        dist/last_dist: distance for current frame/last frame
-        t/last_t: detection time for current frame/last frame
-        img: current frame
-        abs_dist_only: if true, use absolute distance only
-    
-    output:
-        enum[lvl]: danger level in string
-        img: put text on img
-    
-    note that the t/last is inference time when debugging with PC, when using 
-    phone app, they should be interval between shooting two input frames
+        distlist: {imagename: distance}
+        last_dist: distance of the frame before the first one
+        abs_dist_only: see getDangerLevel, false for the tracking mode
     
     """
-    enum=('Low','Medium','High')
-    # danger lvl from absolute dist
-    if dist<4000:
-        lvl=2
-    elif dist<8000:
-        lvl=1
-    else:
-        lvl=0
-    
-    # acceleration
-    if not abs_dist_only:
-        predict_dist=(dist-last_dist)/t*timeahead+dist
-        if predict_dist<0:
-            lvl=max(2,lvl)
-        elif predict_dist>8000:
-            lvl=max(0,lvl)
+    alertlist={}
+    for imagename in frame_pipeline.sortFrames(distlist):
+        dist=distlist[imagename]
+        if dist==999999:
+            alertlist[imagename]=None
         else:
-            lvl=max(1,lvl)
-    
-    cv2.putText(img, 'Danger:{}'.format(enum[lvl]), 
-                (4,472), 
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                0.5, (255,255,255), 1, 
-                lineType=cv2.LINE_AA)
-    return enum[lvl],img
+            alertlist[imagename]=getDangerLevel(dist,0.1,last_dist,0.1,
+                                                abs_dist_only=abs_dist_only)
+        last_dist=dist
+    return alertlist
 
 class DistEstimator():
     """
     estimate distance, all units are of milimeters and pixels
     
+    after loading the mapping function, the distances of integer widths from
+    0 to lut_max_width are computed once into a lookup table, estimating the
+    distance of such a width is a single index
+    
     """
-    def __init__(self, width_reference=1600):
+    def __init__(self, width_reference=1600, lut_max_width=640):
         # width_reference unit is milimeters
         self.width_reference=width_reference
         self.mapping=None
+        self.lut=None
+        self.lut_max_width=lut_max_width
         
     def setWidthReference(self, width_reference):
         self.width_reference=width_reference
@@ -446,54 +637,297 @@ class DistEstimator():
         if filepath==None:
             raise ValueError('invalid filepath for pixel-dist mapping function')
         self.mapping=np.loadtxt(filepath,delimiter=';')
+        self.buildLookupTable(self.lut_max_width)
         return self.mapping
     
+    def buildLookupTable(self, max_width=640):
+        """
+        compute the distances of integer widths 0..max_width with the mapping
+        function, the lookup table gives exactly the same distances as the 
+        search in estimateDistance
+        
+        """
+        self.lut=None
+        self.lut=self.estimateDistance(np.arange(max_width+1))
+        self.lut_max_width=max_width
+        return self.lut
+    
     def estimateDistance(self, width):
-        if width==None or width=='null':
+        """
+        estimate the distance from the width of the leading vehicle in pixels
+        
+        width could be a number or an array of widths, the distances of an 
+        array are estimated at once with numpy, each of them is the same as
+        estimating them one by one. integer widths covered by the lookup table
+        are read from it, the others go through the search
+        
+        the search is kept instead of np.searchsorted, since its step-halving
+        doesn't always end in the bracket of width for long mappings, and 
+        the distances must stay the same as before
+        
+        """
+        if width is None or (isinstance(width,str) and width=='null'):
             raise ValueError('invalid width value to calculate distance')
+        width=np.asarray(width)
+        # integer widths in the range of the lookup table
+        if self.lut is not None and np.issubdtype(width.dtype,np.integer):
+            if width.size==0 or (width.min()>=0 and width.max()<=self.lut_max_width):
+                distance=self.lut[width]
+                if distance.ndim==0:
+                    return distance[()]
+                return distance
+        
         # calculate distance from mapping func
         mapping=self.mapping
         total=len(mapping[:,0])
-        i=int(total/2)
+        i=np.full(width.shape,int(total/2),dtype=int)
         step=int(total/4)
-        last_i=0
-        while(i!=last_i):
-            #print(i)
-            last_i=i
-            if width>mapping[i,0]:
-                i-=step
-            else:
-                i+=step
+        # the steps are the same for all the widths, the search stops after
+        # the first step of 0
+        while step>0:
+            i=np.where(width>mapping[i,0],i-step,i+step)
             step=int(step/2)
         #print('width={},mapped_pel={}'.format(width,mapping[i,0]))
-        if i==total-1:
-            #width too small
-            low=int(i-1)
-            high=i
-        elif i==0:
-            #width too large
-            low=i
-            high=int(i+1)
-        else:
-            #regular case
-            if width>mapping[i,0]:
-                low=int(i-1)
-                high=i                    
-            else:
-                low=i
-                high=int(i+1)
+        # regular case
+        above=width>mapping[i,0]
+        low=np.where(above,i-1,i)
+        high=np.where(above,i,i+1)
+        # width too small
+        low=np.where(i==total-1,i-1,low)
+        high=np.where(i==total-1,i,high)
+        # width too large
+        low=np.where(i==0,0,low)
+        high=np.where(i==0,1,high)
         # solve linear regression between (x1,y1) and (x2,y2)
         x1=mapping[low,0]
         y1=mapping[low,1]
         x2=mapping[high,0]
         y2=mapping[high,1]
-        return (y2-y1)/(x2-x1)*(width-x2)+y2
+        distance=(y2-y1)/(x2-x1)*(width-x2)+y2
+        if distance.ndim==0:
+            return distance[()]
+        return distance
    
-def detectMultipleImages(detection_graph, category_index, testimgpath, 
+def getCalibrationCode(camcalpath):
+    """
+    get the code of a calibration file from its name, e.g. '_160' for 
+    viewnyx_160.txt, used as the suffix of the distance json files
+    
+    """
+    return '_'+os.path.basename(camcalpath).split('_')[1].split('.')[0]
+
+def loadSweepEstimators(camcalpaths, width_reference=1600):
+    """
+    load a DistEstimator for each calibration file
+    
+    output:
+        sweep_estimators: list of (calibration code, DistEstimator)
+    """
+    sweep_estimators=[]
+    for camcalpath in camcalpaths:
+        estimator=DistEstimator()
+        estimator.setWidthReference(width_reference)
+        estimator.loadMappingFunc(filepath=camcalpath)
+        sweep_estimators.append((getCalibrationCode(camcalpath),estimator))
+    return sweep_estimators
+
+def getLeadingWidths(annotationdict):
+    """
+    get the width of the leading vehicle in each frame, None if the frame has
+    no leading vehicle
+    
+    """
+    widths={}
+    for imagename in annotationdict:
+        widths[imagename]=None
+        for anno in annotationdict[imagename]['annotations']:
+            if anno['category']=='leading':
+                widths[imagename]=anno['width']
+    return widths
+
+def estimateDistanceSweep(leadingwidths, sweep_estimators):
+    """
+    estimate the distances of all the frames with every calibration at once
+    
+    input:
+        leadingwidths: {imagename: width of the leading vehicle or None}
+        sweep_estimators: list of (calibration code, DistEstimator)
+    output:
+        table: columnar table, 'name' and 'width' columns, then one column of
+            distances for each calibration code. the distance is 999999 if
+            the frame has no leading vehicle, same as drawBBoxNSave
+    """
+    names=sorted(leadingwidths)
+    widths=[leadingwidths[imagename] for imagename in names]
+    valid=np.array([width is not None for width in widths],dtype=bool)
+    validwidths=np.array([width for width in widths if width is not None])
+    
+    table={'name':names,'width':widths}
+    for code,estimator in sweep_estimators:
+        distances=iter(estimator.estimateDistance(validwidths).tolist() if valid.any() else [])
+        table[code]=[next(distances) if isvalid else 999999 for isvalid in valid]
+    return table
+
+def postprocessFrame(output_dict,frame,annotationdict,distlist,savepath,
+                     max_class,category_index,outputthresh=0.5,customNMS=True,
+                     save_raw=False,saveimg_flag=True,dist_estimator=None,
+                     show_leading=False,writer=None,max_candidates=None,
+                     nms_mode='greedy',headless=False,streams=None):
+    """
+    post-process the model output of a single frame in detection mode: NMS,
+    update the annotation, keep only one leading vehicle, then hand over the
+    drawing and saving of the result image to the writer stage
+    
+    input:
+        output_dict: output of the model for this frame, with batch dim 1
+        frame: the tuple from loadFrame
+        annotationdict: dict to store all annotation
+        distlist: dict to store the distances, the value saved for each frame
+            is a future of the distance returned by drawBBoxNSave
+        writer: a frame_pipeline.StageWorker for drawing & saving images,
+            draw on the calling thread if None
+        headless: only estimate the distance, no image is drawn or saved
+        streams: (annotation writer, distance writer) of 
+            result_stream.NDJSONWriter, the results of the frame are appended
+            to them once ready. not used if None
+    
+    """
+    imagename,image_cv,image_np,im_width,im_height,_ = frame
+    if not customNMS:
+        # this is using first 100 detection results
+        annotationdict = updateAnnotationDict(output_dict,
+                        annotationdict,imagename,
+                        im_width,im_height,max_class)
+    else:
+        # use raw detection results with highest score
+        # NMS list will clipped by score threshold
+        annotationdict, rawboxes, rawscores = updateAnnotationDict_Raw(output_dict,annotationdict,
+                                      imagename,im_width,im_height,
+                                      max_class,category_index,
+                                      outputthresh=outputthresh,IOUthresh=0.5,
+                                      max_candidates=max_candidates,
+                                      nms_mode=nms_mode)
+        if save_raw:
+            np.savez(os.path.join(savepath,imagename.split('.')[0]), 
+                     rawboxes, rawscores)
+            #print('npz saved')
+    
+    return finishFrame(frame,annotationdict,distlist,savepath,
+                       saveimg_flag=saveimg_flag,dist_estimator=dist_estimator,
+                       show_leading=show_leading,writer=writer,
+                       headless=headless,streams=streams)
+
+def postprocessBatch(output_list,batch,annotationdict,distlist,savepath,
+                     max_class,category_index,valid_classes=None,
+                     outputthresh=0.5,save_raw=False,saveimg_flag=True,
+                     dist_estimator=None,show_leading=False,writer=None,
+                     max_candidates=None,headless=False,streams=None):
+    """
+    same as postprocessFrame, but runs per-class NMS on all the frames of a 
+    batch at once with updateAnnotationDictBatch_Raw
+    
+    input:
+        output_list: list of output_dict from runDetectionBatch
+        batch: list of tuples from loadFrame, same order as output_list
+    
+    """
+    annotationdict, rawboxes, rawscores = updateAnnotationDictBatch_Raw(
+                                  output_list,annotationdict,batch,
+                                  max_class,category_index,
+                                  valid_classes=valid_classes,
+                                  outputthresh=outputthresh,IOUthresh=0.5,
+                                  max_candidates=max_candidates)
+    for i,frame in enumerate(batch):
+        if save_raw:
+            np.savez(os.path.join(savepath,frame[0].split('.')[0]), 
+                     rawboxes[i:i+1], rawscores[i:i+1])
+        finishFrame(frame,annotationdict,distlist,savepath,
+                    saveimg_flag=saveimg_flag,dist_estimator=dist_estimator,
+                    show_leading=show_leading,writer=writer,
+                    headless=headless,streams=streams)
+    return annotationdict
+
+def finishFrame(frame,annotationdict,distlist,savepath,saveimg_flag=True,
+                dist_estimator=None,show_leading=False,writer=None,
+                headless=False,streams=None):
+    """
+    keep only one leading vehicle in the annotation of a frame, then hand 
+    over the drawing and saving of the result image to the writer stage
+    
+    in headless mode only the distance is estimated, on the calling thread,
+    the frame is never converted or drawn
+    
+    the annotation is appended to the annotation stream here, the distance
+    is written in the order of the frames by drainDistances
+    
+    """
+    imagename,image_cv,image_np,im_width,im_height,_ = frame
+    annotationdict, _ , _ = keepOnlyOneLeading(annotationdict,imagename)
+    if headless:
+        distlist[imagename] = estimateLeadingDistance(
+                annotationdict[imagename]['annotations'],dist_estimator)
+    elif saveimg_flag:
+        if writer is None:
+            writer=frame_pipeline.StageWorker(num_workers=0)
+        distlist[imagename] = writer.submit(drawBBoxNSave,image_np,imagename,
+                savepath,annotationdict,
+                drawside=True,dist_estimator=dist_estimator,
+                show_leading=show_leading,
+                show_dist=True)
+    if streams is not None:
+        streams[0].write(imagename,annotationdict[imagename])
+    return annotationdict
+
+def resolveDistance(dist):
+    """
+    the distance of a frame is a future of the writer stage, or the value 
+    itself in headless mode
+    
+    """
+    if isinstance(dist,Future):
+        return dist.result()
+    return dist
+
+def drainDistances(distlist,framenames,start,distwriter,wait=False):
+    """
+    write the distances of framenames[start:] to the distance stream on the
+    calling thread, in the order of the frames
+    
+    input:
+        distlist: {imagename: distance or future}, filled by the NMS stage
+        framenames: names of the frames in the order of submission
+        start: index of the first frame not written yet
+        wait: if false, stop at the first frame whose distance is not ready.
+            if true, wait for all of them and skip the frames without a 
+            distance, call it after the NMS and writer stages are joined
+    output:
+        index of the first frame not written yet
+    """
+    while start<len(framenames):
+        imagename=framenames[start]
+        dist=distlist.get(imagename)
+        if dist is None or (isinstance(dist,Future) and not dist.done()):
+            if not wait:
+                break
+            if dist is None:
+                start+=1
+                continue
+        distwriter.write(imagename,resolveDistance(dist))
+        start+=1
+    return start
+
+def detectMultipleImages(detector, category_index, testimgpath, 
                          foldernumber, outputthresh=0.5, saveimg_flag=True,
                          max_class=8, dist_estimator=None, use_tracking=False,
                          folder_only='', show_leading=False, customNMS=True,
-                         save_raw=False, calibration_code=''):
+                         save_raw=False, calibration_code='', batch_size=1,
+                         num_readers=0, num_writers=0, max_candidates=None,
+                         per_class_nms=False, nms_mode='greedy', cache=None,
+                         sweep_estimators=None, headless=False,
+                         stream_output=False, flush_every=100,
+                         incremental=False, folder_list=None, scheduler='fixed',
+                         max_track=None, target_fps=0, async_detect=False,
+                         multi_track=False):
     '''
     load the frozen graph (model) and run detection among all the images
     
@@ -501,11 +935,62 @@ def detectMultipleImages(detection_graph, category_index, testimgpath,
         testimgpath: the top level of your image folders, note that subfolders 
             are considered as default
         foldernumber: how many subfolders do you want to test
-        detection_graph: the loaded frozen graph
+        detector: a detector.Detector with the loaded frozen graph
         category_index: index to convert category labels into numbers
         outputthresh
         saveimg_flag: if ture, save detection results under subfolder 'leadingdetect'
         max_class: how many class to be detected
+        batch_size: number of frames stacked into one detector.detect call, only 
+            used when use_tracking=False
+        num_readers: number of threads decoding frames ahead of the model,
+            decode on the main thread if 0
+        num_writers: number of threads drawing & saving the result images,
+            only used when use_tracking=False. if num_readers or num_writers
+            is not 0, NMS also runs on its own thread besides the session
+        max_candidates: if not None, only the top max_candidates boxes above
+            outputthresh go through the custom NMS
+        per_class_nms: if true, run per-class NMS on the whole batch at once 
+            and remove the 'null' classes before NMS, only used when 
+            use_tracking=False, customNMS=True and nms_mode='greedy'
+        nms_mode: NMS used by the custom NMS, one of myGreedyNMS.NMS_MODES
+        cache: a detection_cache.DetectionCache of the raw outputs, the 
+            frames found in it skip the model
+        sweep_estimators: list of (calibration code, DistEstimator), if not
+            None, the distances of all the calibrations are saved in one 
+            table distance_<folder>_<detection|tracking>_sweep.json
+        headless: skip all the drawing, only distances and danger levels 
+            are computed, the levels are saved in 
+            alert_<folder>_<detection|tracking><calibration_code>.json. the
+            images could be rendered later by render_overlays.py
+        stream_output: if true, the annotation and the distance of each 
+            frame are appended to annotation_<folder>_<mode>.ndjson and 
+            distance_<folder>_<mode><calibration_code>.ndjson as soon as 
+            they are ready, instead of one pretty-printed json per folder at
+            the end. read them with result_stream.loadResults
+        flush_every: the .ndjson files are flushed and checkpointed every 
+            flush_every frames
+        incremental: if true, skip the folders recorded as done in 
+            manifest_<mode><calibration_code>.json whose frames didn't 
+            change and whose outputs are newer than the frames. with 
+            stream_output, the frames already in the .ndjson files of an
+            unfinished folder are skipped as well
+        folder_list: names of the folders under testimgpath to be processed,
+            all the folders if None, see listFolders
+        scheduler: how the tracking mode picks detect or track for each 
+            frame, one of detect_scheduler.SCHEDULERS. the reason of each 
+            detection is saved in schedule_<folder>_tracking.json
+        max_track: max frames tracked after a detection, the default of the
+            scheduler if None
+        target_fps: time budget of the adaptive scheduler, 0 for none
+        async_detect: in tracking mode, track every frame on the main thread
+            and run detection on a background thread on the latest frame,
+            see track_obj.AsyncDetectTracker. the scheduler is not used, and
+            only the tracked leading vehicle is saved for each frame
+        multi_track: in tracking mode, track all the detected vehicles with
+            track_obj.MultiObjTracker instead of the leading one only, the
+            leading vehicle of a tracked frame is chosen from the tracks, 
+            and detection is needed only when all the tracks are lost or by
+            the scheduler. not used with async_detect
         
     output:
         output_dict: raw detection result of tensor graph
@@ -521,199 +1006,539 @@ def detectMultipleImages(detection_graph, category_index, testimgpath,
     last_dist=20000
     last_time=2
     chunksize=1000
+    output_dict=None
+    annotationdict={}
+    distlist={}
+    mode='tracking' if use_tracking else 'detection'
     
     if use_tracking:
-        objtracker=track_obj.ObjTracker()
-        objtracker.buildTracker()
-        maxtrack=10 # switch to detection when reach max track frame
-        print('detection-tracking scheme is used')
+        if multi_track:
+            objtracker=track_obj.MultiObjTracker()
+        else:
+            objtracker=track_obj.ObjTracker()
+            objtracker.buildTracker()
+        # decides when to switch to detection
+        detectscheduler=buildScheduler(scheduler,maxtrack=max_track,
+                                       target_fps=target_fps)
+        if async_detect:
+            asynctracker=track_obj.AsyncDetectTracker(functools.partial(
+                    detectLeading,detector=detector,
+                    category_index=category_index,max_class=max_class,
+                    outputthresh=outputthresh,customNMS=customNMS,
+                    max_candidates=max_candidates,nms_mode=nms_mode,
+                    cache=cache))
+            print('detection-tracking scheme is used, detection runs asynchronously')
+        else:
+            print('detection-tracking scheme is used, {} scheduler'.format(scheduler))
+    elif batch_size>1:
+        print('batched inference is used, batch size is {}'.format(batch_size))
     print('chunk size is {} images'.format(chunksize))
     
-    # initialize the graph once for all
-    with detection_graph.as_default():
-        with tf.Session() as sess:            
-                    
-            # Get handles to input and output tensors
-            ops = tf.get_default_graph().get_operations()
-            all_tensor_names = {output.name for op in ops for output in op.outputs}
-            
-            tensor_dict = {}
-            for key in [#'num_detections', 'detection_boxes', 
-                        #'detection_scores', 'detection_classes',
-                        'Postprocessor/raw_box_encodings',
-                        'Postprocessor/raw_box_locations',
-                        'Postprocessor/raw_box_scores']:
-                tensor_name = key + ':0'
-                
-                if tensor_name in all_tensor_names:
-                    tensor_dict[key] = tf.get_default_graph().get_tensor_by_name(tensor_name)
-           
-            image_tensor = tf.get_default_graph().get_tensor_by_name('image_tensor:0')
-            
-            folderdict=os.listdir(testimgpath)
-            for folder in folderdict:
-                # skip the files, choose folders only
-                if '.' in folder:
-                    continue
-                
-                # run model for val set only
-                if folder_only!='' and folder_only not in folder:
-                    continue
-                
-                # for debug, set the number of folders to be processed
-                if foldercount>=foldernumber:
-                    break
-                else:
-                    foldercount+=1
-                
-                # show folder name and create save path
-                imagepath=os.path.join(testimgpath,folder)
-                print('processing folder:',imagepath)
-                
-                savepath=os.path.join(testimgpath,folder,'leadingdetect')
-                if saveimg_flag:
-                    if not os.path.exists(savepath):
-                        os.makedirs(savepath)
+    # stages of the pipeline, decode -> session -> NMS -> draw & save
+    # the session stays on the main thread
+    pipelined = num_readers>0 or num_writers>0
+    reader=frame_pipeline.FrameReader(num_workers=num_readers,
+                                      prefetch=2*max(1,batch_size,num_readers))
+    postprocessor=frame_pipeline.StageWorker(num_workers=1 if pipelined else 0,
+                                             max_pending=2*max(1,batch_size))
+    writer=frame_pipeline.StageWorker(num_workers=num_writers,
+                                      max_pending=4*max(1,num_writers))
+    per_class_nms = per_class_nms and customNMS and not use_tracking and nms_mode=='greedy'
+    if customNMS and nms_mode!='greedy':
+        print('{} is used instead of greedy NMS'.format(nms_mode))
+    if per_class_nms:
+        valid_classes=getValidClasses(category_index,max_class)
+        print('per-class batched NMS is used, valid classes: {}'.format(valid_classes))
+    if headless:
+        saveimg_flag=False
+        print('headless mode is used, no image is drawn or saved')
+    if incremental:
+        manifest=RunManifest(os.path.join(testimgpath,'manifest_{}{}.json'.format(mode,calibration_code)))
+        print('incremental mode is used, {} folders in the manifest'.format(len(manifest.folders)))
+    if pipelined:
+        print('pipelined processing is used, {} readers, {} writers'.format(num_readers,num_writers))
+    
+    # the graph and the session are owned by the detector, and stay open 
+    # across the folders
+    if folder_list is None:
+        folderdict=os.listdir(testimgpath)
+    else:
+        folderdict=folder_list
+    for folder in folderdict:
+        # skip the files, choose folders only
+        if '.' in folder:
+            continue
+        
+        # run model for val set only
+        if folder_only!='' and folder_only not in folder:
+            continue
+        
+        imagepath=os.path.join(testimgpath,folder)
+        outputs=getFolderOutputs(testimgpath,folder,mode,calibration_code,
+                                 stream_output=stream_output)
+        if incremental:
+            frames=scanFolder(imagepath)
+            if manifest.isUpToDate(folder,frames,outputs,detector.model_hash):
+                print('folder is up to date, skipped:',imagepath)
+                continue
+        
+        # for debug, set the number of folders to be processed
+        if foldercount>=foldernumber:
+            break
+        else:
+            foldercount+=1
+        
+        # show folder name and create save path
+        print('processing folder:',imagepath)
+        
+        savepath=os.path.join(testimgpath,folder,'leadingdetect')
+        if saveimg_flag:
+            if not os.path.exists(savepath):
+                os.makedirs(savepath)
+        
+        # frames in temporal order, the tracker is re-initialized by 
+        # detection after each gap
+        filedict, gaps = frame_pipeline.enumerateFrames(os.listdir(imagepath))
+        gapframes=set(after for _,after,_ in gaps)
+        if len(gaps)>0:
+            print('{} gaps, {} frames missing, e.g. between {} and {}'.format(
+                    len(gaps),sum(count for _,_,count in gaps),gaps[0][0],gaps[0][1]))
+        annotationdict={} # save all detection result into json file
+        distlist={} # save all the distances estimated from prediction
+        trackwidths={} # width of the leading vehicle used in tracking mode
+        schedule={} # 'track' or the reason of detection for each frame
+        if use_tracking:
+            detectscheduler.reset()
+            if async_detect:
+                asynctracker.reset()
+            elif multi_track:
+                objtracker.reset()
+        folder_last_dist=last_dist # for the danger levels in headless mode
+        resumeddist={} # distances of the frames done by the last run
+        if stream_output:
+            # only an unfinished folder is resumed, a done folder which has
+            # changed since is processed again from scratch
+            resume=incremental and folder not in manifest.folders
+            streams, done = openStreams(outputs,flush_every=flush_every,
+                                        resume=resume)
+            if len(done)>0:
+                # the frames of an unfinished folder, done by the last run
+                # and saved in both the annotation and the distance stream
+                annotationdict.update(loadDone(outputs[0],done))
+                resumeddist=loadDone(outputs[1],done)
+                trackwidths.update(getLeadingWidths(annotationdict))
+                filedict=[imagename for imagename in filedict 
+                          if imagename not in done]
+                print('{} frames resumed from the last run'.format(len(done)))
+        else:
+            streams=None
+        folderstart=time.time()
+        framecount=0
+        distnames=[] # frames submitted to the NMS stage, in order
+        distdrained=0 # frames whose distance is in the distance stream
+        
+        # tracking needs the result of the last frame, so it always
+        # runs frame by frame
+        for batch in loadFrameBatches(imagepath,filedict,
+                                      batch_size=1 if use_tracking else batch_size,
+                                      reader=reader):
+            framecount+=len(batch)
+            ##################### Actual detection ######################
+            if not use_tracking:
+                # Run detection inference, all the frames in the batch
+                # share one detector.detect call
+                starttime=time.time()
+                output_list = detectFrames(detector,batch,cache=cache)
+                output_dict = output_list[-1]
+                detect_time=(time.time()-starttime)/len(batch)
                 
-                filedict=os.listdir(imagepath)
-                annotationdict={} # save all detection result into json file
-                distlist={} # save all the distances estimated from prediction
-                trackcount=0 # record how many frames used for tracking
-                solidtrack=False
+                for frame in batch:
+                    filecount+=1
+                    if filecount>0: # the first 5 images won't be counted for detection time
+                        sumtime+=detect_time
+                        print('processing time: {} s'.format(detect_time))
+                        if filecount==chunksize:
+                            timelist.append(sumtime/chunksize)
+                            print('average time of current chunk: {}'.format(sumtime/filecount))
+                            filecount=0
+                            sumtime=0
+                        #print('average detection time is {} s'.format(sumtime/filecount))
                 
-                for imagename in filedict:
-                    if 'jpg' in imagename or 'png' in imagename:
-                        image_cv = cv2.imread(os.path.join(imagepath,imagename))
-                        if image_cv is None:
-                            continue
-                        image = Image.open(os.path.join(imagepath,imagename))
-                        (im_width, im_height) = image.size
-                        
-                        filecount+=1
-                        # the array based representation of the image will be used 
-                        # later in order to prepare the
-                        # result image with boxes and labels on it.
-                        image_np = loadImageInNpArray(image)
-                        # Expand dimensions since the model expects images to have shape: [1, None, None, 3]
-                        # image_np_expanded = np.expand_dims(image_np, axis=0)
-                        
-                        ##################### Actual detection ######################
-                        if not use_tracking:
-                            # Run detection inference
-                            starttime=time.time()
-                            output_dict = sess.run(tensor_dict,feed_dict={image_tensor: np.expand_dims(image_np, 0)})
-                            detect_time=time.time()-starttime
-                            if filecount>0: # the first 5 images won't be counted for detection time
-                                sumtime+=detect_time
-                                print('processing time: {} s'.format(detect_time))
-                                if filecount==chunksize:
-                                    timelist.append(sumtime/chunksize)
-                                    print('average time of current chunk: {}'.format(sumtime/filecount))
-                                    filecount=0
-                                    sumtime=0
-                                #print('average detection time is {} s'.format(sumtime/filecount))
-                            
-                            if not customNMS:
-                                # this is using first 100 detection results
-                                annotationdict = updateAnnotationDict(output_dict,
-                                                annotationdict,imagename,
-                                                im_width,im_height,max_class)
-                            else:
-                                # use raw detection results with highest score
-                                # NMS list will clipped by score threshold
-                                annotationdict, rawboxes, rawscores = updateAnnotationDict_Raw(output_dict,annotationdict,
-                                                              imagename,im_width,im_height,
-                                                              max_class,category_index,
-                                                              outputthresh=outputthresh,IOUthresh=0.5)
-                                if save_raw:
-                                    np.savez(os.path.join(savepath,imagename.split('.')[0]), 
-                                             rawboxes, rawscores)
-                                    #print('npz saved')
-                            
-                            annotationdict, _ , _ = keepOnlyOneLeading(annotationdict,imagename)
-                            if saveimg_flag:
-                                distlist[imagename] = drawBBoxNSave(image_np,imagename,
-                                        savepath,annotationdict,
-                                        drawside=True,dist_estimator=dist_estimator,
-                                        show_leading=show_leading,
-                                        show_dist=True)
-                                
-                        else:
-                            # Run detection-tracking inference
-                            if solidtrack and trackcount<maxtrack:
-                                # refresh tracker and do tracking
-                                # return solidtrack mark
-                                solidtrack, bbox, detect_time = objtracker.updateTrack(image_cv)
-                                #print('track frame {}, time {}'.format(filecount+5,tracktime))
-                                annotationdict = updateAnnotationDict_Track(annotationdict,imagename,bbox)
-                                trackcount+=1
-                                sumtime+=detect_time
-                            if solidtrack==False or trackcount==maxtrack:
-                                # detection
-                                # get bbox of leading car
-                                # if has leading car:
-                                    #reture solidtrack mark
-                                    #trackcount=0
-                                
-                                starttime=time.time()
-                                output_dict = sess.run(tensor_dict,feed_dict={image_tensor: np.expand_dims(image_np, 0)})
-                                detect_time=time.time()-starttime
-                                if filecount>0: # the first 5 images won't be counted for detection time
-                                    sumtime+=detect_time
-                                    print('processing time: {} s'.format(sumtime/filecount))
-                                    if filecount==chunksize:
-                                        timelist.append(sumtime/chunksize)
-                                        print('average time of current chunk: {}'.format(sumtime/filecount))
-                                        filecount=0
-                                        sumtime=0
-                                if not customNMS:
-                                    annotationdict = updateAnnotationDict(output_dict,
-                                                    annotationdict,imagename,
-                                                    im_width,im_height,max_class)
-                                else:
-                                    annotationdict, _ ,_ = updateAnnotationDict_Raw(output_dict,annotationdict,
-                                                              imagename,im_width,im_height,
-                                                              max_class,category_index,
-                                                              outputthresh=outputthresh,IOUthresh=0.5)
-                                # let solidtrack=True if has leading vehicle
-                                annotationdict, solidtrack, bbox = keepOnlyOneLeading(annotationdict,imagename)
-                                #print('detect frame {}, time {}'.format(filecount+5,detect_time))
-                                # update tracker
-                                if solidtrack:
-                                    objtracker.refreshTracker()
-                                    objtracker.updateTrack(image_cv,init=True,bbox=bbox)
-                                    trackcount=0
-                            # draw bbox and text and save img
-                            last_dist=drawBBoxNSave_Track(image_np,imagename,savepath,bbox,
-                                                last_dist,last_time,detect_time,
-                                                dist_estimator = dist_estimator,
-                                                saveimg_flag = saveimg_flag)
-                            distlist[imagename]=last_dist
-                            last_time=detect_time
-                            
-                timelist.append(sumtime/filecount)
-                # after done save all the annotation into json file, save the file
-                if not use_tracking:
-                    # save annotation if not using tracking
-                    with open(os.path.join(testimgpath,'annotation_{}_detection.json'.format(folder)),'w') as savefile:
-                        savefile.write(json.dumps(annotationdict, sort_keys = True, indent = 4))
+                # NMS runs on its own stage while the session 
+                # moves on to the next batch
+                if per_class_nms:
+                    postprocessor.submit(postprocessBatch,output_list,batch,
+                                         annotationdict,distlist,savepath,
+                                         max_class,category_index,
+                                         valid_classes=valid_classes,
+                                         outputthresh=outputthresh,
+                                         save_raw=save_raw,
+                                         saveimg_flag=saveimg_flag,
+                                         dist_estimator=dist_estimator,
+                                         show_leading=show_leading,
+                                         writer=writer,
+                                         max_candidates=max_candidates,
+                                         headless=headless,
+                                         streams=streams)
                 else:
-                    # save annotation if using tracking
-                    with open(os.path.join(testimgpath,'annotation_{}_tracking.json'.format(folder)),'w') as savefile:
-                        savefile.write(json.dumps(annotationdict, sort_keys = True, indent = 4))
-                
-                # save distance estimated from predictions or tracking
-                if not use_tracking:
-                    with open(os.path.join(testimgpath,'distance_{}_detection{}.json'.format(folder,calibration_code)),'w') as savefile:
-                        savefile.write(json.dumps(distlist, sort_keys = True, indent = 4))
+                    for frame,output_dict in zip(batch,output_list):
+                        postprocessor.submit(postprocessFrame,output_dict,frame,
+                                             annotationdict,distlist,savepath,
+                                             max_class,category_index,
+                                             outputthresh=outputthresh,
+                                             customNMS=customNMS,
+                                             save_raw=save_raw,
+                                             saveimg_flag=saveimg_flag,
+                                             dist_estimator=dist_estimator,
+                                             show_leading=show_leading,
+                                             writer=writer,
+                                             max_candidates=max_candidates,
+                                             headless=headless,
+                                             streams=streams,
+                                             nms_mode=nms_mode)
+                distnames.extend(frame[0] for frame in batch)
+                if streams is not None:
+                    distdrained=drainDistances(distlist,distnames,distdrained,
+                                               streams[1])
+                    
+            else:
+                imagename,image_cv,image_np,im_width,im_height,_ = batch[0]
+                filecount+=1
+                if async_detect:
+                    if imagename in gapframes:
+                        asynctracker.reset()
+                    # the tracked box comes at once, the detection of an 
+                    # earlier frame refreshes the tracker when it's done
+                    solidtrack, bbox, detect_time, refreshed = asynctracker.update(
+                            image_cv,batch[0])
+                    annotationdict = updateAnnotationDict_Track(annotationdict,imagename,bbox,
+                                                                im_width,im_height)
+                    if filecount>0: # the first 5 images won't be counted for detection time
+                        sumtime+=detect_time
+                        if filecount==chunksize:
+                            timelist.append(sumtime/chunksize)
+                            print('average time of current chunk: {}'.format(sumtime/filecount))
+                            filecount=0
+                            sumtime=0
+                    schedule[imagename]='async_refresh' if refreshed else 'track'
                 else:
-                    with open(os.path.join(testimgpath,'distance_{}_tracking{}.json'.format(folder,calibration_code)),'w') as savefile:
-                        savefile.write(json.dumps(distlist, sort_keys = True, indent = 4))
+                    if imagename in gapframes:
+                        # the vehicle could have moved far during the gap
+                        detectscheduler.invalidate('gap')
+                    # Run detection-tracking inference
+                    if detectscheduler.wantsTrack():
+                        # do tracking, the scheduler tells if detection is
+                        # needed on this frame as well
+                        if multi_track:
+                            # the leading vehicle is chosen again from all
+                            # the tracks, a cut-in needs no detection
+                            tracks, detect_time = objtracker.update(image_cv)
+                            annotationdict = updateAnnotationDict_Tracks(annotationdict,imagename,
+                                                                         tracks,im_width,im_height)
+                            annotationdict, _, bbox = keepOnlyOneLeading(annotationdict,imagename)
+                            solidtrack = len(tracks)>0
+                        else:
+                            solidtrack, bbox, detect_time = objtracker.updateTrack(image_cv)
+                            #print('track frame {}, time {}'.format(filecount+5,tracktime))
+                            annotationdict = updateAnnotationDict_Track(annotationdict,imagename,bbox,
+                                                                        im_width,im_height)
+                        if filecount>0: # the first 5 images won't be counted for detection time
+                            sumtime+=detect_time
+                        reason=detectscheduler.onTrack(solidtrack,bbox,detect_time)
+                    else:
+                        reason=detectscheduler.getReason()
+                    schedule[imagename]='track' if reason is None else reason
+                    if reason is not None:
+                        # detection
+                        # get bbox of leading car
+                        # if has leading car:
+                            #reture solidtrack mark
+                            #trackcount=0
+                    
+                        starttime=time.time()
+                        output_dict = detectFrames(detector,batch,cache=cache)[0]
+                        detect_time=time.time()-starttime
+                        if filecount>0: # the first 5 images won't be counted for detection time
+                            sumtime+=detect_time
+                            print('processing time: {} s'.format(sumtime/filecount))
+                            if filecount==chunksize:
+                                timelist.append(sumtime/chunksize)
+                                print('average time of current chunk: {}'.format(sumtime/filecount))
+                                filecount=0
+                                sumtime=0
+                        if not customNMS:
+                            annotationdict = updateAnnotationDict(output_dict,
+                                            annotationdict,imagename,
+                                            im_width,im_height,max_class)
+                        else:
+                            annotationdict, _ ,_ = updateAnnotationDict_Raw(output_dict,annotationdict,
+                                                      imagename,im_width,im_height,
+                                                      max_class,category_index,
+                                                      outputthresh=outputthresh,IOUthresh=0.5,
+                                                      max_candidates=max_candidates,
+                                                      nms_mode=nms_mode)
+                        # let solidtrack=True if has leading vehicle
+                        annotationdict, solidtrack, bbox = keepOnlyOneLeading(annotationdict,imagename)
+                        #print('detect frame {}, time {}'.format(filecount+5,detect_time))
+                        # update tracker
+                        if multi_track:
+                            objtracker.refresh(image_cv,annotationdict[imagename]['annotations'])
+                            solidtrack = len(objtracker.tracks)>0
+                        elif solidtrack:
+                            objtracker.refreshTracker()
+                            objtracker.updateTrack(image_cv,init=True,bbox=bbox)
+                        detectscheduler.onDetect(solidtrack,bbox,detect_time)
+                # draw bbox and text and save img
+                last_dist=drawBBoxNSave_Track(image_np,imagename,savepath,bbox,
+                                    last_dist,last_time,detect_time,
+                                    dist_estimator = dist_estimator,
+                                    saveimg_flag = saveimg_flag)
+                distlist[imagename]=last_dist
+                last_time=detect_time
+                detectscheduler.onDistance(last_dist)
+                if streams is not None:
+                    streams[0].write(imagename,annotationdict[imagename])
+                    streams[1].write(imagename,last_dist)
+                trackwidths[imagename]=int(bbox[2]) if bbox[2]!=0 else None
+        
+        # wait for the NMS and writer stages to finish current folder
+        postprocessor.join()
+        writer.join()
+        if not use_tracking:
+            if streams is not None:
+                drainDistances(distlist,distnames,distdrained,streams[1],wait=True)
+            distlist={imagename:resolveDistance(distlist[imagename]) for imagename in distlist}
+        distlist.update(resumeddist)
+        foldertime=time.time()-folderstart
+        if framecount>0:
+            print('{} frames in {:.2f} s, {:.2f} fps including decoding and saving'.format(
+                    framecount,foldertime,framecount/foldertime))
+        if cache is not None:
+            print('detection cache: {} hits, {} misses, {:.1f} MB'.format(*cache.stats()))
+        
+        if filecount>0:
+            timelist.append(sumtime/filecount)
+        if use_tracking and async_detect:
+            # the tracker and the detection in flight start over in each 
+            # folder, so does the time of the folder
+            filecount=0
+            sumtime=0
+        # after done save all the annotation into json file, save the file
+        if streams is not None:
+            # already saved frame by frame
+            for stream in streams:
+                stream.close()
+        elif not use_tracking:
+            # save annotation if not using tracking
+            with open(os.path.join(testimgpath,'annotation_{}_detection.json'.format(folder)),'w') as savefile:
+                savefile.write(json.dumps(annotationdict, sort_keys = True, indent = 4))
+        else:
+            # save annotation if using tracking
+            with open(os.path.join(testimgpath,'annotation_{}_tracking.json'.format(folder)),'w') as savefile:
+                savefile.write(json.dumps(annotationdict, sort_keys = True, indent = 4))
+        
+        # save distance estimated from predictions or tracking
+        if streams is not None:
+            pass # already saved frame by frame
+        elif not use_tracking:
+            with open(os.path.join(testimgpath,'distance_{}_detection{}.json'.format(folder,calibration_code)),'w') as savefile:
+                savefile.write(json.dumps(distlist, sort_keys = True, indent = 4))
+        else:
+            with open(os.path.join(testimgpath,'distance_{}_tracking{}.json'.format(folder,calibration_code)),'w') as savefile:
+                savefile.write(json.dumps(distlist, sort_keys = True, indent = 4))
+        
+        # danger levels are not drawn in headless mode, save them instead
+        if headless:
+            alertlist=getAlertLevels(distlist,last_dist=folder_last_dist,
+                                     abs_dist_only=not use_tracking)
+            with open(os.path.join(testimgpath,'alert_{}_{}{}.json'.format(folder,
+                      mode,calibration_code)),'w') as savefile:
+                savefile.write(json.dumps(alertlist, sort_keys = True, indent = 4))
+        
+        # save the distances of all the calibrations in one table
+        if sweep_estimators is not None:
+            if not use_tracking:
+                sweeptable=estimateDistanceSweep(getLeadingWidths(annotationdict),sweep_estimators)
+            else:
+                sweeptable=estimateDistanceSweep(trackwidths,sweep_estimators)
+            with open(os.path.join(testimgpath,'distance_{}_{}_sweep.json'.format(folder,
+                      mode)),'w') as savefile:
+                savefile.write(json.dumps(sweeptable, sort_keys = True, indent = 4))
+        
+        # save why each detection was run in tracking mode
+        if use_tracking and len(schedule)>0:
+            reasons={}
+            for reason in schedule.values():
+                reasons[reason]=reasons.get(reason,0)+1
+            print('schedule: {}'.format(reasons))
+            with open(os.path.join(testimgpath,'schedule_{}_tracking.json'.format(folder)),'w') as savefile:
+                savefile.write(json.dumps(schedule, sort_keys = True, indent = 4))
+        
+        # record the folder as done only after all the outputs are saved
+        if incremental:
+            manifest.markDone(folder,frames,outputs,detector.model_hash)
+    postprocessor.close()
+    writer.close()
+    if use_tracking and async_detect:
+        asynctracker.close()
     return output_dict, annotationdict, timelist, distlist
 
 
             
+def getFolderOutputs(testimgpath, folder, mode, calibration_code='',
+                     stream_output=False):
+    """
+    filepaths of the annotation and the distance of a folder, recorded in 
+    the manifest of an incremental run
+    
+    """
+    ext='.ndjson' if stream_output else '.json'
+    return [os.path.join(testimgpath,'annotation_{}_{}{}'.format(folder,mode,ext)),
+            os.path.join(testimgpath,'distance_{}_{}{}{}'.format(folder,mode,calibration_code,ext))]
+
+def isFolderUpToDate(manifest, testimgpath, folder, model_hash, mode,
+                     calibration_code='', stream_output=False):
+    """
+    the same check as detectMultipleImages with incremental=True, for 
+    listFolders
+    
+    """
+    return manifest.isUpToDate(folder,scanFolder(os.path.join(testimgpath,folder)),
+                               getFolderOutputs(testimgpath,folder,mode,
+                                                calibration_code,stream_output),
+                               model_hash)
+
+def listFolders(testimgpath, folder_only='', foldernumber=None, skip=None):
+    """
+    list the folders processed by detectMultipleImages, in the same order
+    
+    input:
+        foldernumber: max number of folders, counted after the skip
+        skip: function of the folder name, true for the folders which are
+            not processed, e.g. the up-to-date ones of an incremental run, 
+            see isFolderUpToDate
+    """
+    folders=[]
+    for folder in os.listdir(testimgpath):
+        if '.' in folder:
+            continue
+        if folder_only!='' and folder_only not in folder:
+            continue
+        if skip is not None and skip(folder):
+            print('folder is up to date, skipped:',os.path.join(testimgpath,folder))
+            continue
+        if foldernumber is not None and len(folders)>=foldernumber:
+            break
+        folders.append(folder)
+    return folders
+
+def shardFolders(testimgpath, folders, workers):
+    """
+    split the folders into shards of about the same number of files, the
+    largest folders are given out first, each to the smallest shard so far
+    
+    output:
+        shards: list of folder lists, one for each worker, empty ones removed
+    """
+    sizes={folder:len(os.listdir(os.path.join(testimgpath,folder))) for folder in folders}
+    shards=[[] for _ in range(workers)]
+    shardsizes=[0]*workers
+    for folder in sorted(folders,key=lambda folder: -sizes[folder]):
+        i=shardsizes.index(min(shardsizes))
+        shards[i].append(folder)
+        shardsizes[i]+=sizes[folder]
+    return [shard for shard in shards if len(shard)>0]
+
+def detectFoldersWorker(worker_id, folder_list, ckptpath, camcalpath=None,
+                        calibration_sweep=None, intra_op_threads=0, 
+                        inter_op_threads=0, cache_path='', cache_size_mb=2048,
+                        **kwargs):
+    """
+    run detectMultipleImages on a shard of folders in a worker process, with
+    its own detector, session and thread budget. the arguments are all
+    picklable, the detector, distance estimators and cache are built here
+    
+    input:
+        worker_id: index of the worker, for printing only
+        folder_list: the folders of this worker
+        kwargs: the other arguments of detectMultipleImages
+    output:
+        worker_id, timelist of the worker, wall time of the worker in seconds
+    """
+    starttime=time.time()
+    dist_estimator=None
+    if camcalpath is not None:
+        dist_estimator=DistEstimator()
+        dist_estimator.setWidthReference(1600)
+        dist_estimator.loadMappingFunc(filepath=camcalpath)
+    sweep_estimators=None
+    if calibration_sweep is not None:
+        sweep_estimators=loadSweepEstimators(calibration_sweep)
+    
+    with Detector(ckptpath, intra_op_threads=intra_op_threads,
+                  inter_op_threads=inter_op_threads) as detector:
+        cache=None
+        if cache_path!='':
+            cache=DetectionCache(cache_path, detector.model_hash, max_size_mb=cache_size_mb)
+        print('worker {}: {} folders'.format(worker_id,len(folder_list)))
+        _, _, timelist, _ = detectMultipleImages(detector, 
+                                 foldernumber=len(folder_list),
+                                 dist_estimator=dist_estimator,
+                                 cache=cache,
+                                 sweep_estimators=sweep_estimators,
+                                 folder_list=folder_list,
+                                 **kwargs)
+    return worker_id, timelist, time.time()-starttime
+
+def detectWithWorkers(testimgpath, folders, workers, ckptpath, 
+                      intra_op_threads=0, inter_op_threads=0, **kwargs):
+    """
+    shard the folders across worker processes, each runs 
+    detectFoldersWorker. the processes are spawned, not forked, so no 
+    tensorflow state is shared between them
+    
+    input:
+        folders: output of listFolders
+        workers: number of processes
+        intra_op_threads, inter_op_threads: threads of each session, the 
+            cores are split evenly among the workers if 0
+        kwargs: the other arguments of detectFoldersWorker
+    output:
+        timelist: the timelists of all the workers, in the order of workers
+    """
+    shards=shardFolders(testimgpath,folders,workers)
+    if len(shards)==0:
+        print('no folder to be processed')
+        return []
+    if intra_op_threads==0:
+        intra_op_threads=max(1,multiprocessing.cpu_count()//len(shards))
+    if inter_op_threads==0:
+        inter_op_threads=1
+    print('{} folders in {} workers, {} intra-op threads and {} inter-op threads each'.format(
+            len(folders),len(shards),intra_op_threads,inter_op_threads))
+    
+    context=multiprocessing.get_context('spawn')
+    with context.Pool(len(shards)) as pool:
+        jobs=[pool.apply_async(detectFoldersWorker,(i,shard,ckptpath),
+                               dict(intra_op_threads=intra_op_threads,
+                                    inter_op_threads=inter_op_threads,
+                                    **kwargs)) 
+              for i,shard in enumerate(shards)]
+        results=[job.get() for job in jobs]
+    
+    timelist=[]
+    for worker_id, workertimes, workertime in results:
+        print('worker {}: {} folders in {:.2f} s'.format(worker_id,
+              len(shards[worker_id]),workertime))
+        timelist.extend(workertimes)
+    return timelist
+
 if __name__=='__main__':
+    # pin the gpu only when run as a script, importing the helpers, e.g. in
+    # cascade_runtime.py, keeps the gpus of the caller
+    os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
+    os.environ["CUDA_VISIBLE_DEVICES"] = "1"
+    
     # pass the parameters
     parser=argparse.ArgumentParser()
     parser.add_argument('--ckpt_path', type=str, 
@@ -756,12 +1581,89 @@ if __name__=='__main__':
     # viewnyx_200.txt
     # viewnyx_210.txt
     # viewnyx_220.txt
+    parser.add_argument('--calibration_sweep',type=str,nargs='+',default=None,
+                        help='filepaths of several pixel-distance mappings, the \
+                        distances of all of them are estimated from one detection \
+                        pass and saved as one table per folder')
+    parser.add_argument('--stream_output',type=bool,default=False,
+                        help='if true, append the annotation and distance of \
+                        each frame to .ndjson files as soon as they are ready, \
+                        instead of one pretty-printed json per folder. default is false')
+    parser.add_argument('--flush_every',type=int,default=100,
+                        help='flush and checkpoint the .ndjson files every N \
+                        frames, used with --stream_output. default is 100')
+    parser.add_argument('--incremental',type=bool,default=False,
+                        help='if true, skip the folders already done by an \
+                        earlier run and not changed since, see manifest_*.json \
+                        under testimg_path. with --stream_output the done \
+                        frames of an unfinished folder are skipped too. default is false')
+    parser.add_argument('--headless',type=bool,default=False,
+                        help='if true, only distances and danger levels are \
+                        computed, no image is drawn or saved. the images could \
+                        be rendered later with render_overlays.py. default is false')
     parser.add_argument('--use_tracking',type=bool, default=False,
                         help='use tracking to boost processing speed or not, default is false')
+    parser.add_argument('--scheduler',type=str,default='fixed',choices=SCHEDULERS,
+                        help='how tracking mode picks detect or track for each \
+                        frame: fixed detects after max_track tracked frames, \
+                        adaptive detects more often for close vehicles and when \
+                        the tracked box jumps. default is fixed')
+    parser.add_argument('--max_track',type=int,default=0,
+                        help='max frames tracked after a detection, 0 for the \
+                        default of the scheduler: 10 for fixed, 30 for adaptive')
+    parser.add_argument('--target_fps',type=float,default=0,
+                        help='time budget of the adaptive scheduler, it tracks \
+                        longer if detecting more often would be slower than \
+                        this, except for close vehicles. 0 for no budget')
+    parser.add_argument('--async_detect',type=bool,default=False,
+                        help='in tracking mode, track every frame and run the \
+                        detection on a background thread on the latest frame, \
+                        the tracker is refreshed when a detection is done. \
+                        default is false')
+    parser.add_argument('--multi_track',type=bool,default=False,
+                        help='in tracking mode, track all the detected vehicles \
+                        and choose the leading one from the tracks, instead of \
+                        tracking the leading one only. needs scipy. default is false')
     parser.add_argument('--show_leading',type=bool,default=True,
                         help='show leading vehicle in red bbox if true, in green if false.')
     parser.add_argument('--save_raw_output',type=bool,default=False,
                         help='if true, save raw output in .npz format.')
+    parser.add_argument('--batch_size',type=int,default=1,
+                        help='number of frames fed into the model at once, \
+                        ignored when use_tracking is true. default is 1')
+    parser.add_argument('--num_readers',type=int,default=0,
+                        help='number of threads decoding frames ahead of the \
+                        model, 0 for decoding on the main thread. default is 0')
+    parser.add_argument('--num_writers',type=int,default=0,
+                        help='number of threads drawing and saving result \
+                        images in detection mode, 0 for the main thread. default is 0')
+    parser.add_argument('--max_candidates',type=int,default=0,
+                        help='max number of boxes above output_thresh passed \
+                        to the custom NMS for each frame, 0 for no limit. default is 0')
+    parser.add_argument('--per_class_nms',type=bool,default=False,
+                        help='if true, run per-class NMS over each batch of frames \
+                        and drop the null classes before NMS. default is false')
+    parser.add_argument('--intra_op_threads',type=int,default=0,
+                        help='threads used inside a single op of the model, \
+                        0 for the default of tensorflow. default is 0')
+    parser.add_argument('--inter_op_threads',type=int,default=0,
+                        help='threads used to run independent ops of the model, \
+                        0 for the default of tensorflow. default is 0')
+    parser.add_argument('--cache_path',type=str,default='',
+                        help='folder to cache the raw outputs of the model, \
+                        frames found in the cache skip the model. no cache if empty')
+    parser.add_argument('--cache_size_mb',type=float,default=2048,
+                        help='size cap of the cache folder in MB, the least \
+                        recently used results are removed first. default is 2048')
+    parser.add_argument('--nms_mode',type=str,default='greedy',
+                        choices=myGreedyNMS.NMS_MODES,
+                        help='NMS used on the raw outputs: greedy, soft_linear, \
+                        soft_gaussian or wbf. default is greedy')
+    parser.add_argument('--workers',type=int,default=1,
+                        help='number of processes, the folders are sharded \
+                        among them, each with its own session. the cores are \
+                        split evenly among the workers if --intra_op_threads \
+                        is 0. default is 1')
     args = parser.parse_args()
     
     ckptpath = args.ckpt_path
@@ -777,6 +1679,27 @@ if __name__=='__main__':
     usetracking=args.use_tracking
     showleading=args.show_leading
     saveraw=args.save_raw_output
+    batchsize=args.batch_size
+    numreaders=args.num_readers
+    numwriters=args.num_writers
+    maxcandidates=args.max_candidates if args.max_candidates>0 else None
+    perclassnms=args.per_class_nms
+    nmsmode=args.nms_mode
+    intrathreads=args.intra_op_threads
+    interthreads=args.inter_op_threads
+    cachepath=args.cache_path
+    cachesize=args.cache_size_mb
+    calibrationsweep=args.calibration_sweep
+    headless=args.headless
+    streamoutput=args.stream_output
+    flushevery=args.flush_every
+    incremental=args.incremental
+    workers=args.workers
+    schedulername=args.scheduler
+    maxtrack=args.max_track if args.max_track>0 else None
+    targetfps=args.target_fps
+    asyncdetect=args.async_detect
+    multitrack=args.multi_track
     
         
     IMAGE_SIZE = (12, 8)# Size, in inches, of the output images.
@@ -786,51 +1709,117 @@ if __name__=='__main__':
         dist_estimator.setWidthReference(1600)
         mapping=dist_estimator.loadMappingFunc(filepath=camcalpath)
         #result=dist_estimator.estimateDistance(120)
-        calibrationcode='_'+camcalpath.split('_')[1].split('.')[0]
-    
-    # reset for debugging
-    tf.reset_default_graph()
-    
-    # Load a (frozen) Tensorflow model into memory
-    detection_graph = tf.Graph()
-    with detection_graph.as_default():
-        od_graph_def = tf.GraphDef()
-        with tf.gfile.GFile(ckptpath, 'rb') as fid:
-            serialized_graph = fid.read()
-            # the od_graph_def is the config file for the network
-            # when display this variable, please wait, cause it read the file in binary
-            # but display with utf8
-            
-            # there is a NonMaximumSupressionV3 in the graph, but only V1 & V2 given
-            # in the api if tf version<1.8.0
-            od_graph_def.ParseFromString(serialized_graph)
-            tf.import_graph_def(od_graph_def, name='')
-            
- 
+        calibrationcode=getCalibrationCode(camcalpath)
+    if calibrationsweep is not None:
+        sweepestimators=loadSweepEstimators(calibrationsweep)
+        print('calibration sweep: {}'.format([code for code,_ in sweepestimators]))
+    else:
+        sweepestimators=None
+    
     # Loading label map
     label_map = label_map_util.load_labelmap(labelpath)
     categories = label_map_util.convert_label_map_to_categories(label_map, 
             max_num_classes=classnumber, use_display_name=True)
     category_index = label_map_util.create_category_index(categories)
     
+    if workers>1:
+        # the up-to-date folders are skipped before the folders are counted
+        # and sharded, the same as in detectMultipleImages
+        skip=None
+        if incremental:
+            skip=functools.partial(isFolderUpToDate,
+                     RunManifest(os.path.join(testimgpath,'manifest_{}{}.json'.format(
+                             'tracking' if usetracking else 'detection',calibrationcode))),
+                     testimgpath,
+                     model_hash=hashFile(ckptpath),
+                     mode='tracking' if usetracking else 'detection',
+                     calibration_code=calibrationcode,
+                     stream_output=streamoutput)
+        # each worker loads the model itself
+        starttime=time.time()
+        average_detection_time=detectWithWorkers(testimgpath,
+                                 listFolders(testimgpath,folderonly,foldernumber,skip=skip),
+                                 workers, ckptpath,
+                                 intra_op_threads=intrathreads,
+                                 inter_op_threads=interthreads,
+                                 camcalpath=camcalpath,
+                                 calibration_sweep=calibrationsweep,
+                                 cache_path=cachepath,
+                                 cache_size_mb=cachesize,
+                                 category_index=category_index, 
+                                 testimgpath=testimgpath, 
+                                 outputthresh=outputthresh, 
+                                 saveimg_flag=saveflag,
+                                 max_class=classnumber,
+                                 use_tracking=usetracking,
+                                 show_leading=showleading,
+                                 customNMS=True,
+                                 save_raw=saveraw,
+                                 calibration_code=calibrationcode,
+                                 batch_size=batchsize,
+                                 num_readers=numreaders,
+                                 num_writers=numwriters,
+                                 max_candidates=maxcandidates,
+                                 per_class_nms=perclassnms,
+                                 nms_mode=nmsmode,
+                                 headless=headless,
+                                 stream_output=streamoutput,
+                                 flush_every=flushevery,
+                                 incremental=incremental,
+                                 scheduler=schedulername,
+                                 max_track=maxtrack,
+                                 target_fps=targetfps,
+                                 async_detect=asyncdetect,
+                                 multi_track=multitrack)
+    else:
+        # reset for debugging
+        tf.reset_default_graph()
     
-    # detection by function
-    starttime=time.time()
-    output_dict, jsondict, average_detection_time, distance_list =detectMultipleImages(
-                             detection_graph, 
-                             category_index=category_index, 
-                             testimgpath=testimgpath, 
-                             foldernumber=foldernumber,  
-                             outputthresh=outputthresh, 
-                             saveimg_flag=saveflag,
-                             max_class=classnumber,
-                             dist_estimator=dist_estimator,
-                             use_tracking=usetracking,
-                             folder_only=folderonly,
-                             show_leading=showleading,
-                             customNMS=True,
-                             save_raw=saveraw,
-                             calibration_code=calibrationcode)
+        # Load a (frozen) Tensorflow model into memory, the detector keeps one
+        # session open for all the folders
+        detector = Detector(ckptpath, intra_op_threads=intrathreads,
+                            inter_op_threads=interthreads)
+        print('model loaded, sha1 {}'.format(detector.model_hash))
+        if cachepath!='':
+            cache=DetectionCache(cachepath, detector.model_hash, max_size_mb=cachesize)
+        else:
+            cache=None
+    
+        # detection by function
+        starttime=time.time()
+        with detector:
+            output_dict, jsondict, average_detection_time, distance_list =detectMultipleImages(
+                                     detector, 
+                                     category_index=category_index, 
+                                     testimgpath=testimgpath, 
+                                     foldernumber=foldernumber,  
+                                     outputthresh=outputthresh, 
+                                     saveimg_flag=saveflag,
+                                     max_class=classnumber,
+                                     dist_estimator=dist_estimator,
+                                     use_tracking=usetracking,
+                                     folder_only=folderonly,
+                                     show_leading=showleading,
+                                     customNMS=True,
+                                     save_raw=saveraw,
+                                     calibration_code=calibrationcode,
+                                     batch_size=batchsize,
+                                     num_readers=numreaders,
+                                     num_writers=numwriters,
+                                     max_candidates=maxcandidates,
+                                     per_class_nms=perclassnms,
+                                     nms_mode=nmsmode,
+                                     cache=cache,
+                                     sweep_estimators=sweepestimators,
+                                     headless=headless,
+                                     stream_output=streamoutput,
+                                     flush_every=flushevery,
+                                     incremental=incremental,
+                                     scheduler=schedulername,
+                                     max_track=maxtrack,
+                                     target_fps=targetfps,
+                                     async_detect=asyncdetect,
+                                     multi_track=multitrack)
     endtime=time.time()
     if usetracking:
         print('leading vehicle detection with tracking')
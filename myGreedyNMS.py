@@ -8,6 +8,8 @@ Created on Thu Jul  4 16:07:30 2019
 import numpy as np
 import cv2
 
+from iou_matrix import getIoUCorners, getIoUPair
+
 
 def getClass1Score(x,classcode=1):
     return x['scores'][classcode]
@@ -66,33 +68,10 @@ def getIoU(bbx_benchmark,bbx_detect):
     return 0 if no intersection
 
     Args:
-        bbx_benchmark: format {'xmin':_, 'ymin':_, 'xmax':_, 'ymax':_, ...others}
-        bbx_detect: format {'xmin':_, 'ymin':_, 'xmax':_, 'ymax':_, ...others}
+        bbx_benchmark: format [y_min, x_min, y_max, x_max, ...others]
+        bbx_detect: format [y_min, x_min, y_max, x_max, ...others]
     """
-    
-    # get the cordinates of intersecting square
-    x_inter_1=max(bbx_benchmark[1],bbx_detect[1])
-    y_inter_1=max(bbx_benchmark[0],bbx_detect[0])
-    x_inter_2=min(bbx_benchmark[3],bbx_detect[3])
-    y_inter_2=min(bbx_benchmark[2],bbx_detect[2])
-# =============================================================================
-#     x_inter_1=max(bbx_benchmark['xmin'],bbx_detect['xmin'])
-#     y_inter_1=max(bbx_benchmark['ymin'],bbx_detect['ymin'])
-#     x_inter_2=min(bbx_benchmark['xmax'],bbx_detect['xmax'])
-#     y_inter_2=min(bbx_benchmark['ymax'],bbx_detect['ymax'])
-# =============================================================================
-    
-    # get intersect area
-    inter_area = max(0, x_inter_2 - x_inter_1) * max(0, y_inter_2 - y_inter_1)
-    
-    # get bbx area
-    benchmark_area = (bbx_benchmark[2]-bbx_benchmark[0]) * (bbx_benchmark[3]-bbx_benchmark[1])
-    detect_area=(bbx_detect[2]-bbx_detect[0]) * (bbx_detect[3]-bbx_detect[1])
-    
-    # calculate IoU
-    iou = inter_area / float(benchmark_area + detect_area - inter_area)
-    
-    return iou
+    return getIoUPair(bbx_benchmark,bbx_detect,box_format='yxyx')
 
 def greedyNonMaximumSupression(boxlist,clipthresh=0.05,IOUthresh=0.5):
     """
@@ -107,6 +86,10 @@ def greedyNonMaximumSupression(boxlist,clipthresh=0.05,IOUthresh=0.5):
     # keep every box with largest score while doesn't overlap with all the other
     # boxes
     NMSed_list.append(boxlist[0])
+    # corners of the kept boxes, filled in as they are kept
+    first=np.asarray(boxlist[0][:4])
+    kept=np.empty((len(boxlist),4),dtype=np.result_type(first,np.float32))
+    kept[0]=first
     for i in range(1,len(boxlist)):
         keepflag=True
         
@@ -114,18 +97,440 @@ def greedyNonMaximumSupression(boxlist,clipthresh=0.05,IOUthresh=0.5):
             break # break when score of current box is lower than thresh
         else:
             #print('----NMS--{}----'.format(i))
-            for j in range(len(NMSed_list)):
-                iou=getIoU(boxlist[i],NMSed_list[j])
-                #print(iou)
-                if iou>IOUthresh:
-                    keepflag=False
-                    break
+            # IoU with all the kept boxes at once
+            box=np.asarray(boxlist[i][:4],dtype=kept.dtype)
+            iou=getIoUCorners(box,kept[:len(NMSed_list)])
+            if np.any(iou>IOUthresh):
+                keepflag=False
             if keepflag:
+                kept[len(NMSed_list)]=box
                 NMSed_list.append(boxlist[i])
     
     return NMSed_list
     
 
+def sortByScoreArray(scores,boxes,classcode=1,clipthresh=None,max_candidates=None):
+    """
+    array version of sortByScore, sort detections by class 1 score with numpy
+    instead of building a dict for every box. the order of boxes with the 
+    same score is kept as in sortByScore
+    
+    if clipthresh is given, the boxes which greedyNonMaximumSupression would
+    never reach (everything after the first box with score lower than 
+    clipthresh) are dropped in O(N) before sorting, so only the candidates are
+    sorted. if max_candidates is given, only the first max_candidates boxes 
+    are kept
+    
+    Args:
+        scores: array of scores of boxes, format [N,q]
+        boxes: array of bounding boxes, format [N,4], for each box it has 4 
+            parameters [y_min, x_min, y_max, x_max]
+        clipthresh: score threshold of greedyNonMaximumSupression, None for
+            keeping all the boxes
+        max_candidates: max number of boxes to be kept, None for no limit
+    Returns:
+        sortedboxes: sorted boxes, format [M,4]
+        sortedscores: highest score of each sorted box, format [M]
+        sortedclasses: predicted class of each sorted box, format [M]
+        pruned: number of boxes dropped before sorting, N-M
+    """
+    scores=np.asarray(scores)
+    boxes=np.asarray(boxes)
+    classscores=scores[:,classcode]
+    candidates=np.arange(len(scores))
+    
+    if clipthresh is not None and len(scores)>0:
+        # score of the predicted class is the highest score of all the 
+        # classes except background
+        fail=np.max(scores[:,1:],axis=1)<clipthresh
+        # the first box in order is kept anyway
+        fail[np.argmax(classscores)]=False
+        if fail.any():
+            # find the first failed box in order, keep all the boxes before it
+            failidx=np.flatnonzero(fail)
+            firstfail=failidx[np.argmax(classscores[failidx])]
+            lastscore=classscores[firstfail]
+            candidates=np.flatnonzero((classscores>lastscore) | 
+                            ((classscores==lastscore) & (candidates<firstfail)))
+    
+    if max_candidates is not None and len(candidates)>max_candidates:
+        # O(N) selection of the top max_candidates, ties are broken by index 
+        # in the same way as the sorting
+        candscores=classscores[candidates]
+        kthscore=np.partition(candscores,len(candscores)-max_candidates)[len(candscores)-max_candidates]
+        greater=candidates[candscores>kthscore]
+        equal=candidates[candscores==kthscore][:max_candidates-len(greater)]
+        candidates=np.sort(np.concatenate([greater,equal]))
+    
+    order=candidates[np.argsort(-classscores[candidates],kind='stable')]
+    sortedscores=scores[order]
+    
+    # if class 0 has highest prob, find second highest as class
+    sortedclasses=np.argmax(sortedscores,axis=1)
+    background=sortedclasses==0
+    sortedclasses[background]=1+np.argmax(sortedscores[background,1:],axis=1)
+    
+    return (boxes[order], sortedscores[np.arange(len(order)),sortedclasses], 
+            sortedclasses, len(scores)-len(order))
+
+def getIoUArray(bbx_benchmark,bbx_detect):
+    """
+    calculate Intersection over Union between one box and an array of boxes,
+    in the same way as getIoU, in the precision of the boxes
+    
+    Args:
+        bbx_benchmark: a single box, [y_min, x_min, y_max, x_max]
+        bbx_detect: an array of boxes, format [N,4]
+    Returns:
+        iou: array of IoU, format [N], 0 for boxes of no area
+    """
+    # the boxes are already corners in the same axis order, so the kernel
+    # of iou_matrix is called directly, without converting them
+    return getIoUCorners(bbx_benchmark,bbx_detect)
+
+def greedyKeepIndex(sortedboxes,IOUthresh=0.5):
+    """
+    greedy suppression of boxes already sorted by score, each kept box is 
+    compared with all the remaining boxes at once, and the boxes overlapping 
+    with it are dropped
+    
+    Args:
+        sortedboxes: array of boxes sorted by score, format [N,4]
+        IOUthresh: IoU threshold
+    Returns:
+        keep: array of indices of the kept boxes in sortedboxes, in order
+    """
+    keep=[]
+    remaining=np.arange(len(sortedboxes))
+    while remaining.size>0:
+        i=remaining[0]
+        keep.append(i)
+        remaining=remaining[1:]
+        if remaining.size==0:
+            break
+        iou=getIoUArray(sortedboxes[i],sortedboxes[remaining])
+        remaining=remaining[np.logical_not(iou>IOUthresh)]
+    return np.array(keep,dtype=np.intp)
+
+def greedyNonMaximumSupressionArray(boxes,scores,clipthresh=0.05,IOUthresh=0.5,
+                                    max_candidates=None,return_pruned=False):
+    """
+    array version of sortByScore + greedyNonMaximumSupression, takes the raw
+    output of the model and returns the same NMSed_list
+    
+    the boxes after the first one lower than clipthresh are dropped before 
+    sorting, then each kept box is compared with all the remaining candidates
+    at once, and the boxes overlapping with it are dropped from the candidates
+    
+    Args:
+        boxes: raw box locations, format [N,4]
+        scores: raw box scores, format [N,q]
+        clipthresh: score threshold, same as greedyNonMaximumSupression
+        IOUthresh: IoU threshold, same as greedyNonMaximumSupression
+        max_candidates: if not None, only the top max_candidates boxes are
+            used for NMS
+        return_pruned: if True, also return the number of boxes dropped 
+            before sorting
+    Returns:
+        NMSed_list: list of [y_min, x_min, y_max, x_max, highest_score, 
+            predicted_class]
+        pruned: only if return_pruned is True
+    """
+    NMSed_list=[]
+    if len(boxes)==0 or clipthresh>1:
+        if return_pruned:
+            return NMSed_list, len(boxes)
+        return NMSed_list
+    
+    sortedboxes, sortedscores, sortedclasses, pruned = sortByScoreArray(scores,boxes,
+                                                    clipthresh=clipthresh,
+                                                    max_candidates=max_candidates)
+    
+    # the box with largest score is always kept, stop at the first box with 
+    # score lower than thresh
+    belowthresh=sortedscores[1:]<clipthresh
+    if belowthresh.any():
+        count=1+int(np.argmax(belowthresh))
+    else:
+        count=len(sortedscores)
+    
+    keep=greedyKeepIndex(sortedboxes[:count],IOUthresh)
+    
+    for i in keep:
+        NMSed_list.append([sortedboxes[i][0],
+                           sortedboxes[i][1],
+                           sortedboxes[i][2],
+                           sortedboxes[i][3],
+                           sortedscores[i],
+                           sortedclasses[i]
+                           ])
+    
+    if return_pruned:
+        return NMSed_list, pruned
+    return NMSed_list
+    
+
+def batchedNonMaximumSupression(boxes,scores,clipthresh=0.05,IOUthresh=0.5,
+                                valid_classes=None,max_candidates=None):
+    """
+    per-class greedy NMS over the raw outputs of a batch of images at once
+    
+    boxes are only suppressed by boxes of the same image and the same class.
+    boxes predicted as a class not in valid_classes are removed before NMS, 
+    so they never suppress the boxes of valid classes. unlike 
+    greedyNonMaximumSupression, every kept box has a score no lower than 
+    clipthresh
+    
+    Args:
+        boxes: raw box locations, format [B,N,4], B is the number of images
+        scores: raw box scores, format [B,N,q]
+        clipthresh: score threshold, boxes with lower scores are removed
+        IOUthresh: IoU threshold
+        valid_classes: list of class codes to be kept, None for all classes
+        max_candidates: if not None, only the top max_candidates boxes of 
+            each image are used for NMS
+    Returns:
+        keep: kept boxes, format [K,2], each row is [image index, box index],
+            sorted by image index, then by score from high to low
+        keepscores: highest score of each kept box, format [K]
+        keepclasses: predicted class of each kept box, format [K]
+    """
+    boxes=np.asarray(boxes)
+    scores=np.asarray(scores)
+    batch,num=boxes.shape[0:2]
+    boxes=boxes.reshape(batch*num,4)
+    scores=scores.reshape(batch*num,scores.shape[-1])
+    
+    # predicted class is the highest non-background class, same as sortByScore
+    classes=1+np.argmax(scores[:,1:],axis=1)
+    highest=scores[np.arange(len(classes)),classes]
+    candmask=highest>=clipthresh
+    if valid_classes is not None:
+        candmask &= np.isin(classes,valid_classes)
+    candidates=np.flatnonzero(candmask)
+    images=candidates//num
+    
+    # sort by image, then by score from high to low
+    order=np.lexsort((-highest[candidates],images))
+    candidates=candidates[order]
+    images=images[order]
+    if max_candidates is not None:
+        firstinimage=np.searchsorted(images,images,side='left')
+        rank=np.arange(len(candidates))-firstinimage
+        candidates=candidates[rank<max_candidates]
+        images=images[rank<max_candidates]
+    
+    # boxes of different images or classes never suppress each other, so the
+    # greedy suppression is run inside each group, a kept box is compared
+    # only with the candidates of its own group
+    groups=images*scores.shape[1]+classes[candidates]
+    grouporder=np.argsort(groups,kind='stable')
+    bounds=np.flatnonzero(np.diff(groups[grouporder]))+1
+    keep=[np.zeros(0,dtype=np.intp)]
+    for members in np.split(grouporder,bounds):
+        # members keep the candidate order, i.e. sorted by score
+        keep.append(members[greedyKeepIndex(boxes[candidates[members]],IOUthresh)])
+    
+    keep=candidates[np.sort(np.concatenate(keep))]
+    return (np.stack([keep//num,keep%num],axis=1), highest[keep], classes[keep])
+    
+
+NMS_MODES=['greedy','soft_linear','soft_gaussian','wbf']
+
+def splitBoxList(boxlist):
+    """
+    split a boxlist into arrays of boxes, scores and classes
+    
+    Args:
+        boxlist: list or array of [y_min, x_min, y_max, x_max, highest_score, 
+            predicted_class], format [N,6]
+    Returns:
+        boxes: format [N,4]
+        scores: format [N], in float64
+        classes: format [N], in int
+    """
+    if len(boxlist)==0:
+        return np.zeros((0,4)), np.zeros(0), np.zeros(0,dtype=int)
+    if isinstance(boxlist,np.ndarray):
+        return (boxlist[:,0:4], boxlist[:,4].astype(np.float64), 
+                boxlist[:,5].astype(int))
+    boxes=np.array([box[0:4] for box in boxlist])
+    scores=np.array([box[4] for box in boxlist],dtype=np.float64)
+    classes=np.array([box[5] for box in boxlist],dtype=int)
+    return boxes, scores, classes
+
+def softNonMaximumSupression(boxlist,clipthresh=0.05,IOUthresh=0.5,
+                             method='linear',sigma=0.5):
+    """
+    soft non-maximum supression, instead of removing the boxes overlapping 
+    with a kept box, their scores are decayed, and a box is removed only when
+    its score drops below clipthresh
+    
+    Args:
+        boxlist: list or array of [y_min, x_min, y_max, x_max, highest_score,
+            predicted_class], format [N,6], e.g. output of sortByScore
+        clipthresh: boxes with (decayed) scores lower than this are removed
+        IOUthresh: for method 'linear', scores of boxes with IoU larger than
+            this are multiplied by (1-IoU). not used by method 'gaussian'
+        method: 'linear' or 'gaussian', gaussian multiplies the scores by 
+            exp(-IoU^2/sigma)
+        sigma: parameter of the gaussian decay
+    Returns:
+        NMSed_list: list of [y_min, x_min, y_max, x_max, decayed_score, 
+            predicted_class], sorted by decayed score
+    """
+    if method not in ('linear','gaussian'):
+        raise ValueError('unknown soft NMS method {}'.format(method))
+    NMSed_list=[]
+    boxes,scores,classes=splitBoxList(boxlist)
+    
+    keep=[]
+    keepscores=[]
+    remaining=np.flatnonzero(scores>=clipthresh)
+    while remaining.size>0:
+        # box with the highest decayed score, the first one on ties
+        top=np.argmax(scores[remaining])
+        i=remaining[top]
+        keep.append(i)
+        keepscores.append(scores[i])
+        remaining=np.delete(remaining,top)
+        if remaining.size==0:
+            break
+        iou=np.nan_to_num(getIoUArray(boxes[i],boxes[remaining]))
+        if method=='linear':
+            decay=np.where(iou>IOUthresh,1-iou,1.0)
+        else:
+            decay=np.exp(-(iou*iou)/sigma)
+        scores[remaining]*=decay
+        remaining=remaining[scores[remaining]>=clipthresh]
+    
+    for i,score in zip(keep,keepscores):
+        NMSed_list.append([boxes[i][0],
+                           boxes[i][1],
+                           boxes[i][2],
+                           boxes[i][3],
+                           score,
+                           classes[i]
+                           ])
+    return NMSed_list
+
+def weightedBoxFusion(boxlist,clipthresh=0.05,IOUthresh=0.5):
+    """
+    weighted box fusion, the boxes are visited by score from high to low, 
+    each box joins the fused box of the same class with the largest IoU if 
+    the IoU is larger than IOUthresh, or starts a new fused box otherwise.
+    a fused box is the score-weighted average of its boxes, and its score is
+    the average score of its boxes
+    
+    Args:
+        boxlist: list or array of [y_min, x_min, y_max, x_max, highest_score,
+            predicted_class], format [N,6], e.g. output of sortByScore
+        clipthresh: boxes with scores lower than this are not fused
+        IOUthresh: IoU threshold for joining a fused box
+    Returns:
+        NMSed_list: list of [y_min, x_min, y_max, x_max, fused_score, 
+            predicted_class], sorted by fused score
+    """
+    NMSed_list=[]
+    boxes,scores,classes=splitBoxList(boxlist)
+    order=np.flatnonzero(scores>=clipthresh)
+    order=order[np.argsort(-scores[order],kind='stable')]
+    
+    # accumulators of the fused boxes
+    fusedboxes=np.zeros((len(order),4))
+    coordsum=np.zeros((len(order),4))
+    scoresum=np.zeros(len(order))
+    count=np.zeros(len(order),dtype=int)
+    fusedclasses=np.zeros(len(order),dtype=int)
+    numfused=0
+    for i in order:
+        best=-1
+        if numfused>0:
+            iou=np.nan_to_num(getIoUArray(boxes[i],fusedboxes[:numfused]))
+            iou[fusedclasses[:numfused]!=classes[i]]=0
+            best=int(np.argmax(iou))
+            if not iou[best]>IOUthresh:
+                best=-1
+        if best<0:
+            best=numfused
+            fusedclasses[best]=classes[i]
+            numfused+=1
+        coordsum[best]+=scores[i]*boxes[i]
+        scoresum[best]+=scores[i]
+        count[best]+=1
+        if scoresum[best]>0:
+            fusedboxes[best]=coordsum[best]/scoresum[best]
+        else:
+            fusedboxes[best]=boxes[i]
+    
+    fusedscores=scoresum[:numfused]/np.maximum(count[:numfused],1)
+    for i in np.argsort(-fusedscores,kind='stable'):
+        NMSed_list.append([fusedboxes[i][0],
+                           fusedboxes[i][1],
+                           fusedboxes[i][2],
+                           fusedboxes[i][3],
+                           fusedscores[i],
+                           fusedclasses[i]
+                           ])
+    return NMSed_list
+
+def nonMaximumSupression(boxlist,clipthresh=0.05,IOUthresh=0.5,mode='greedy'):
+    """
+    run one of NMS_MODES on a sorted boxlist
+    
+    Args:
+        boxlist: list or array of [y_min, x_min, y_max, x_max, highest_score,
+            predicted_class], format [N,6], e.g. output of sortByScore
+        mode: 'greedy', 'soft_linear', 'soft_gaussian' or 'wbf'
+    Returns:
+        NMSed_list: list of [y_min, x_min, y_max, x_max, score, 
+            predicted_class]
+    """
+    if mode=='greedy':
+        return greedyNonMaximumSupression(boxlist,clipthresh=clipthresh,IOUthresh=IOUthresh)
+    elif mode=='soft_linear':
+        return softNonMaximumSupression(boxlist,clipthresh=clipthresh,
+                                        IOUthresh=IOUthresh,method='linear')
+    elif mode=='soft_gaussian':
+        return softNonMaximumSupression(boxlist,clipthresh=clipthresh,
+                                        IOUthresh=IOUthresh,method='gaussian')
+    elif mode=='wbf':
+        return weightedBoxFusion(boxlist,clipthresh=clipthresh,IOUthresh=IOUthresh)
+    else:
+        raise ValueError('unknown NMS mode {}, use one of {}'.format(mode,NMS_MODES))
+
+def nonMaximumSupressionArray(boxes,scores,clipthresh=0.05,IOUthresh=0.5,
+                              mode='greedy',max_candidates=None):
+    """
+    run one of NMS_MODES on the raw output of the model, 'greedy' is the same
+    as greedyNonMaximumSupressionArray
+    
+    Args:
+        boxes: raw box locations, format [N,4]
+        scores: raw box scores, format [N,q]
+        mode: 'greedy', 'soft_linear', 'soft_gaussian' or 'wbf'
+        max_candidates: if not None, only the top max_candidates boxes are
+            used for NMS
+    Returns:
+        NMSed_list: list of [y_min, x_min, y_max, x_max, score, 
+            predicted_class]
+    """
+    if mode=='greedy':
+        return greedyNonMaximumSupressionArray(boxes,scores,clipthresh=clipthresh,
+                                               IOUthresh=IOUthresh,
+                                               max_candidates=max_candidates)
+    if mode not in NMS_MODES:
+        raise ValueError('unknown NMS mode {}, use one of {}'.format(mode,NMS_MODES))
+    if len(boxes)==0:
+        return []
+    
+    sortedboxes, sortedscores, sortedclasses, _ = sortByScoreArray(scores,boxes,
+                                                    clipthresh=clipthresh,
+                                                    max_candidates=max_candidates)
+    boxlist=np.concatenate([sortedboxes,sortedscores[:,None],sortedclasses[:,None]],axis=1)
+    return nonMaximumSupression(boxlist,clipthresh=clipthresh,IOUthresh=IOUthresh,mode=mode)
+    
+
 if __name__=='__main__':
     boxes=np.load('boxes.npy')[0]
     scores=np.load('scores.npy')[0]
@@ -150,6 +555,10 @@ if __name__=='__main__':
                 img_raw) # don't save it in png!!!
     
     NMSed_list = greedyNonMaximumSupression(boxlist,clipthresh=clipthresh,IOUthresh=IOUthresh)
+    NMSed_array, pruned = greedyNonMaximumSupressionArray(boxes,scores,
+                                clipthresh=clipthresh,IOUthresh=IOUthresh,
+                                return_pruned=True)
+    print('{} of {} boxes pruned before sorting'.format(pruned,len(boxes)))
     
     img=cv2.imread('D:/Private Manager/Personal File/uOttawa/Lab works/2018 fall/BerkleyDeepDrive/debug/bdd100k/images/100k/val/b1ceb32e-3f481b43_crop.jpg')
     
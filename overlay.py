@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+draw the detection / tracking results and the danger level on the frames
+
+these used to be done inside drawBBoxNSave and drawBBoxNSave_Track of
+model_test.py for every frame. they are kept here without any dependency on
+tensorflow, so the overlays could also be rebuilt later from the saved json
+files by render_overlays.py
+"""
+
+import os
+import cv2
+
+DANGER_LEVELS=('Low','Medium','High')
+
+
+def getDangerLevel(dist,t,last_dist,last_t,abs_dist_only=True,timeahead=0.6):
+    """
+    get the danger level according to absolute distance and high acceleration
+    the distance unit is milimeters, time unit is seconds. always return the
+    higher danger level
+
+    input:
+        dist/last_dist: distance for current frame/last frame
+        t/last_t: detection time for current frame/last frame
+        abs_dist_only: if true, use absolute distance only
+
+    output:
+        danger level in string, one of DANGER_LEVELS
+
+    """
+    # danger lvl from absolute dist
+    if dist<4000:
+        lvl=2
+    elif dist<8000:
+        lvl=1
+    else:
+        lvl=0
+
+    # acceleration
+    if not abs_dist_only:
+        predict_dist=(dist-last_dist)/t*timeahead+dist
+        if predict_dist<0:
+            lvl=max(2,lvl)
+        elif predict_dist>8000:
+            lvl=max(0,lvl)
+        else:
+            lvl=max(1,lvl)
+
+    return DANGER_LEVELS[lvl]
+
+def raiseAlert(dist,t,last_dist,last_t,img,abs_dist_only=True,timeahead=0.6):
+    """
+    raise alert according to absolute distance and high acceleration, see
+    getDangerLevel
+
+    output:
+        level: danger level in string
+        img: put text on img
+
+    note that the t/last is inference time when debugging with PC, when using
+    phone app, they should be interval between shooting two input frames
+
+    """
+    level=getDangerLevel(dist,t,last_dist,last_t,
+                         abs_dist_only=abs_dist_only,timeahead=timeahead)
+    cv2.putText(img, 'Danger:{}'.format(level),
+                (4,472),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.5, (255,255,255), 1,
+                lineType=cv2.LINE_AA)
+    return level,img
+
+def renderDetectionOverlay(image_np,annotations,drawside=False,
+                           show_leading=False,show_width=False):
+    """
+    draw the detected vehicles on the frame
+
+    input:
+        image_np: h*w*3 uint8 in RGB color space
+        annotations: annotations of the frame in VIVA format
+        drawside: draw the sideway vehicles in green if true
+        show_leading: draw the leading vehicle in red if true, green if false
+        show_width: put the width of the leading vehicle in pixels on it
+    output:
+        img: h*w*3 uint8 in BGR color space
+
+    """
+    img=cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+    font=cv2.FONT_HERSHEY_SIMPLEX
+    linetype=cv2.LINE_AA
+    linewidth=2
+    for anno in annotations:
+        tl=(anno['x'],anno['y'])
+        br=(anno['x']+anno['width'],anno['y']+anno['height'])
+        if anno['category']=='leading':
+            # draw leading car in red
+            if show_leading:
+                img=cv2.rectangle(img,tl,br,(0,0,255),linewidth) # red
+            else:
+                img=cv2.rectangle(img,tl,br,(0,255,0),linewidth) # green
+            if show_width:
+                bl=(anno['x'],anno['y']+anno['height']-4)
+                cv2.putText(img, 'w={} pels'.format(anno['width']), bl, font, 0.5, (255,255,255), 1, lineType=linetype)
+        elif drawside:
+            # draw sideway cars in green
+            img=cv2.rectangle(img,tl,br,(0,255,0),linewidth) # green
+    return img
+
+def renderTrackOverlay(image_np,bbox,distance=None,last_dist=20000):
+    """
+    draw the tracked leading vehicle, the danger level and the distance
+
+    input:
+        image_np: h*w*3 uint8 in RGB color space
+        bbox: (x,y,width,height) of the leading vehicle, width is 0 if no
+            leading vehicle
+        distance: distance of the leading vehicle, no alert and distance are
+            drawn if None
+        last_dist: distance of the last frame
+    output:
+        img: h*w*3 uint8 in BGR color space
+
+    """
+    img=cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+    font=cv2.FONT_HERSHEY_SIMPLEX
+    linetype=cv2.LINE_AA
+    tl=(int(bbox[0]),int(bbox[1]))
+    br=(int(bbox[0]+bbox[2]),int(bbox[1]+bbox[3]))
+    if bbox[2]!=0:
+        img=cv2.rectangle(img,tl,br,(0,0,255),2) # red
+        if distance is not None:
+            # use real detection time for real camera-captured video, for our
+            # demo, however, the video are all of 10 fps sample frequency
+            _,img=raiseAlert(distance,0.1,last_dist,0.1,
+                              img,abs_dist_only=False)
+            cv2.putText(img, 'Distance: {:.1f}m'.format(distance/1000), (4,456), font, 0.5, (255,255,255), 1, lineType=linetype)
+    return img
+
+def saveOverlay(img,savepath,imagename):
+    """
+    save the frame with overlay as <imagename>_leadingdetect.jpg
+
+    """
+    cv2.imwrite(os.path.join(savepath,imagename.split('.')[0]+'_leadingdetect.jpg'),img) # don't save it in png!!!
+
+''' End of File '''
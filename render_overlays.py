@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+render the _leadingdetect.jpg overlays from the saved json files of
+model_test.py, instead of drawing them while the model runs
+
+model_test.py with --headless True only saves annotation_<folder>_<mode>.json,
+distance_<folder>_<mode><code>.json and alert_<folder>_<mode><code>.json, this
+script draws the same images afterwards on a pool of threads, only for the
+folders asked for. tensorflow is not needed. the results of a run with
+--stream_output True (.ndjson) are read as well.
+
+note that the tracked boxes are saved rounded in the annotation, so the
+rebuilt tracking overlays could differ by one pixel from the ones drawn
+during tracking.
+
+usage example:
+    python3 render_overlays.py --testimg_path /YOUR/TEST/FOLDER
+    --folder_only 3652 --mode tracking --calibration_code _190
+"""
+
+import os
+import time
+import argparse
+
+import frame_pipeline
+from result_stream import loadResults, toNDJSONPath
+from image_loader import readImage
+from overlay import renderDetectionOverlay, renderTrackOverlay, saveOverlay
+
+
+def getLeadingBBox(annotations):
+    """
+    get (x,y,width,height) of the leading vehicle, all zeros if no leading
+    vehicle, the same as the bbox used by the tracker
+
+    """
+    for anno in annotations:
+        if anno['category']=='leading':
+            return (anno['x'],anno['y'],anno['width'],anno['height'])
+    return (0,0,0,0)
+
+def renderFrame(imagepath,savepath,imagename,annotations,mode='detection',
+                distance=None,last_dist=20000,drawside=True,
+                show_leading=True,show_width=False):
+    """
+    decode a single frame, draw the overlay and save it
+
+    output:
+        True if saved, False if the frame can't be decoded
+    """
+    _, image_np = readImage(os.path.join(imagepath,imagename))
+    if image_np is None:
+        return False
+    if mode=='detection':
+        img=renderDetectionOverlay(image_np,annotations,drawside=drawside,
+                                   show_leading=show_leading,
+                                   show_width=show_width)
+    else:
+        img=renderTrackOverlay(image_np,getLeadingBBox(annotations),
+                               distance=distance,last_dist=last_dist)
+    saveOverlay(img,savepath,imagename)
+    return True
+
+def renderFolder(testimgpath,folder,mode='detection',calibration_code='',
+                 num_workers=4,drawside=True,show_leading=True,
+                 show_width=False):
+    """
+    render the overlays of all the frames of a folder in its annotation json
+
+    input:
+        testimgpath: the testimg_path given to model_test.py
+        folder: name of the folder
+        mode: 'detection' or 'tracking'
+        calibration_code: suffix of the distance json, used in tracking mode
+        num_workers: threads decoding, drawing and saving the frames
+    output:
+        number of frames saved
+    """
+    annotationdict=loadResults(os.path.join(testimgpath,
+                               'annotation_{}_{}.json'.format(folder,mode)))
+    distlist={}
+    if mode=='tracking':
+        distpath=os.path.join(testimgpath,'distance_{}_tracking{}.json'.format(folder,calibration_code))
+        if os.path.exists(distpath) or os.path.exists(toNDJSONPath(distpath)):
+            distlist=loadResults(distpath)
+
+    imagepath=os.path.join(testimgpath,folder)
+    savepath=os.path.join(imagepath,'leadingdetect')
+    if not os.path.exists(savepath):
+        os.makedirs(savepath)
+
+    futures=[]
+    last_dist=20000
+    with frame_pipeline.StageWorker(num_workers=num_workers,
+                                    max_pending=4*max(1,num_workers)) as renderer:
+        # the danger level of a frame depends on the distance of the frame
+        # before it, so the frames are walked in order
+        for imagename in frame_pipeline.sortFrames(annotationdict):
+            dist=distlist.get(imagename,999999)
+            futures.append(renderer.submit(renderFrame,imagepath,savepath,
+                                           imagename,
+                                           annotationdict[imagename]['annotations'],
+                                           mode=mode,
+                                           distance=None if dist==999999 else dist,
+                                           last_dist=last_dist,
+                                           drawside=drawside,
+                                           show_leading=show_leading,
+                                           show_width=show_width))
+            last_dist=dist
+        renderer.join()
+    return sum(future.result() for future in futures)
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--testimg_path',type=str,
+                        default='D:/Private Manager/Personal File/uOttawa/Lab works/2018 summer/Leading Vehicle/Viewnyx dataset/Part4_ACC',
+                        help='the testimg_path used by model_test.py')
+    parser.add_argument('--folder_only', type=str, default='3652',
+                        help="render the folders with 'A String' in its name \
+                        only, set this as '' to render all the folders")
+    parser.add_argument('--mode',type=str,default='detection',
+                        choices=['detection','tracking'],
+                        help='render the results of detection or tracking')
+    parser.add_argument('--calibration_code',type=str,default='',
+                        help='suffix of the distance json files, e.g. \
+                        _190 for viewnyx_190.txt, used for the danger levels in tracking mode')
+    parser.add_argument('--num_workers',type=int,default=4,
+                        help='threads rendering the frames. default is 4')
+    parser.add_argument('--drawside',type=bool,default=True,
+                        help='draw the sideway vehicles in detection mode')
+    parser.add_argument('--show_leading',type=bool,default=True,
+                        help='show leading vehicle in red bbox if true, in green if false.')
+    parser.add_argument('--show_width',type=bool,default=False,
+                        help='put the width of the leading vehicle on it in \
+                        detection mode, the same as running with a camera calibration')
+    args = parser.parse_args()
+
+    testimgpath=args.testimg_path
+    suffixes=['_{}.json'.format(args.mode),'_{}.ndjson'.format(args.mode)]
+    folders=set()
+    for filename in os.listdir(testimgpath):
+        # annotation_<folder>_<mode>.json, or .ndjson with --stream_output
+        if not filename.startswith('annotation_'):
+            continue
+        for suffix in suffixes:
+            if filename.endswith(suffix):
+                folders.add(filename[len('annotation_'):-len(suffix)])
+    for folder in sorted(folders):
+        if args.folder_only!='' and args.folder_only not in folder:
+            continue
+        if not os.path.isdir(os.path.join(testimgpath,folder)):
+            continue
+        starttime=time.time()
+        count=renderFolder(testimgpath,folder,mode=args.mode,
+                           calibration_code=args.calibration_code,
+                           num_workers=args.num_workers,
+                           drawside=args.drawside,
+                           show_leading=args.show_leading,
+                           show_width=args.show_width)
+        print('{}: {} frames rendered in {:.2f} s'.format(folder,count,
+              time.time()-starttime))
+
+''' End of File '''
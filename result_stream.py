@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+write per-frame results as newline-delimited json (.ndjson), one record per
+frame, instead of one big pretty-printed json per folder
+
+each line is {"name": imagename, "value": ...}. the file is flushed to disk
+every flush_every records, then a checkpoint <file>.ckpt is saved with the
+byte offset and the number of records written so far. a crashed run loses at
+most the records after the last checkpoint, and a resumed writer cuts the file
+back to the checkpoint before appending.
+
+loadResults() reads both .json and .ndjson into the old dict shape
+{imagename: value}, so the evaluation scripts work with either.
+
+usage example:
+    with NDJSONWriter('/PATH/annotation_VNX_3652_detection.ndjson') as writer:
+        writer.write(imagename, annotationdict[imagename])
+    annotationdict = loadResults('/PATH/annotation_VNX_3652_detection.json')
+"""
+
+import os
+import json
+import threading
+
+
+def getCheckpointPath(filepath):
+    return filepath+'.ckpt'
+
+def loadCheckpoint(filepath):
+    """
+    load the checkpoint of an .ndjson file
+
+    output:
+        {'offset': bytes of complete records, 'records': number of records},
+        None if there is no checkpoint
+    """
+    ckptpath=getCheckpointPath(filepath)
+    if not os.path.exists(ckptpath):
+        return None
+    try:
+        return json.load(open(ckptpath))
+    except ValueError:
+        return None # killed while writing, should not happen with os.replace
+
+def toNDJSONPath(filepath):
+    """
+    annotation_x.json -> annotation_x.ndjson
+
+    """
+    if filepath.endswith('.json'):
+        return filepath[:-len('.json')]+'.ndjson'
+    return filepath
+
+def toJSONPath(filepath):
+    """
+    annotation_x.ndjson -> annotation_x.json
+
+    """
+    if filepath.endswith('.ndjson'):
+        return filepath[:-len('.ndjson')]+'.json'
+    return filepath
+
+
+class NDJSONWriter():
+    """
+    append one json record per frame, with periodic flush and checkpoint.
+    write() could be called from several threads
+
+    """
+    def __init__(self, filepath, flush_every=100, resume=False):
+        """
+        input:
+            filepath: path of the .ndjson file
+            flush_every: flush and save the checkpoint every N records
+            resume: if true, keep the records up to the checkpoint and append
+                after them, otherwise start a new file
+
+        """
+        self.filepath=filepath
+        self.flush_every=max(1,flush_every)
+        self.lock=threading.Lock()
+        self.records=0
+        self.pending=0
+        self.done=set() # names of the records kept from the last run
+
+        ckpt=loadCheckpoint(filepath) if resume else None
+        if ckpt is not None and os.path.exists(filepath):
+            # cut off the records written after the last checkpoint, they
+            # might be incomplete
+            self.fid=open(filepath,'r+b')
+            self.fid.truncate(ckpt['offset'])
+            self.fid.seek(0)
+            for line in self.fid:
+                self.done.add(json.loads(line.decode('utf-8'))['name'])
+            self.fid.seek(ckpt['offset'])
+            self.records=ckpt['records']
+        else:
+            self.fid=open(filepath,'wb')
+            self._saveCheckpoint()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, name, value):
+        """
+        append the record of a frame
+
+        """
+        line=json.dumps({'name':name,'value':value}, sort_keys=True)+'\n'
+        with self.lock:
+            self.fid.write(line.encode('utf-8'))
+            self.records+=1
+            self.pending+=1
+            if self.pending>=self.flush_every:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.fid.flush()
+        os.fsync(self.fid.fileno())
+        self.pending=0
+        self._saveCheckpoint()
+
+    def _saveCheckpoint(self):
+        ckptpath=getCheckpointPath(self.filepath)
+        tmppath=ckptpath+'.tmp'
+        with open(tmppath,'w') as savefile:
+            savefile.write(json.dumps({'offset':self.fid.tell(),
+                                       'records':self.records}))
+        os.replace(tmppath,ckptpath)
+
+    def close(self):
+        if self.fid is not None:
+            self.flush()
+            self.fid.close()
+            self.fid=None
+
+
+def loadNDJSON(filepath):
+    """
+    load an .ndjson file into {name: value}, an incomplete last line left by
+    a crash is skipped, a later record of the same name replaces the earlier
+
+    """
+    results={}
+    with open(filepath,'rb') as fid:
+        for line in fid:
+            try:
+                record=json.loads(line.decode('utf-8'))
+            except ValueError:
+                continue
+            results[record['name']]=record['value']
+    return results
+
+def openStreams(filepaths, flush_every=100, resume=False):
+    """
+    open an NDJSONWriter for each of the files written together frame by 
+    frame, e.g. the annotation and the distance of a folder
+
+    the files are checkpointed one by one, so a run killed between the 
+    checkpoints leaves a frame in some of the files only. such a frame is 
+    not counted as done, it is done again and its new records replace the 
+    old ones, see loadNDJSON
+
+    output:
+        writers: list of NDJSONWriter, in the order of filepaths
+        done: names of the frames kept in all the files
+    """
+    writers=[NDJSONWriter(filepath, flush_every=flush_every, resume=resume)
+             for filepath in filepaths]
+    done=set.intersection(*[writer.done for writer in writers])
+    return writers, done
+
+def loadDone(filepath, done):
+    """
+    load the records of the frames in done from an .ndjson file, see 
+    openStreams
+
+    """
+    return {name:value for name,value in loadNDJSON(filepath).items()
+            if name in done}
+
+def loadResults(filepath):
+    """
+    load the results of model_test.py in the old dict shape, from either
+    the .json or the .ndjson file. if filepath is a .json which doesn't
+    exist, the .ndjson of the same name is loaded instead
+
+    """
+    if filepath.endswith('.ndjson'):
+        return loadNDJSON(filepath)
+    if not os.path.exists(filepath) and os.path.exists(toNDJSONPath(filepath)):
+        return loadNDJSON(toNDJSONPath(filepath))
+    return json.load(open(filepath))
+
+''' End of File '''
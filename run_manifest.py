@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+manifest of the folders already processed by model_test.py, for incremental
+runs
+
+for each folder the manifest keeps the (mtime, size) of every input frame,
+the output files and the model used. a folder is up to date if its frames
+are the same as in the manifest, the model is the same, and all its outputs
+exist and are newer than every frame. only the new or changed folders are
+processed again.
+
+the workers of model_test.py --workers share one manifest, a finished folder
+is recorded under a lock on <manifest>.lock so they don't drop each other's
+folders.
+"""
+
+import os
+import json
+
+try:
+    import fcntl
+except ImportError:
+    fcntl=None # windows
+    import msvcrt
+
+
+def scanFolder(imagepath):
+    """
+    get the signature of all the frames under a folder, only jpg & png are
+    counted, the same as loadFrameBatches in model_test.py
+
+    output:
+        frames: {imagename: [mtime, size]}
+    """
+    frames={}
+    for imagename in os.listdir(imagepath):
+        if 'jpg' not in imagename and 'png' not in imagename:
+            continue
+        filepath=os.path.join(imagepath,imagename)
+        if not os.path.isfile(filepath):
+            continue
+        stat=os.stat(filepath)
+        frames[imagename]=[stat.st_mtime,stat.st_size]
+    return frames
+
+
+class FileLock():
+    """
+    exclusive lock on a file, shared by processes, e.g.
+        with FileLock(manifestpath+'.lock'):
+            ...
+    the lock is released by the system if the process is killed, so no
+    stale lock is left behind
+
+    """
+    def __init__(self, lockpath):
+        self.lockpath=lockpath
+        self.fid=None
+
+    def __enter__(self):
+        self.fid=open(self.lockpath,'a+')
+        if fcntl is not None:
+            fcntl.flock(self.fid.fileno(),fcntl.LOCK_EX)
+        else:
+            self.fid.seek(0)
+            while True:
+                try:
+                    # LK_LOCK gives up after 10 s
+                    msvcrt.locking(self.fid.fileno(),msvcrt.LK_LOCK,1)
+                    break
+                except OSError:
+                    continue
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl is not None:
+            fcntl.flock(self.fid.fileno(),fcntl.LOCK_UN)
+        else:
+            self.fid.seek(0)
+            msvcrt.locking(self.fid.fileno(),msvcrt.LK_UNLCK,1)
+        self.fid.close()
+        self.fid=None
+
+
+class RunManifest():
+    """
+    {folder: {'model': model hash, 'frames': {imagename: [mtime, size]},
+              'outputs': [filepaths]}} saved in a json file
+
+    """
+    def __init__(self, filepath):
+        self.filepath=filepath
+        if os.path.exists(filepath):
+            self.folders=json.load(open(filepath))
+        else:
+            self.folders={}
+
+    def isUpToDate(self, folder, frames, outputs, model_hash=''):
+        """
+        input:
+            folder: name of the folder
+            frames: output of scanFolder for the folder
+            outputs: filepaths of the outputs of the folder
+            model_hash: hash of the model, e.g. Detector.model_hash
+        output:
+            True if the folder doesn't need to be processed again
+        """
+        entry=self.folders.get(folder)
+        if entry is None:
+            return False
+        if entry['model']!=model_hash or entry['outputs']!=outputs:
+            return False
+        if entry['frames']!=frames:
+            return False
+        # the outputs should be written after all the frames
+        newest=max([mtime for mtime,_ in frames.values()]+[0])
+        for filepath in outputs:
+            if not os.path.exists(filepath) or os.path.getmtime(filepath)<newest:
+                return False
+        return True
+
+    def markDone(self, folder, frames, outputs, model_hash=''):
+        """
+        record a finished folder and save the manifest at once. the read of
+        the folders recorded by other processes since the manifest was 
+        loaded, the update and the save are done under the lock of the 
+        manifest, so the workers of model_test.py --workers sharing one 
+        manifest don't drop each other's folders
+
+        """
+        with FileLock(self.filepath+'.lock'):
+            if os.path.exists(self.filepath):
+                self.folders.update(json.load(open(self.filepath)))
+            self.folders[folder]={'model':model_hash,
+                                  'frames':frames,
+                                  'outputs':outputs}
+            self.save()
+
+    def save(self):
+        tmppath='{}.tmp{}'.format(self.filepath,os.getpid())
+        with open(tmppath,'w') as savefile:
+            savefile.write(json.dumps(self.folders, sort_keys = True, indent = 4))
+        os.replace(tmppath,self.filepath)
+
+''' End of File '''
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+the scripts live at the top level of the repository, put it on the path so
+the tests can import them
+
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+''' End of File '''
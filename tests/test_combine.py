@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+the heavy/light combination of combine_heavy_and_light_network.py with the
+kalman box filter
+
+"""
+
+import pytest
+
+from combine_heavy_and_light_network import (CascadeRule, KalmanBoxFilter,
+                                             combineDetectionResult)
+
+
+def getBox(x, score=0.9, category='leading'):
+    return {'x':x, 'y':100, 'width':50, 'height':40, 'score':score,
+            'category':category}
+
+def getFrame(imgname, annotations):
+    return {'name':imgname, 'width':640, 'height':480,
+            'annotations':annotations}
+
+def test_filter_moves_once_per_frame_without_time_stamps():
+    box_filter=KalmanBoxFilter(motion_model='velocity', dt=0.1)
+    box_filter.update(getBox(0))
+    for k in range(1,6):
+        box_filter.predict()
+        box_filter.update(getBox(10*k))
+        assert box_filter.t==pytest.approx(0.1*k)
+    # without predict() the update moves the state itself
+    box_filter.update(getBox(60))
+    assert box_filter.t==pytest.approx(0.6)
+
+@pytest.mark.parametrize('motion_model', ['velocity','acceleration'])
+def test_rule_moves_once_per_frame_without_index(motion_model):
+    rule=CascadeRule(prediction_fun_order=2, motion_model=motion_model,
+                     frame_interval=0.1)
+    actions=[]
+    for k in range(12):
+        # the rough box jumps away every other frame, so the precise result
+        # is used after the filter has predicted the frame
+        rough=getBox(10*k if k%2==0 else 400)
+        action, merged = rule.decide(rough, None)
+        actions.append(action)
+        final=merged if action=='merge' else getBox(10*k)
+        rule.accept(final, None)
+        assert rule.box_filter.t==pytest.approx(0.1*k)
+    assert 'merge' in actions
+    assert actions[-1]=='precise'
+
+def test_combine_frames_without_index():
+    names=['frame_a.jpg','frame_b.jpg','frame_c.jpg','frame_d.jpg','frame_e.jpg']
+    precise={name:getFrame(name,[getBox(10*k,score=0.99)]) for k,name in enumerate(names)}
+    rough={name:getFrame(name,[getBox(10*k+1),getBox(300,category='sideways')])
+           for k,name in enumerate(names)}
+    combined=combineDetectionResult({'video.json':precise}, {'video.json':rough},
+                                    motion_model='velocity')['video.json']
+    assert sorted(combined)==names
+    # the last frames are merged from the rough detection and the filter
+    leading=[anno for anno in combined['frame_e.jpg']['annotations']
+             if anno['category']=='leading'][0]
+    assert abs(leading['x']-41)<=2
+    assert len(combined['frame_e.jpg']['annotations'])==2
+    # the inputs are not changed
+    assert rough['frame_e.jpg']['annotations'][0]['x']==41
+
+''' End of File '''
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+the detector should not add ops to the graph per frame, otherwise the graph
+and the detection time grow over a folder (see checkGraphGrowth in
+model_performance.py). a small synthetic graph with the outputs of the
+object detection api is run for 1000 frames
+
+"""
+
+import time
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+pytest.importorskip('object_detection')
+
+from detector import Detector
+
+ITERATIONS=1000
+WINDOW=100
+
+
+def buildSyntheticGraph(max_detections=10):
+    """
+    graph with an image_tensor input and the detection outputs, the boxes
+    and scores depend on the image so every run does some work
+
+    """
+    graph=tf.Graph()
+    with graph.as_default():
+        image_tensor=tf.placeholder(tf.uint8, [None,None,None,3], name='image_tensor')
+        mean=tf.reduce_mean(tf.cast(image_tensor,tf.float32), axis=[1,2,3])/255.0
+        batch=tf.shape(image_tensor)[0]
+        tf.tile(tf.reshape(mean,[-1,1,1]), [1,max_detections,4], name='detection_boxes')
+        tf.tile(tf.reshape(mean,[-1,1]), [1,max_detections], name='detection_scores')
+        tf.ones([batch,max_detections], name='detection_classes')
+        tf.fill([batch], float(max_detections), name='num_detections')
+    return graph
+
+def test_graph_and_latency_stay_flat():
+    graph=buildSyntheticGraph()
+    image=np.random.RandomState(0).randint(0,255,(120,160,3)).astype(np.uint8)
+    with Detector(graph=graph) as detector:
+        opcount=len(detector.graph.get_operations())
+        latencylist=[]
+        for _ in range(ITERATIONS):
+            starttime=time.time()
+            output_dict=detector.detect([image], raw=False)[0]
+            latencylist.append(time.time()-starttime)
+        assert output_dict['num_detections']==10
+        assert len(detector.graph.get_operations())==opcount
+
+    # skip the warm-up frame, compare medians so a single slow frame on a
+    # busy machine doesn't fail the test
+    latency=latencylist[1:]
+    early=np.median(latency[:WINDOW])
+    late=np.median(latency[-WINDOW:])
+    assert late<=early*1.5+1e-3
+
+''' End of File '''
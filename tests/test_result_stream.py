@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+resuming the .ndjson streams of model_test.py --stream_output True 
+--incremental True after the run is killed
+
+"""
+
+import os
+
+from result_stream import NDJSONWriter, loadDone, loadResults, openStreams
+
+
+def getFrames(count):
+    return ['VNX_3652_{:05d}.jpg'.format(i) for i in range(count)]
+
+def runFrames(streams, frames):
+    """
+    write the annotation and the distance of each frame, in the same order
+    as model_test.py
+
+    """
+    annowriter, distwriter = streams
+    for imagename in frames:
+        annowriter.write(imagename, {'name': imagename, 'annotations': []})
+        distwriter.write(imagename, float(len(imagename)))
+
+def killRun(streams):
+    """
+    drop the writers without the final flush and checkpoint, the records 
+    after the last checkpoint of each file are lost on resume
+
+    """
+    for writer in streams:
+        writer.fid.close()
+        writer.fid=None
+
+def test_resume_after_kill_between_checkpoints(tmp_path):
+    outputs=[os.path.join(str(tmp_path), 'annotation_VNX_3652_detection.ndjson'),
+             os.path.join(str(tmp_path), 'distance_VNX_3652_detection_190.ndjson')]
+    frames=getFrames(10)
+
+    # the annotation stream is checkpointed after every frame, the distance
+    # stream every 4 frames, so the run is killed after frame 9 is in the
+    # annotation checkpoint but not in the distance one
+    streams=[NDJSONWriter(outputs[0], flush_every=1),
+             NDJSONWriter(outputs[1], flush_every=4)]
+    runFrames(streams, frames)
+    killRun(streams)
+
+    streams, done = openStreams(outputs, flush_every=4, resume=True)
+    assert len(streams[0].done)==10
+    assert len(streams[1].done)==8
+    assert done==set(frames[:8])
+    assert set(loadDone(outputs[0], done))==done
+    assert set(loadDone(outputs[1], done))==done
+
+    # the resumed run does the frames which are not in both streams
+    runFrames(streams, [imagename for imagename in frames if imagename not in done])
+    for writer in streams:
+        writer.close()
+
+    annotationdict=loadResults(outputs[0])
+    distlist=loadResults(outputs[1])
+    assert sorted(annotationdict)==frames
+    assert sorted(distlist)==frames
+    assert distlist[frames[9]]==float(len(frames[9]))
+
+def test_new_run_has_nothing_done(tmp_path):
+    outputs=[os.path.join(str(tmp_path), 'annotation.ndjson'),
+             os.path.join(str(tmp_path), 'distance.ndjson')]
+    streams=[NDJSONWriter(outputs[0]), NDJSONWriter(outputs[1])]
+    runFrames(streams, getFrames(3))
+    for writer in streams:
+        writer.close()
+
+    streams, done = openStreams(outputs, resume=False)
+    assert done==set()
+    for writer in streams:
+        writer.close()
+    assert loadResults(outputs[0])=={}
+
+''' End of File '''
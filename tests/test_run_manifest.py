@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+the manifest of model_test.py --incremental True, shared by the workers of
+--workers
+
+"""
+
+import os
+import multiprocessing
+
+from run_manifest import RunManifest, scanFolder
+
+WORKERS=4
+FOLDERS=25
+
+
+def markFolders(manifestpath, worker_id):
+    """
+    a worker which loaded the manifest before the others wrote to it
+
+    """
+    manifest=RunManifest(manifestpath)
+    for i in range(FOLDERS):
+        manifest.markDone('VNX_{}_{}'.format(worker_id,i), {}, [], 'model')
+
+def test_workers_keep_each_others_folders(tmp_path):
+    manifestpath=os.path.join(str(tmp_path), 'manifest_detection.json')
+    context=multiprocessing.get_context('spawn')
+    processes=[context.Process(target=markFolders, args=(manifestpath,i))
+               for i in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode==0
+
+    manifest=RunManifest(manifestpath)
+    assert len(manifest.folders)==WORKERS*FOLDERS
+
+def test_changed_folder_is_not_up_to_date(tmp_path):
+    imagepath=tmp_path / 'VNX_3652'
+    imagepath.mkdir()
+    (imagepath / 'VNX_3652_00001.jpg').write_bytes(b'frame')
+    output=tmp_path / 'annotation_VNX_3652_detection.json'
+    frames=scanFolder(str(imagepath))
+
+    manifest=RunManifest(os.path.join(str(tmp_path), 'manifest_detection.json'))
+    output.write_text('{}')
+    os.utime(str(output), (frames['VNX_3652_00001.jpg'][0]+1,)*2)
+    manifest.markDone('VNX_3652', frames, [str(output)], 'model')
+    assert manifest.isUpToDate('VNX_3652', frames, [str(output)], 'model')
+    assert not manifest.isUpToDate('VNX_3652', frames, [str(output)], 'other model')
+
+    (imagepath / 'VNX_3652_00002.jpg').write_bytes(b'frame')
+    assert not manifest.isUpToDate('VNX_3652', scanFolder(str(imagepath)),
+                                   [str(output)], 'model')
+
+''' End of File '''
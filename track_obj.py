@@ -9,13 +9,21 @@ frame.
 
 further more, it's possible the apply multi-threads to boost the app, e.g. one
 tracking thread, one detection thread, then update the tracking feature from 
-the last detection result.
+the last detection result. this is done by AsyncDetectTracker, the tracker
+gives a box for every frame on the calling thread, while the detection runs on
+a background thread on the latest frame.
 
 @author: Wen Wen
 """
 import cv2
 import os
 import time
+import numpy as np
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from iou_matrix import getIoUMatrix
 
 tracker_types = ['MIL',
                  'KCF', 
@@ -25,6 +33,25 @@ tracker_types = ['MIL',
                  'CSRT']
 #cwd=os.getcwd()
 medianflowparams = 'trackermedianflow.json'
+# content of the parameter files, read from disk only once
+trackerparams = {}
+
+
+def loadTrackerParams(filepath):
+    """
+    read a tracker parameter file once and keep its content in memory, so
+    building a tracker never touches the disk again
+    
+    output:
+        the content of the file, None if the file doesn't exist
+    """
+    if filepath not in trackerparams:
+        if os.path.exists(filepath):
+            with open(filepath) as fid:
+                trackerparams[filepath]=fid.read()
+        else:
+            trackerparams[filepath]=None
+    return trackerparams[filepath]
 
 
 class ObjTracker():
@@ -49,17 +76,23 @@ class ObjTracker():
                 self.tracker = cv2.TrackerTLD_create() # FP when object is gone, some issue when adjust bbx
             if self.trackertype == 'MEDIANFLOW':
                 self.tracker = cv2.TrackerMedianFlow_create() # best one
-                if medianflowparams:
-                    fs = cv2.FileStorage(medianflowparams,cv2.FILE_STORAGE_READ)
+                params = loadTrackerParams(medianflowparams) if medianflowparams else None
+                if params:
+                    # parse the parameters from memory
+                    fs = cv2.FileStorage(params,cv2.FILE_STORAGE_READ | cv2.FILE_STORAGE_MEMORY)
                     fn = fs.getFirstTopLevelNode()
                     self.tracker.read(fn)
-                    self.tracker.save('loaded_tracker_params.json')
             if self.trackertype == 'MOSSE':
                 self.tracker = cv2.TrackerMOSSE_create() # when the size doesnt change, it's the fastest
             if self.trackertype == "CSRT":
                 self.tracker = cv2.TrackerCSRT_create() # not good, doesnt adjust bbox
     
     def refreshTracker(self):
+        """
+        build a new tracker of the same type, an opencv tracker can't be
+        initialized twice. the parameters come from memory
+        
+        """
         if self.trackertype==None:
             raise ValueError('invalid tracker type')
         self.buildTracker(tracker_type=self.trackertype)
@@ -95,6 +128,222 @@ class ObjTracker():
         
         return flag, bbox, tracktime
 
+
+class AsyncDetectTracker():
+    """
+    track on the calling thread, detect on a background thread
+    
+    only one detection runs at a time, started on the latest frame once the
+    last one finished. when the detection of frame k finishes at frame n, the
+    tracker is initialized on frame k with the detected box, then run over
+    the frames k+1...n-1 kept since, so the box is brought up to date instead
+    of being n-k frames late (latency compensation). the time per frame on
+    the calling thread is the cost of the tracker, plus the catching up when
+    a detection arrives
+    
+    only the last max_replay+1 frames are kept, so a slow detection costs at
+    most max_replay extra tracker updates on the frame it arrives. if more
+    frames passed, the tracker is initialized on the oldest frame kept, a 
+    few frames after the detected one
+    
+    """
+    def __init__(self, detectfunc, tracker_type='MEDIANFLOW', compensate=True,
+                 max_replay=5):
+        """
+        input:
+            detectfunc: detectfunc(*args) returns the (xmin,ymin,width,height)
+                of the leading vehicle, None if there is no leading vehicle.
+                runs on the background thread
+            tracker_type: one of tracker_types
+            compensate: if false, the tracker is initialized with the late 
+                box on the last frame, without catching up
+            max_replay: max frames replayed when a detection arrives
+        
+        """
+        self.detectfunc=detectfunc
+        self.compensate=compensate
+        self.max_replay=max_replay if compensate else 0
+        self.objtracker=ObjTracker()
+        self.objtracker.buildTracker(tracker_type)
+        self.pool=ThreadPoolExecutor(max_workers=1)
+        self.future=None
+        self.reset()
+    
+    def reset(self):
+        """
+        drop the target and wait for the detection in flight, e.g. before a 
+        new video
+        
+        """
+        if self.future is not None:
+            self.future.result()
+        self.future=None
+        # frames since the frame of the detection in flight, the last 
+        # max_replay+1 of them
+        self.history=deque(maxlen=self.max_replay+1)
+        self.solid=False
+        self.bbox=(0,0,0,0)
+    
+    def close(self):
+        self.reset()
+        self.pool.shutdown(wait=True)
+    
+    def _refresh(self, bbox):
+        """
+        re-initialize the tracker with the detected box on the detected frame,
+        then catch up to the last frame. the detected frame could have been
+        dropped from the history already, see max_replay
+        
+        """
+        self.objtracker.refreshTracker()
+        history=iter(self.history)
+        self.objtracker.updateTrack(next(history),init=True,bbox=bbox)
+        flag=True
+        for img in history:
+            flag, bbox, _ = self.objtracker.updateTrack(img)
+            if not flag:
+                break
+        return flag, bbox
+    
+    def update(self, img, *args):
+        """
+        get the box of the leading vehicle in a frame
+        
+        input:
+            img: the frame for the tracker, in BGR color space
+            args: arguments of detectfunc for this frame, a detection is
+                started on this frame if none is running
+        output:
+            flag: True if the leading vehicle is tracked in this frame
+            bbox: (xmin,ymin,width,height), (0,0,0,0) if flag is False
+            tracktime: time used on the calling thread
+            refreshed: True if a detection finished and refreshed the 
+                tracker on this frame
+        
+        """
+        start=time.time()
+        refreshed=False
+        if self.future is not None and self.future.done():
+            detected=self.future.result()
+            if detected is None:
+                self.solid=False
+            else:
+                self.solid, self.bbox = self._refresh(detected)
+            self.future=None
+            refreshed=True
+        
+        if self.solid:
+            self.solid, self.bbox, _ = self.objtracker.updateTrack(img)
+        if not self.solid:
+            self.bbox=(0,0,0,0)
+        
+        if self.future is None:
+            self.future=self.pool.submit(self.detectfunc,*args)
+            self.history.clear()
+            self.history.append(img)
+        else:
+            self.history.append(img)
+        return self.solid, self.bbox, time.time()-start, refreshed
+
+
+class MultiObjTracker():
+    """
+    track all the detected vehicles, one ObjTracker for each
+    
+    on a detection frame, the detections are assigned to the tracks by the
+    Hungarian algorithm on the IoU cost matrix, so a vehicle keeps its track
+    id. between detection frames every track is propagated by its own 
+    tracker, and a track is dropped when its tracker is lost
+    
+    """
+    def __init__(self, tracker_type='MEDIANFLOW', IOUthresh=0.3):
+        """
+        input:
+            tracker_type: one of tracker_types
+            IOUthresh: min IoU of a detection and a track to be assigned
+        
+        """
+        self.tracker_type=tracker_type
+        self.IOUthresh=IOUthresh
+        self.reset()
+    
+    def reset(self):
+        # tracks: list of {'id', 'bbox':(x,y,w,h), 'label', 'tracker'}
+        self.tracks=[]
+        self.nextid=0
+    
+    def _newTracker(self, img, bbox):
+        objtracker=ObjTracker()
+        objtracker.buildTracker(self.tracker_type)
+        objtracker.updateTrack(img,init=True,bbox=tuple(bbox))
+        return objtracker
+    
+    def assign(self, detections):
+        """
+        assign the detections to the current tracks
+        
+        input:
+            detections: list of (xmin,ymin,width,height)
+        output:
+            matches: list of (track index, detection index)
+        """
+        if len(self.tracks)==0 or len(detections)==0:
+            return []
+        # only the multi-object tracking needs scipy
+        from scipy.optimize import linear_sum_assignment
+        iou=getIoUMatrix([track['bbox'] for track in self.tracks],detections)
+        rows,cols=linear_sum_assignment(1-iou)
+        return [(r,c) for r,c in zip(rows,cols) if iou[r,c]>=self.IOUthresh]
+    
+    def refresh(self, img, annotations):
+        """
+        restart the tracks from the detections of a frame, a detection
+        assigned to a track keeps the id of the track, the others start new
+        tracks, and the tracks without a detection are dropped
+        
+        input:
+            img: the frame, in BGR color space
+            annotations: the detections, in VIVA annotation format
+        output:
+            tracks: the current tracks
+        """
+        annotations=[anno for anno in annotations 
+                     if anno['width']>0 and anno['height']>0]
+        detections=[(anno['x'],anno['y'],anno['width'],anno['height']) 
+                    for anno in annotations]
+        ids={c:self.tracks[r]['id'] for r,c in self.assign(detections)}
+        tracks=[]
+        for i,anno in enumerate(annotations):
+            if i in ids:
+                trackid=ids[i]
+            else:
+                trackid=self.nextid
+                self.nextid+=1
+            tracks.append({'id':trackid,
+                           'bbox':detections[i],
+                           'label':anno.get('label','car'),
+                           'tracker':self._newTracker(img,detections[i])})
+        self.tracks=tracks
+        return self.tracks
+    
+    def update(self, img):
+        """
+        propagate all the tracks to a new frame
+        
+        output:
+            tracks: the tracks still alive
+            tracktime: time used for tracking
+        """
+        start=time.time()
+        alive=[]
+        for track in self.tracks:
+            flag, bbox, _ = track['tracker'].updateTrack(img)
+            if flag:
+                track['bbox']=tuple(bbox)
+                alive.append(track)
+        self.tracks=alive
+        return self.tracks, time.time()-start
+
 if __name__=='__main__':
     imgpath='D:/Private Manager/Personal File/uOttawa/Lab works/2018 summer/Leading Vehicle/Viewnyx dataset/Part3_videoframes/VNX_10009'
     bench=(304,192,331-304,218-192)